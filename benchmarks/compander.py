@@ -0,0 +1,72 @@
+"""
+Native compander vs the sox subprocess.
+
+Times scripts.compander.compand on a synthetic guitar-like take with both
+backends and reports how far the native output is from sox's.
+
+    python -m benchmarks.compander [--seconds 60] [--sr 44100] [--repeat 3] [--level-db 0]
+
+--level-db sets the take's peak level; around -58 its envelope sits in the
+transfer curve's knees.
+
+The sox backend is skipped when the sox binary is not on PATH.
+"""
+import argparse
+import json
+import shutil
+import time
+
+import numpy as np
+
+from benchmarks.signals import plucked_take
+from scripts import compander
+
+
+def timed(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--sr", type=int, default=44100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--level-db", type=float, default=0.0, help="peak level of the take")
+    args = parser.parse_args()
+
+    signal = plucked_take(args.seconds, args.sr) * np.float32(10 ** (args.level_db / 20))
+    report = {"seconds": args.seconds, "sr": args.sr, "level_db": args.level_db}
+
+    native_time, native = timed(lambda: compander.compand(signal, args.sr, backend="native"), args.repeat)
+    report["native_s"] = round(native_time, 4)
+    report["native_x_realtime"] = round(args.seconds / native_time, 1)
+
+    if shutil.which("sox"):
+        sox_time, sox = timed(lambda: compander.compand(signal, args.sr, backend="sox"), args.repeat)
+        report["sox_s"] = round(sox_time, 4)
+        report["speedup"] = round(sox_time / native_time, 2)
+
+        n = min(len(native), len(sox))
+        difference = native[:n].astype(np.float64) - sox[:n]
+        reference_rms = np.sqrt(np.mean(np.square(sox[:n], dtype=np.float64)))
+        report["max_abs_diff"] = float(np.max(np.abs(difference)))
+        report["diff_db_below_sox"] = round(float(20 * np.log10(
+            reference_rms / (np.sqrt(np.mean(difference ** 2)) + 1e-12))), 2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            gain_error = 20 * np.log10(np.abs(native[:n]) / np.abs(sox[:n]))
+        gain_error = gain_error[np.isfinite(gain_error) & (np.abs(sox[:n]) > 1e-3)]
+        report["median_gain_error_db"] = round(float(np.median(gain_error)), 3) if len(gain_error) else None
+    else:
+        report["sox_s"] = None
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
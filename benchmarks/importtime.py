@@ -0,0 +1,166 @@
+"""
+Import cost of the server and worker entry points, from `python -X importtime`.
+
+    python -m benchmarks.importtime run [--modules src.main,scripts.dsp] [--repeat 5] [--out imports.json]
+    python -m benchmarks.importtime compare base.json new.json [--threshold 1.2]
+
+Each module is imported --repeat times, every time in a fresh interpreter, and
+the fastest run is kept. For every module the report has:
+
+- import_ms: the cumulative import time of the module itself
+- total_ms: every import the interpreter made, including its own start-up
+- wall_ms: the wall time of the whole `python -c "import module"` process
+- packages: self time per top-level package (scipy, librosa, fastapi, ...),
+  the --top heaviest
+
+compare prints the new/base import_ms ratio of every module both reports
+have and exits with 1 when one is above --threshold and more than
+MIN_DELTA_MS slower.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# Server start-up, the render worker and the modules they pull in
+DEFAULT_MODULES = ("src.main", "src.jobs", "scripts.retrieveEffects", "scripts.audiotest", "scripts.dsp",
+                   "scripts.analysis", "scripts.streaming", "scripts.warmup")
+# Smaller slowdowns are within run-to-run noise
+MIN_DELTA_MS = 20.0
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(stderr):
+    """
+    `-X importtime` output -> [(name, self_us, cumulative_us, depth)] in output order.
+    depth 0 is a top-level import; other lines (warnings) are skipped.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def import_once(module):
+    """Import module in a fresh interpreter; returns (wall seconds, importtime rows, error or None)."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.getenv("PYTHONPATH")]))}
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=ROOT, env=env)
+    wall = time.perf_counter() - start
+    error = None
+    if result.returncode != 0:
+        error = (result.stderr.strip().splitlines() or ["exit code %d" % result.returncode])[-1]
+    return wall, parse_importtime(result.stderr), error
+
+
+def measure(module, repeat, top):
+    runs = []
+    for _ in range(repeat):
+        wall, rows, error = import_once(module)
+        if error is not None:
+            return {"error": error}
+        own = [cumulative for name, _, cumulative, depth in rows if name == module and depth == 0]
+        runs.append((own[-1] if own else None, wall, rows))
+    import_us, wall, rows = min(runs, key=lambda run: run[0] if run[0] is not None else run[1])
+
+    packages = {}
+    for name, self_us, _, _ in rows:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    heaviest = sorted(packages.items(), key=lambda item: -item[1])[:top]
+    return {
+        "import_ms": round(import_us / 1000, 1) if import_us is not None else None,
+        "import_ms_median": round(sorted(run[0] for run in runs)[len(runs) // 2] / 1000, 1)
+        if import_us is not None else None,
+        "total_ms": round(sum(self_us for _, self_us, _, _ in rows) / 1000, 1),
+        "wall_ms": round(wall * 1000, 1),
+        "modules_imported": len(rows),
+        "packages": {package: round(us / 1000, 1) for package, us in heaviest},
+    }
+
+
+def run(args):
+    modules = args.modules.split(",") if args.modules else list(DEFAULT_MODULES)
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "modules": {},
+    }
+    for module in modules:
+        result = measure(module, args.repeat, args.top)
+        report["modules"][module] = result
+        if "error" in result:
+            print(f"[IMPORTS] {module}: failed, {result['error']}", file=sys.stderr)
+        else:
+            heaviest = ", ".join(f"{name} {ms:g}" for name, ms in list(result["packages"].items())[:3])
+            print(f"[IMPORTS] {module}: {result['import_ms']} ms ({heaviest})", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        print(f"[IMPORTS] wrote {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)["modules"]
+    with open(args.new) as f:
+        new = json.load(f)["modules"]
+
+    regressions = []
+    print(f"{'module':<28} {'base ms':>9} {'new ms':>9} {'ratio':>7}")
+    for module, result in new.items():
+        before = base.get(module)
+        if not before or not before.get("import_ms") or not result.get("import_ms"):
+            continue
+        ratio = result["import_ms"] / before["import_ms"]
+        flag = ""
+        if ratio > args.threshold and result["import_ms"] - before["import_ms"] > MIN_DELTA_MS:
+            regressions.append(module)
+            flag = "  <- slower"
+        print(f"{module:<28} {before['import_ms']:>9.1f} {result['import_ms']:>9.1f} {ratio:>7.2f}{flag}")
+    if regressions:
+        print(f"\n{len(regressions)} module(s) slower to import than {args.threshold}x the base")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="measure and write JSON")
+    run_parser.add_argument("--modules", default=None, help=f"comma-separated (default {','.join(DEFAULT_MODULES)})")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--top", type=int, default=15, help="heaviest packages to list per module")
+    run_parser.add_argument("--out", default=None, help="JSON file (default stdout)")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=1.2,
+                                help="new/base import-time ratio counted as a regression")
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Seeded synthetic guitar-like takes for the benchmarks.
+
+plucked_take() is a run of decaying harmonic notes, one every 0.5 s, at
+random pitches and levels. The same seed gives the same take. Stereo takes
+pan each note with constant power, so the channels differ but mix down to
+a mono take of the same shape.
+
+noise() is seeded, decaying uniform noise: every sample value is about as
+likely, which is what the tests want for checking curves and loops.
+"""
+import numpy as np
+import soundfile as sf
+
+
+def plucked_take(seconds, sr, seed=0, channels=1):
+    """
+    Parameters:
+        seconds: length of the take
+        sr: sample rate
+        seed: random seed of the pitches, levels, decays and pans
+        channels: 1 for a 1-D take, 2 for a (frames, 2) one
+    Returns:
+        float32 np.ndarray peaking at 1.0
+    """
+    rng = np.random.default_rng(seed)
+    out = np.zeros((int(seconds * sr), channels), dtype=np.float32)
+    note = int(0.5 * sr)
+    t = np.arange(2 * note) / sr
+    for start in range(0, len(out), note):
+        f0 = rng.uniform(82, 660)
+        tone = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 6))
+        tone *= np.exp(-t * rng.uniform(2, 6)) * rng.uniform(0.02, 1.0)
+        stop = min(len(out), start + len(tone))
+        if channels == 1:
+            out[start:stop, 0] += tone[:stop - start].astype(np.float32)
+        else:
+            angle = rng.uniform(0, np.pi / 2)
+            pans = np.array([np.cos(angle), np.sin(angle)] + [np.sqrt(0.5)] * (channels - 2))
+            out[start:stop] += (tone[:stop - start, np.newaxis] * pans).astype(np.float32)
+    out /= np.max(np.abs(out))
+    return out[:, 0] if channels == 1 else out
+
+
+def noise(frames, dtype=np.float32, seed=0, decay=0.0):
+    """
+    Uniform noise in [-1, 1) faded by exp(-t), t going from 0 to decay over
+    the length, so it covers every level down to exp(-decay).
+    """
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-1, 1, frames)
+    if decay:
+        x *= np.exp(-np.linspace(0, decay, frames))
+    return x.astype(dtype)
+
+
+def reference_take(seconds, sr, seed=1, channels=1, drive=3.0):
+    """A soft-clipped plucked_take, standing in for a distorted reference."""
+    take = np.tanh(drive * plucked_take(seconds, sr, seed, channels))
+    return (take / np.max(np.abs(take))).astype(np.float32)
+
+
+def write_take(path, samples, sr):
+    """Write a take as a 16-bit WAV, the usual upload."""
+    sf.write(path, samples, sr, subtype="PCM_16")
+    return path
@@ -0,0 +1,321 @@
+"""
+Time and memory of every DSP stage, across input lengths, channel counts and rates.
+
+    python -m benchmarks.suite run [--lengths 10,60,300] [--channels 1,2] [--rates 44100,48000]
+                                   [--repeat 3] [--stages fuzz_distortion,generate] [--out bench.json]
+    python -m benchmarks.suite compare base.json new.json [--threshold 1.15]
+
+Every case is a seeded plucked-string take (benchmarks/signals.py), so two
+runs see the same audio. For each stage the report has the best wall time
+of --repeat runs, its CPU time, x_realtime (audio seconds per wall second),
+the RSS growth, and the tracemalloc peak of one extra run with allocation
+tracing on (--no-memory skips it). Timed runs never trace allocations.
+
+Stages:
+- decode, classify_features: what /results does per file (loader.load, then
+  features.extract_features on the native-rate mono samples)
+- fuzz_distortion, apply_chorus, apply_reverb, apply_tube_screamer,
+  pitch_down, match_dynamics, undertone_matching, match_loudness_lufs: the
+  scripts/dsp.py stages, with generate()'s settings, on the mono mixdown.
+  match_dynamics and match_loudness_lufs get a soft-clipped reference take.
+  pitch_down is the identity in its default "legacy" mode; pitch_down[shift]
+  is the real pitch shifter.
+- generate, generate[stream]: the whole job end to end, with a
+  FileStorage in a temp dir instead of Supabase. Its top-level stage times
+  (analysing, processing, ...) come along from its trace.
+
+Each generate() run gets a fresh pair of takes and the feature cache points
+at a temp dir, so the analysis is never a cache hit. compare prints the
+new/base wall-time ratio of every stage both files have and exits with 1
+when any is above --threshold.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.signals import plucked_take, reference_take, write_take
+from scripts import instrument
+
+DIRECT = ("decode", "classify_features", "fuzz_distortion", "apply_chorus", "apply_reverb", "apply_tube_screamer",
+          "pitch_down", "pitch_down[shift]", "match_dynamics", "undertone_matching", "match_loudness_lufs")
+END_TO_END = ("generate", "generate[stream]")
+STAGES = DIRECT + END_TO_END
+
+# Below this many seconds a ratio in compare is mostly timer noise
+MIN_COMPARE_S = 0.005
+
+
+def direct_stages(path, reference):
+    """
+    Benchmark name -> function(mono, sr) for every stage in DIRECT.
+    path is the take as a WAV file, reference a mono reference signal.
+    """
+    from scripts import dsp, loader
+    from scripts.features import extract_features
+
+    # Same settings as generate()'s process_full_chain and final_processing_touchups
+    return {
+        "decode": lambda mono, sr: loader.load(path),
+        "classify_features": lambda mono, sr: extract_features(mono, sr).classifier_vector(),
+        "fuzz_distortion": lambda mono, sr: dsp.fuzz_distortion(mono, shape=10, hard_limit_db=-10,
+                                                                wet_db=0, dry_db=-20),
+        "apply_chorus": lambda mono, sr: dsp.apply_chorus(mono, sr),
+        "apply_reverb": lambda mono, sr: dsp.apply_reverb(mono, sr, preset="legacy"),
+        "apply_tube_screamer": lambda mono, sr: dsp.apply_tube_screamer(mono, sr, drive=6, output_gain=1.2),
+        "pitch_down": lambda mono, sr: dsp.pitch_down(mono, sr, semitones=-0.5),
+        "pitch_down[shift]": lambda mono, sr: dsp.pitch_down(mono, sr, semitones=-0.5, mode="shift"),
+        "match_dynamics": lambda mono, sr: dsp.match_dynamics(mono, reference, sr),
+        "undertone_matching": lambda mono, sr: dsp.undertone_matching(mono, sr),
+        "match_loudness_lufs": lambda mono, sr: dsp.match_loudness_lufs(mono, sr, reference),
+    }
+
+
+@contextlib.contextmanager
+def quiet(verbose):
+    """Swallow the stages' print output unless verbose."""
+    if verbose:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def summarize(runs, seconds, memory_run=None):
+    """
+    Parameters:
+        runs: span dicts (wall_s, cpu_s, rss_growth_mb) of the timed runs
+        seconds: audio length of the case
+        memory_run: span dict of the tracemalloc run, or None
+    Returns:
+        the stage's entry in the report
+    """
+    best = min(runs, key=lambda run: run["wall_s"])
+    entry = {
+        "wall_s": best["wall_s"],
+        "wall_s_median": round(float(np.median([run["wall_s"] for run in runs])), 4),
+        "cpu_s": best["cpu_s"],
+        "x_realtime": round(seconds / best["wall_s"], 1) if best["wall_s"] else None,
+        "rss_growth_mb": max(run["rss_growth_mb"] for run in runs),
+        "runs": len(runs),
+    }
+    if memory_run is not None:
+        entry["tracemalloc_peak_mb"] = memory_run.get("tracemalloc_peak_mb")
+    return entry
+
+
+def measure(function, tracemalloc_enabled=False):
+    """Run function once inside a trace; returns the span of the run."""
+    with instrument.Trace("benchmark", record=False, tracemalloc_enabled=tracemalloc_enabled) as trace:
+        with trace.stage("run"):
+            function()
+    return trace.to_dict()["stages"][0]
+
+
+def run_generate(workdir, seconds, sr, channels, seed, render_mode, verbose, trace_allocations=False):
+    """One generate() job on a fresh pair of takes; returns its trace dict."""
+    from scripts.audiotest import generate
+
+    bucket = os.path.join(workdir, "detectfx-bucket", "bench")
+    os.makedirs(bucket, exist_ok=True)
+    clean_name, reference_name = f"clean-{seed}.wav", f"reference-{seed}.wav"
+    write_take(os.path.join(bucket, clean_name), plucked_take(seconds, sr, seed, channels), sr)
+    write_take(os.path.join(bucket, reference_name), reference_take(seconds, sr, seed + 1, channels), sr)
+    public = "https://bench.invalid/storage/v1/object/public/detectfx-bucket/bench/"
+
+    if trace_allocations:
+        tracemalloc.start()
+    try:
+        with quiet(verbose):
+            output = generate(public + clean_name, public + reference_name, f"bench/out-{seed}.wav",
+                              render_mode=render_mode)
+    finally:
+        if trace_allocations:
+            tracemalloc.stop()
+    for name in (clean_name, reference_name, f"out-{seed}.wav"):
+        os.remove(os.path.join(bucket, name))
+    return output["trace"]
+
+
+def run_case(workdir, seconds, sr, channels, stages, repeat, memory, verbose, seed):
+    """Every selected stage on one (length, channels, rate) case."""
+    from scripts import loader
+
+    take = plucked_take(seconds, sr, seed, channels)
+    path = write_take(os.path.join(workdir, f"take-{seconds}-{channels}-{sr}.wav"), take, sr)
+    # The chain is mono; stereo uploads are mixed down on load, as in generate()
+    mono = loader.to_mono(take.reshape(len(take), -1))
+    reference = reference_take(seconds, sr, seed + 1, channels)
+    reference = loader.to_mono(reference.reshape(len(reference), -1))
+    results = {}
+
+    functions = direct_stages(path, reference)
+    for name in [stage for stage in DIRECT if stage in stages]:
+        function = functions[name]
+        with quiet(verbose):
+            runs = [measure(lambda: function(mono, sr)) for _ in range(repeat)]
+            memory_run = measure(lambda: function(mono, sr), tracemalloc_enabled=True) if memory else None
+        results[name] = summarize(runs, seconds, memory_run)
+        print(f"  {name}: {results[name]['wall_s']:.4f}s", file=sys.stderr)
+
+    for mode, name in (("whole", "generate"), ("stream", "generate[stream]")):
+        if name not in stages:
+            continue
+        # Seeds 1000 apart from the direct stages' take, two per run (clean, reference)
+        seeds = [seed + 1000 + 2 * i for i in range(repeat + 1)]
+        traces = [run_generate(workdir, seconds, sr, channels, s, mode, verbose) for s in seeds[:repeat]]
+        runs = [{"wall_s": t["wall_s"], "cpu_s": t["cpu_s"],
+                 "rss_growth_mb": max((span["rss_growth_mb"] for span in t["stages"]), default=0.0)}
+                for t in traces]
+        memory_run = None
+        if memory:
+            memory_trace = run_generate(workdir, seconds, sr, channels, seeds[repeat], mode, verbose, True)
+            peaks = [span.get("tracemalloc_peak_mb", 0.0) for span in memory_trace["stages"]]
+            memory_run = {"tracemalloc_peak_mb": max(peaks, default=None)}
+        results[name] = summarize(runs, seconds, memory_run)
+        # Top-level stages of the first run (download, analysing, processing, ...)
+        results[name]["stages"] = {span["stage"]: span["wall_s"] for span in traces[0]["stages"]
+                                   if span["parent"] is None}
+        print(f"  {name}: {results[name]['wall_s']:.4f}s", file=sys.stderr)
+
+    return results
+
+
+def warm_up(workdir, stages, verbose):
+    """One short run of everything first: imports, filter design and JIT stay out of the timings."""
+    take = plucked_take(1, 44100, 0)
+    path = write_take(os.path.join(workdir, "warm-up.wav"), take, 44100)
+    with quiet(verbose):
+        for name, function in direct_stages(path, reference_take(1, 44100)).items():
+            if name in stages:
+                function(take, 44100)
+    if set(stages) & set(END_TO_END):
+        run_generate(workdir, 2, 44100, 1, 999_999, "whole", verbose)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    stages = args.stages.split(",") if args.stages else list(STAGES)
+    unknown = sorted(set(stages) - set(STAGES))
+    if unknown:
+        raise SystemExit(f"Unknown stages {unknown}, expected some of {list(STAGES)}")
+
+    with tempfile.TemporaryDirectory(prefix="detectfx-bench-") as workdir:
+        # Analysis must not hit the user's feature cache (or an earlier run's)
+        os.environ["DETECTFX_CACHE_DIR"] = os.path.join(workdir, "features")
+        from scripts import storage
+        storage.set_storage(storage.FileStorage(workdir))
+
+        warm_up(workdir, stages, args.verbose)
+        report = {
+            "meta": {
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "repeat": args.repeat,
+                "memory": not args.no_memory,
+                "seed": args.seed,
+            },
+            "cases": [],
+        }
+        for seconds in [float(v) for v in args.lengths.split(",")]:
+            for channels in [int(v) for v in args.channels.split(",")]:
+                for sr in [int(v) for v in args.rates.split(",")]:
+                    print(f"[BENCH] {seconds:g}s, {channels} ch, {sr} Hz", file=sys.stderr)
+                    results = run_case(workdir, seconds, sr, channels, stages, args.repeat,
+                                       not args.no_memory, args.verbose, args.seed)
+                    report["cases"].append({"seconds": seconds, "channels": channels, "sr": sr,
+                                            "stages": results})
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        print(f"[BENCH] wrote {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+
+def case_name(case):
+    return f"{case['seconds']:g}s/{case['channels']}ch/{case['sr']}"
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    base_cases = {case_name(case): case["stages"] for case in base["cases"]}
+
+    regressions = []
+    print(f"{'case':<20} {'stage':<22} {'base s':>9} {'new s':>9} {'ratio':>7} {'base MB':>8} {'new MB':>8}")
+    for case in new["cases"]:
+        name = case_name(case)
+        if name not in base_cases:
+            continue
+        for stage, result in case["stages"].items():
+            before = base_cases[name].get(stage)
+            if not result or not before:
+                continue
+            ratio = result["wall_s"] / before["wall_s"] if before["wall_s"] else None
+            flag = ""
+            if ratio is not None and ratio > args.threshold and result["wall_s"] >= MIN_COMPARE_S:
+                regressions.append((name, stage, ratio))
+                flag = "  <- slower"
+            print(f"{name:<20} {stage:<22} {before['wall_s']:>9.4f} {result['wall_s']:>9.4f} "
+                  f"{ratio if ratio is not None else float('nan'):>7.2f} "
+                  f"{before.get('tracemalloc_peak_mb') or 0:>8.1f} {result.get('tracemalloc_peak_mb') or 0:>8.1f}"
+                  f"{flag}")
+    if regressions:
+        print(f"\n{len(regressions)} stage(s) slower than {args.threshold}x the base")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="benchmark and write JSON")
+    run_parser.add_argument("--lengths", default="10,60,300", help="take lengths in seconds")
+    run_parser.add_argument("--channels", default="1,2")
+    run_parser.add_argument("--rates", default="44100,48000")
+    run_parser.add_argument("--stages", default=None, help=f"comma-separated subset of {','.join(STAGES)}")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    run_parser.add_argument("--out", default=None, help="JSON file (default stdout)")
+    run_parser.add_argument("--verbose", action="store_true", help="keep the stages' own output")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=1.15,
+                                help="new/base wall-time ratio counted as a regression")
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
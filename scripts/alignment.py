@@ -0,0 +1,159 @@
+"""
+Coarse-to-fine alignment of a take against a longer reference.
+
+A full-rate correlate(reference, signal, 'valid') costs O(N * M) when both
+are long, e.g. a full song against a long DI take. Alignment here happens in
+two stages instead:
+
+1. Coarse: RMS envelopes at HOP samples per frame are matched by normalized
+   cross-correlation (one FFT correlation plus running sums). The best few
+   lags become candidates.
+2. Fine: around each candidate, a REFINE_SAMPLES window of the signal (its
+   loudest stretch) is correlated at full rate against the reference over
+   +-2 hops with FFT convolution.
+
+The result is the sample offset plus a confidence: the normalized
+correlation (0..1) of the refine window at that offset.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.signal import correlate
+
+from scripts import framing
+
+HOP = 512
+REFINE_SAMPLES = 65536
+CANDIDATES = 3
+
+
+@dataclass(frozen=True)
+class Alignment:
+    """Where a signal sits inside a reference."""
+    offset: int
+    confidence: float
+    coarse_offset: int
+
+
+def envelope(blocks, hop=HOP):
+    """
+    RMS of consecutive hop-sample frames of a signal given as an iterable of
+    blocks (a list holding one array works). A trailing partial frame is dropped.
+    """
+    return framing.rms_blocks(blocks, frame_size=hop, hop_size=hop)
+
+
+def _window_sums(values, width):
+    sums = np.concatenate([[0.0], np.cumsum(values, dtype=np.float64)])
+    return sums[width:] - sums[:-width]
+
+
+def _normalized(numerator, window_sum, window_sq, width, signal_norm):
+    """Pearson-style normalization of a sliding correlation; flat windows score 0."""
+    spread = np.sqrt(np.maximum(window_sq - window_sum ** 2 / width, 0.0)) * signal_norm
+    floor = 1e-9 * spread.max() if len(spread) else 0.0
+    scores = np.zeros_like(numerator)
+    np.divide(numerator, spread, out=scores, where=spread > floor)
+    return scores
+
+
+def envelope_lags(reference_env, signal_env, candidates=1, spacing=2):
+    """
+    Lags of signal_env inside the longer reference_env, ranked by normalized
+    cross-correlation. Works on any pair of envelopes (RMS, dB, ...).
+
+    Parameters:
+        reference_env: envelope to search in
+        signal_env: envelope to look for
+        candidates: how many lags to return
+        spacing: minimum distance, in frames, between returned lags
+    Returns:
+        list of (lag, score), best first
+    """
+    n = len(signal_env)
+    lags = len(reference_env) - n + 1
+    if n == 0 or lags <= 0:
+        return [(0, 0.0)]
+    reference_env = np.asarray(reference_env, dtype=np.float64)
+    centered = np.asarray(signal_env, dtype=np.float64) - np.mean(signal_env)
+    numerator = correlate(reference_env, centered, mode='valid', method='fft')
+    scores = _normalized(numerator, _window_sums(reference_env, n), _window_sums(reference_env ** 2, n),
+                         n, np.sqrt(np.dot(centered, centered)))
+
+    picked = []
+    for lag in np.argsort(scores)[::-1]:
+        if all(abs(lag - other) > spacing for other, _ in picked):
+            picked.append((int(lag), float(scores[lag])))
+            if len(picked) == candidates:
+                break
+    return picked
+
+
+def align_envelopes(reference_env, signal_env, reference_length, signal_length,
+                    read_reference, read_signal, hop=HOP, window=REFINE_SAMPLES, candidates=CANDIDATES):
+    """
+    align() for callers that hold the signals in pieces (e.g. the streaming
+    render's spools). The envelopes come from envelope() with the same hop;
+    read_reference(start, stop) and read_signal(start, stop) return samples.
+    """
+    max_lag = reference_length - signal_length
+    if max_lag <= 0:
+        return Alignment(0, 0.0, 0)
+
+    # Refine on the loudest stretch of the signal
+    window = min(window, signal_length)
+    frames = max(1, window // hop)
+    start = 0
+    if len(signal_env) > frames:
+        start = int(np.argmax(_window_sums(np.square(signal_env), frames))) * hop
+        start = min(start, signal_length - window)
+    refine = np.asarray(read_signal(start, start + window), dtype=np.float64)
+    refine = refine - np.mean(refine)
+    refine_norm = np.sqrt(np.dot(refine, refine))
+
+    radius = 2 * hop
+    if max_lag <= 2 * radius:
+        # Few enough lags to search them all at full rate
+        centers, radius = [max_lag // 2], max_lag
+    else:
+        centers = [lag * hop for lag, _ in envelope_lags(reference_env, signal_env, candidates)]
+
+    best = None
+    for center in centers:
+        low, high = max(0, center - radius), min(max_lag, center + radius)
+        segment = np.asarray(read_reference(start + low, start + high + window), dtype=np.float64)
+        # The refine window is centered, so the segment's mean drops out
+        numerator = correlate(segment, refine, mode='valid', method='fft')
+        scores = _normalized(numerator, _window_sums(segment, window), _window_sums(segment ** 2, window),
+                             window, refine_norm)
+        lag = int(np.argmax(scores))
+        if best is None or scores[lag] > best[1]:
+            best = (low + lag, float(scores[lag]), center)
+
+    offset, score, center = best
+    return Alignment(offset=offset, confidence=max(0.0, score), coarse_offset=center)
+
+
+def align(reference, signal, hop=HOP, window=REFINE_SAMPLES, candidates=CANDIDATES):
+    """
+    Find where `signal` best lines up inside the longer `reference`.
+
+    Parameters:
+        reference: mono np.ndarray to search in
+        signal: mono np.ndarray to look for
+        hop: envelope frame size for the coarse search
+        window: length of the full-rate refine window
+        candidates: coarse lags refined at full rate
+    Returns:
+        Alignment(offset, confidence, coarse_offset); offset is the start of
+        the best match in reference, 0 when reference is not longer
+    """
+    def blocks(x):
+        # Bounded temporaries; the envelope does not depend on the blocking
+        step = hop * 1024
+        return (x[start:start + step] for start in range(0, len(x), step))
+
+    return align_envelopes(envelope(blocks(reference), hop), envelope(blocks(signal), hop),
+                           len(reference), len(signal),
+                           lambda start, stop: reference[start:stop], lambda start, stop: signal[start:stop],
+                           hop=hop, window=window, candidates=candidates)
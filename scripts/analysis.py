@@ -0,0 +1,178 @@
+"""
+Per-job analysis context.
+
+Each input is decoded once per job by scripts.loader. Derived products (analysis-rate signal,
+feature record, MFCC matrix, envelopes, loudness, trimmed copy) are computed
+on first use and memoized, so every later stage reuses the cached result.
+The context counts the decodes, resamples and STFTs a job performed.
+
+With a FeatureCache attached, the products in PERSISTED are also stored on
+disk under a hash of the decoded PCM, so a reference that was analysed by an
+earlier job is not analysed again.
+
+Inputs added with spooled=True are decoded into Spools (scripts.spool), and
+their resampled and trimmed signals and features are computed block by block,
+so only the small products are held in memory. envelope() and loudness()
+need an in-memory signal.
+"""
+import numpy as np
+
+from scripts import features, framing, loader
+from scripts.feature_cache import audio_key
+from scripts.loader import ANALYSIS_SR
+
+# Products small enough to keep in the on-disk feature cache
+PERSISTED = ("tone_vector", "mfcc", "loudness")
+
+
+class AnalyzedAudio:
+    """
+    One mono input signal and its memoized analysis products. Inputs decoded
+    by the loader keep their LoadedAudio in `loaded`; derived signals (trimmed,
+    other rates) have none.
+    """
+
+    def __init__(self, context, name, samples, sr, loaded=None):
+        self.context = context
+        self.name = name
+        self.samples = samples
+        self.sr = sr
+        self.loaded = loaded
+        self.spooled = not isinstance(samples, np.ndarray)
+        self._cache = {}
+        self._stored = None
+        self._dirty = {}
+        context.items.append(self)
+
+    @property
+    def cache_key(self):
+        # Analysis products depend on the resampler that made the analysis signal
+        return self._memo("cache_key", lambda: audio_key(self.samples, self.sr,
+                                                         f"analysis:{self.context.resampler}"))
+
+    def _stored_products(self):
+        if self._stored is None:
+            self._stored = {}
+            if self.context.cache is not None:
+                self._stored = self.context.cache.get(self.cache_key) or {}
+        return self._stored
+
+    def _memo(self, key, compute):
+        if key not in self._cache:
+            if key in PERSISTED and key in self._stored_products():
+                self.context.count("cache_hits")
+                value = self._stored_products()[key]
+                self._cache[key] = value[()] if value.ndim == 0 else value
+            else:
+                self._cache[key] = compute()
+                if key in PERSISTED and self.context.cache is not None:
+                    self._dirty[key] = self._cache[key]
+        return self._cache[key]
+
+    def flush(self):
+        """Write newly computed persistent products to the feature cache."""
+        if self._dirty:
+            self.context.cache.update(self.cache_key, **self._dirty)
+            self._dirty = {}
+
+    def analysis_signal(self):
+        """The signal resampled to ANALYSIS_SR (the rate librosa.load used)."""
+        def compute():
+            if self.sr == ANALYSIS_SR:
+                return self.samples
+            self.context.count("resamples")
+            if self.loaded is not None:
+                return self.loaded.analysis()
+            return loader.resample(self.samples, self.sr, ANALYSIS_SR, self.context.resampler)
+        return self._memo("analysis_signal", compute)
+
+    def at_rate(self, sr):
+        """This signal converted to sr, as its own AnalyzedAudio (itself if already at sr)."""
+        if sr == self.sr:
+            return self
+
+        def compute():
+            self.context.count("resamples")
+            return AnalyzedAudio(self.context, f"{self.name}@{sr}",
+                                 loader.resample(self.samples, self.sr, sr, self.context.resampler), sr)
+        return self._memo(("at_rate", sr), compute)
+
+    def features(self):
+        """AudioFeatures of the analysis-rate signal (one STFT)."""
+        def compute():
+            self.context.count("stfts")
+            if self.spooled:
+                return features.extract_features_blocks(self.analysis_signal().blocks(), ANALYSIS_SR)
+            return features.extract_features(self.analysis_signal(), ANALYSIS_SR)
+        return self._memo("features", compute)
+
+    def tone_vector(self):
+        return self._memo("tone_vector", lambda: self.features().tone_vector())
+
+    def mfcc(self):
+        """(13, frames) MFCC matrix at ANALYSIS_SR."""
+        return self._memo("mfcc", lambda: self.features().mfcc)
+
+    def envelope(self, frame_size=1024, hop_size=1024):
+        """RMS envelope of the native-rate signal."""
+        return self._memo(("envelope", frame_size, hop_size),
+                          lambda: framing.rms(self.samples, frame_size, hop_size, partial=True))
+
+    def loudness(self):
+        """Integrated LUFS of the peak-normalized signal, as the loudness stage measures it."""
+        def compute():
+            import pyloudnorm as pyln
+            normalized = self.samples / np.max(np.abs(self.samples))
+            return float(pyln.Meter(self.sr, block_size=0.1).integrated_loudness(normalized))
+        return self._memo("loudness", compute)
+
+    def trimmed(self, threshold=0.01, chunk_size=1024):
+        """
+        Copy-free view with leading silence removed, as its own AnalyzedAudio so
+        its products are cached separately.
+        """
+        def compute():
+            if self.spooled:
+                start = framing.leading_silence_blocks(self.samples.blocks(), threshold, chunk_size)
+                return AnalyzedAudio(self.context, f"{self.name}:trimmed", self.samples.slice(start), self.sr)
+            start = framing.leading_silence(self.samples, threshold, chunk_size)
+            return AnalyzedAudio(self.context, f"{self.name}:trimmed", self.samples[start:], self.sr)
+        return self._memo(("trimmed", threshold, chunk_size), compute)
+
+
+class AnalysisContext:
+    """Decodes each input of a job once and hands out memoized analyses."""
+
+    def __init__(self, cache=None, resampler=None):
+        self.cache = cache
+        self.resampler = loader.resampler_name(resampler)
+        self.inputs = {}
+        self.items = []
+        self.stats = {"decodes": 0, "resamples": 0, "stfts": 0, "cache_hits": 0}
+
+    def count(self, key, amount=1):
+        self.stats[key] = self.stats.get(key, 0) + amount
+
+    def add(self, name, data, spooled=False):
+        """
+        Decode encoded bytes, a path or a file object once and register the
+        input under `name`. spooled=True decodes it block by block into a Spool.
+        """
+        self.count("decodes")
+        load = loader.load_spooled if spooled else loader.load
+        loaded = load(data, ANALYSIS_SR, self.resampler)
+        self.inputs[name] = AnalyzedAudio(self, name, loaded.samples, loaded.sr, loaded)
+        return self.inputs[name]
+
+    def __getitem__(self, name):
+        return self.inputs[name]
+
+    def flush(self):
+        """Persist everything computed during the job (no-op without a cache)."""
+        if self.cache is None:
+            return
+        for item in self.items:
+            item.flush()
+
+    def summary(self):
+        return ", ".join(f"{key}={value}" for key, value in self.stats.items())
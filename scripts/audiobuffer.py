@@ -0,0 +1,268 @@
+"""
+Float32 audio buffer for the effect chain.
+
+AudioBuffer wraps a float32 ndarray together with its sample rate and
+channel count:
+
+- Slicing returns views.
+- apply_gain() scales the samples in place and clips them at full scale,
+  as pydub's 16-bit gain saturated.
+- Filters and the compressor replace the array, staying in float32.
+
+The one-pole filters and the RMS compressor use pydub's algorithms, computed
+in float with no truncation or clipping. They are stateful block processors,
+so the streaming render runs the same classes block by block, and the two
+render modes agree sample for sample. pydub is only used at the edges, by
+scripts.loader for formats soundfile cannot decode.
+"""
+import io
+import math
+
+import numpy as np
+from scipy.signal import lfilter
+
+from scripts import loader
+
+
+def db_to_float(db):
+    return 10 ** (db / 20)
+
+
+class AudioBuffer:
+    """
+    float32 samples shaped (frames,) when mono or (frames, channels).
+    Slices and view() share memory with the parent, so in-place methods on
+    them change the parent too; copy() first to keep the original.
+    """
+
+    __slots__ = ("samples", "sr", "channels")
+
+    def __init__(self, samples, sr, channels=None):
+        samples = np.asarray(samples)
+        if samples.dtype != np.float32:
+            samples = samples.astype(np.float32)
+        self.samples = samples
+        self.sr = sr
+        self.channels = channels or (1 if samples.ndim == 1 else samples.shape[1])
+
+    @classmethod
+    def from_file(cls, source):
+        """Decode bytes, a path or a file object (soundfile, or pydub as the fallback)."""
+        samples, sr = loader.decode(source)
+        return cls(samples[:, 0] if samples.shape[1] == 1 else samples, sr)
+
+    @classmethod
+    def silent(cls, duration_ms, sr, channels=1):
+        frames = int(duration_ms * sr / 1000)
+        return cls(np.zeros(frames if channels == 1 else (frames, channels), dtype=np.float32), sr, channels)
+
+    def __len__(self):
+        return self.samples.shape[0]
+
+    @property
+    def duration(self):
+        return len(self) / self.sr
+
+    def ms_to_frames(self, ms):
+        return int(ms * self.sr / 1000)
+
+    def __getitem__(self, key):
+        """Frame slice as a view: buffer[start:stop]."""
+        if not isinstance(key, slice):
+            raise TypeError("AudioBuffer only supports slicing by frames")
+        return AudioBuffer(self.samples[key], self.sr, self.channels)
+
+    def view(self):
+        return AudioBuffer(self.samples, self.sr, self.channels)
+
+    def copy(self):
+        return AudioBuffer(self.samples.copy(), self.sr, self.channels)
+
+    def mono(self):
+        """Mono buffer: a view when already mono, else the channel mean."""
+        if self.channels == 1:
+            return self.view()
+        return AudioBuffer(loader.to_mono(self.samples), self.sr, 1)
+
+    def peak(self):
+        return float(np.max(np.abs(self.samples))) if self.samples.size else 0.0
+
+    def rms(self):
+        return float(np.sqrt(np.mean(np.square(self.samples, dtype=np.float64)))) if self.samples.size else 0.0
+
+    def normalize(self):
+        """Scale in place to a peak of 1 (silence is left alone)."""
+        peak = np.max(np.abs(self.samples)) if self.samples.size else 0
+        if peak > 0:
+            self.samples /= peak
+        return self
+
+    def apply_gain(self, db):
+        """Scale in place by db decibels, clipped to [-1, 1] like pydub's int16 gain."""
+        self.samples *= np.float32(db_to_float(db))
+        np.clip(self.samples, -1.0, 1.0, out=self.samples)
+        return self
+
+    def _filter(self, make):
+        """Run a fresh block processor from make() over each channel."""
+        if self.channels == 1:
+            self.samples = make()(self.samples)
+        else:
+            self.samples = np.stack([make()(self.samples[:, c]) for c in range(self.channels)], axis=1)
+        return self
+
+    def low_pass_filter(self, cutoff):
+        return self._filter(lambda: OnePoleLowPass(self.sr, cutoff))
+
+    def high_pass_filter(self, cutoff):
+        return self._filter(lambda: OnePoleHighPass(self.sr, cutoff))
+
+    def compress_dynamic_range(self, threshold=-20.0, ratio=4.0, attack=5.0, release=50.0):
+        return self._filter(lambda: RMSCompressor(self.sr, threshold, ratio, attack, release))
+
+    def compand(self, args=None, backend=None):
+        """sox-style compand (scripts.compander) of each channel."""
+        from scripts import compander
+        args = args or compander.COMPAND_ARGS
+        return self._filter(lambda: lambda x: compander.compand(x, self.sr, args, backend))
+
+    def overlay(self, other, position=0):
+        """Mix other into this buffer in place, starting at frame `position`, cut to this length."""
+        end = min(len(self), position + len(other))
+        if end > position:
+            self.samples[position:end] += other.samples[:end - position]
+        return self
+
+    def write(self, target, format="WAV", subtype="FLOAT"):
+        """Write to a path or file object (32-bit float WAV unless told otherwise)."""
+        import soundfile as sf
+        sf.write(target, self.samples, self.sr, format=format, subtype=subtype)
+
+    def encode(self, format="WAV", subtype="FLOAT"):
+        buffer = io.BytesIO()
+        self.write(buffer, format, subtype)
+        return buffer.getvalue()
+
+
+# ---------------------------------------------------------------------------
+# Block processors: call with consecutive blocks of one mono signal.
+# ---------------------------------------------------------------------------
+
+class Gain:
+    """apply_gain() for blocks: scale by db decibels and clip to [-1, 1]."""
+
+    def __init__(self, db):
+        self.factor = np.float32(db_to_float(db))
+
+    def __call__(self, block):
+        out = block * self.factor
+        return np.clip(out, -1.0, 1.0, out=out)
+
+
+class OnePoleLowPass:
+    """pydub's low_pass_filter (one-pole RC) in float. The first sample passes through."""
+
+    def __init__(self, sr, cutoff):
+        rc = 1.0 / (cutoff * 2 * np.pi)
+        dt = 1.0 / sr
+        self.alpha = dt / (rc + dt)
+        self.zi = None
+
+    def __call__(self, block):
+        if len(block) == 0:
+            return block
+        x = block.astype(np.float64)
+        head = None
+        if self.zi is None:
+            # The first sample seeds the filter
+            head, x = block[:1].astype(np.float32), x[1:]
+            self.zi = np.array([(1 - self.alpha) * float(block[0])])
+            if len(x) == 0:
+                return head
+        out, self.zi = lfilter([self.alpha], [1.0, self.alpha - 1], x, zi=self.zi)
+        out = out.astype(np.float32)
+        return out if head is None else np.concatenate([head, out])
+
+
+class OnePoleHighPass:
+    """pydub's high_pass_filter (one-pole RC) in float. The first sample passes through."""
+
+    def __init__(self, sr, cutoff):
+        rc = 1.0 / (cutoff * 2 * np.pi)
+        dt = 1.0 / sr
+        self.alpha = rc / (rc + dt)
+        self.zi = None
+        self.previous = None
+
+    def __call__(self, block):
+        if len(block) == 0:
+            return block
+        x = block.astype(np.float64)
+        head = None
+        if self.zi is None:
+            head, self.previous = block[:1].astype(np.float32), x[0]
+            self.zi = np.array([self.alpha * x[0]])
+            x = x[1:]
+            if len(x) == 0:
+                return head
+        diff = np.diff(x, prepend=self.previous)
+        self.previous = x[-1]
+        out, self.zi = lfilter([self.alpha], [1.0, -self.alpha], diff, zi=self.zi)
+        out = out.astype(np.float32)
+        return out if head is None else np.concatenate([head, out])
+
+
+class RMSCompressor:
+    """
+    pydub's compress_dynamic_range on float samples, carrying the attenuation
+    and the RMS look-back window between blocks. The RMS is vectorized; the
+    attack/release recursion is a plain loop like pydub's.
+
+    Only the level detector reads the signal on a 16-bit integer grid, as
+    pydub did. Its running sums are then exact, so any block size gives the
+    same gains. The gains are applied to the float samples.
+    """
+
+    def __init__(self, sr, threshold=-20.0, ratio=4.0, attack=5.0, release=50.0):
+        self.thresh_rms = 32768.0 * db_to_float(threshold)
+        self.ratio = ratio
+        self.look_frames = int(attack * (sr / 1000.0))
+        self.attack_frames = attack * (sr / 1000.0)
+        self.release_frames = release * (sr / 1000.0)
+        self.attenuation = 0.0
+        self.history = np.zeros(0, dtype=np.int64)
+
+    def __call__(self, block):
+        n = len(block)
+        if n == 0:
+            return block
+        look = self.look_frames
+        levels = np.round(block.astype(np.float64) * 32768).astype(np.int64)
+        line = np.concatenate([self.history, levels])
+        offset = len(self.history)
+        squares = np.concatenate([[0], np.cumsum(line * line)])
+        ends = np.arange(offset, offset + n)
+        starts = np.maximum(ends - look, 0)
+        counts = ends - starts
+        rms = np.where(counts > 0, np.floor(np.sqrt((squares[ends] - squares[starts]) / np.maximum(counts, 1))), 0)
+
+        factors = np.ones(n)
+        attenuation = self.attenuation
+        thresh_rms, ratio, log = self.thresh_rms, self.ratio, math.log
+        for i, rms_now in enumerate(rms.tolist()):
+            if rms_now == 0:
+                over = 0.0
+            else:
+                over = max(20 * log(rms_now / thresh_rms, 10), 0)
+            max_attenuation = (1 - (1.0 / ratio)) * over
+            if rms_now > thresh_rms and attenuation <= max_attenuation:
+                attenuation += max_attenuation / self.attack_frames
+                attenuation = min(attenuation, max_attenuation)
+            else:
+                attenuation -= max_attenuation / self.release_frames
+                attenuation = max(attenuation, 0)
+            if attenuation != 0.0:
+                factors[i] = 10 ** (-attenuation / 20)
+        self.attenuation = attenuation
+        self.history = line[-look:] if look else self.history
+        return (block * factors).astype(np.float32)
@@ -0,0 +1,335 @@
+"""
+In-process compander with sox compand's parameters.
+
+Compander takes the arguments of the "compressor" effect's sox compand
+(COMPAND_ARGS, in sox's own syntax) and runs them in NumPy:
+
+- Detector: sox's volume follower, v += (|x| - v) * rate, where rate is the
+  attack rate while |x| is above v and the decay rate otherwise. Once it is
+  known which samples rise, this is a linear recursion with a closed form
+  (cumulative products and sums). The detector guesses the rising samples,
+  solves the recursion for the whole chunk, and repeats with the new
+  envelope until the guess is self-consistent, which usually takes 2-3
+  passes. That fixed point is exactly sox's recursion. A chunk that does
+  not settle falls back to a plain loop.
+- Gain computer: sox's transfer function (compandt.c), piecewise linear in
+  dB with quadratic corners, tabulated on a 0.01 dB grid and interpolated
+  over the whole envelope.
+- Lookahead: each sample gets the gain computed `delay` seconds later, and
+  the output keeps the input's length and alignment, as sox's does. Output
+  clips at full scale, as sox's integer samples do.
+
+The detector state is advanced in fixed CHUNK-sized pieces at absolute
+positions, so Compander gives the same output whatever block sizes it is fed.
+The streaming render and compand() share it.
+
+benchmarks/compander.py measures the speed and output difference against sox.
+Against libsox 14.4.2 on a 60 s take the output is within 6e-8 of sox's
+(-144 dB), and 77 dB below the signal on a quiet take whose envelope sits in
+the transfer curve's knees. Native is the default; DETECTFX_COMPANDER=sox
+opts back into the sox binary (compand_sox), which must then be installed.
+"""
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+# sox compand settings of the "compressor" effect
+COMPAND_ARGS = ["compand", "0.3,1", "6:-70,-60,-20", "-5", "-90", "0.2"]
+
+BACKEND = os.getenv("DETECTFX_COMPANDER", "native")
+BACKENDS = ("native", "sox")
+# Samples per detector step; fixed so the output does not depend on block sizes
+CHUNK = 8192
+# Envelope floor in dB, keeps log() finite on digital silence
+FLOOR_DB = -200.0
+# Passes of the rising/falling guess before falling back to the loop
+MAX_PASSES = 32
+# Largest decay of the closed form's running product within one piece (nepers)
+MAX_LOG_DECAY = 200.0
+# Grid of the tabulated gain curve; interpolation error stays below 1e-4 dB
+TABLE_STEP_DB = 0.01
+TABLE_TOP_DB = 60.0
+
+
+def parse_compand_args(args=COMPAND_ARGS):
+    """
+    sox compand arguments -> Compander keyword arguments.
+    "attack,decay [knee:]in1[,out1]{,in2,out2} [gain [initial [delay]]]".
+    With an odd count of transfer values the first point's output is its input.
+    """
+    if args and args[0] == "compand":
+        args = args[1:]
+    attack, decay = (float(v) for v in args[0].split(",")[:2])
+    knee, _, points = args[1].rpartition(":")
+    values = [float(v) for v in points.split(",")]
+    if len(values) % 2:
+        values.insert(1, values[0])
+    params = {
+        "attack": attack,
+        "decay": decay,
+        "points": list(zip(values[::2], values[1::2])),
+        "knee_db": float(knee) if knee else 0.01,
+    }
+    for key, value in zip(("gain_db", "initial_db", "delay"), args[2:5]):
+        params[key] = float(value)
+    return params
+
+
+def transfer_curve(points, knee_db=6.0):
+    """
+    f(level_db) -> output level in dB for a sox-style transfer function,
+    built the way sox's compandt.c builds it. (0, 0) is added when the points
+    do not end at 0 dB, and a slope-1 tail 2 * knee_db long leads into the
+    first point; below the tail and above the last point the gain holds.
+    Every corner but the last is rounded with sox's quadratic, which spans
+    knee_db along the incoming line and up to half the outgoing one.
+    """
+    # (input dB, gain dB) corners: the tail's start, the points, then 0 dB
+    corners = [(float(x), float(y) - float(x)) for x, y in points]
+    if corners[-1][0] != 0:
+        corners.append((0.0, 0.0))
+    corners.insert(0, (corners[0][0] - 2 * knee_db, corners[0][1]))
+    i = 2
+    while i < len(corners):
+        (x0, g0), (x1, g1), (x2, g2) = corners[i - 2:i + 1]
+        if (g2 - g1) * (x1 - x0) == (g1 - g0) * (x2 - x1):
+            del corners[i - 1]
+        else:
+            i += 1
+
+    # sox's segment list: a line from each corner, then the curve into the next.
+    # Each segment is (start dB, gain dB at start, a, b); gain = y + d * (a * d + b)
+    x = [value for corner in corners for value in (corner[0], 0.0)]
+    y = [value for corner in corners for value in (corner[1], 0.0)]
+    a = [0.0] * len(x)
+    b = [0.0] * len(x)
+    for i in range(4, len(x), 2):
+        b[i - 4] = (y[i - 2] - y[i - 4]) / (x[i - 2] - x[i - 4])
+        b[i - 2] = (y[i] - y[i - 2]) / (x[i] - x[i - 2])
+        theta = np.arctan2(y[i - 2] - y[i - 4], x[i - 2] - x[i - 4])
+        radius = min(knee_db, np.hypot(x[i - 2] - x[i - 4], y[i - 2] - y[i - 4]))
+        x[i - 3] = x[i - 2] - radius * np.cos(theta)
+        y[i - 3] = y[i - 2] - radius * np.sin(theta)
+        theta = np.arctan2(y[i] - y[i - 2], x[i] - x[i - 2])
+        radius = min(knee_db, np.hypot(x[i] - x[i - 2], y[i] - y[i - 2]) / 2)
+        end_x, end_y = x[i - 2] + radius * np.cos(theta), y[i - 2] + radius * np.sin(theta)
+        mid_x = (x[i - 3] + x[i - 2] + end_x) / 3 - x[i - 3]
+        mid_y = (y[i - 3] + y[i - 2] + end_y) / 3 - y[i - 3]
+        x[i - 2], y[i - 2] = end_x, end_y
+        span_x, span_y = end_x - x[i - 3], end_y - y[i - 3]
+        a[i - 3] = (span_y / span_x - mid_y / mid_x) / (span_x - mid_x)
+        b[i - 3] = mid_y / mid_x - a[i - 3] * mid_x
+    # The last corner is not rounded; past it the gain holds
+    x[-1], y[-1] = x[-2], y[-2]
+    x, y, a, b = (np.array(v[1:]) for v in (x, y, a, b))
+
+    def curve(level_db):
+        level_db = np.asarray(level_db, dtype=np.float64)
+        # The first segment whose successor starts at or above the level
+        index = np.searchsorted(x[1:], level_db)
+        d = level_db - x[index]
+        gain_db = y[index] + d * (a[index] * d + b[index])
+        return level_db + np.where(level_db <= x[0], y[0], gain_db)
+    return curve
+
+
+class Compander:
+    """
+    Streaming compander: feed consecutive blocks of one signal through
+    process() and call flush() at the end. Output lags the input by up to
+    CHUNK + delay samples; flush() returns the rest.
+    """
+
+    def __init__(self, sr, attack=0.3, decay=1.0, points=((-70, -70), (-60, -20)), knee_db=6.0,
+                 gain_db=0.0, initial_db=-90.0, delay=0.0, chunk=CHUNK):
+        self.sr = sr
+        # Follower rates per sample; times shorter than a sample act instantly
+        self.attack = 1 - np.exp(-1 / (sr * attack)) if attack * sr > 1 else 1.0
+        self.decay = 1 - np.exp(-1 / (sr * decay)) if decay * sr > 1 else 1.0
+        with np.errstate(divide="ignore"):
+            self.log_keep_attack = np.log1p(-self.attack)
+            self.log_keep_decay = np.log1p(-self.decay)
+        self.curve = transfer_curve(points, knee_db)
+        self.gain_db = gain_db
+        # Gain in nepers per envelope level in dB, tabulated once on a fine grid
+        table_db = np.arange(FLOOR_DB, TABLE_TOP_DB + TABLE_STEP_DB, TABLE_STEP_DB)
+        self.table = (self.curve(table_db) - table_db + gain_db) * (np.log(10) / 20)
+        self.table_slope = np.append(np.diff(self.table), 0.0)
+        self.lookahead = int(round(delay * sr))
+        self.chunk = chunk
+        self.decay_ramp = np.zeros(0)
+
+        # Detector state: the follower's volume after the last detected sample
+        self.volume = 10 ** (initial_db / 20)
+        self.pending = []
+        self.pending_count = 0
+        # Input samples not yet output, and the gains of the detected ones from the first of them on
+        self.signal = np.zeros(0, dtype=np.float32)
+        self.gains = np.zeros(0)
+
+    @classmethod
+    def from_args(cls, sr, args=COMPAND_ARGS, **overrides):
+        return cls(sr, **{**parse_compand_args(args), **overrides})
+
+    def _solve(self, level, rising, volume):
+        """The follower over `level` given which samples rise, in closed form."""
+        steepest = -min(self.log_keep_attack, self.log_keep_decay)
+        if not np.isfinite(steepest):
+            return self._loop(level, volume)
+        # Selects by arithmetic on the mask; np.where with scalar branches is
+        # several times slower on this hot path
+        rising = rising.astype(np.float64)
+        weighted = (self.attack - self.decay) * rising
+        weighted += self.decay
+        weighted *= level
+        # log of the running product of (1 - rate): a ramp plus a count of rising samples
+        log_product = np.cumsum(rising, out=rising)
+        log_product *= self.log_keep_attack - self.log_keep_decay
+        log_product += self._decay_ramp(len(level))
+        out = np.empty(len(level))
+        # v[n] = P[n] * (v0 + sum_k rate[k] * level[k] / P[k]), P the running
+        # product of (1 - rate), taken in pieces short enough that 1 / P stays finite
+        piece = max(1, int(MAX_LOG_DECAY / steepest))
+        offset = 0.0
+        for start in range(0, len(level), piece):
+            stop = min(start + piece, len(level))
+            product = log_product[start:stop]
+            product -= offset
+            offset += product[-1]
+            product = np.exp(product, out=product)
+            part = weighted[start:stop]
+            part /= product
+            np.cumsum(part, out=part)
+            part += volume
+            np.multiply(product, part, out=out[start:stop])
+            volume = out[stop - 1]
+        return out
+
+    def _decay_ramp(self, length):
+        """log(1 - decay) * (1, 2, ..., length), kept for the chunk length."""
+        if len(self.decay_ramp) != length:
+            self.decay_ramp = self.log_keep_decay * np.arange(1, length + 1)
+        return self.decay_ramp
+
+    def _loop(self, level, volume):
+        out = np.empty(len(level))
+        for i, value in enumerate(level.tolist()):
+            delta = value - volume
+            volume += delta * (self.attack if delta > 0 else self.decay)
+            out[i] = volume
+        return out
+
+    def _detect(self, x):
+        """Envelope of one chunk, advancing the detector state."""
+        level = np.abs(x.astype(np.float64))
+        previous = np.full(len(level), self.volume)
+        rising = None
+        for _ in range(MAX_PASSES):
+            guess = level > previous
+            if rising is not None and np.array_equal(guess, rising):
+                break
+            rising = guess
+            envelope = self._solve(level, rising, self.volume)
+            previous[1:] = envelope[:-1]
+        else:
+            envelope = self._loop(level, self.volume)
+        self.volume = envelope[-1]
+        return envelope
+
+    def _gains(self, envelope):
+        # Position on the gain table's uniform grid, then linear interpolation
+        position = np.log10(np.maximum(envelope, 1e-300))
+        position *= 20 / TABLE_STEP_DB
+        position -= FLOOR_DB / TABLE_STEP_DB
+        # Past the top the curve has slope 1, so the gain holds its last value
+        np.clip(position, 0, len(self.table) - 1, out=position)
+        index = position.astype(np.intp)
+        position -= index
+        position *= self.table_slope.take(index)
+        position += self.table.take(index)
+        return np.exp(position, out=position)
+
+    def _emit(self, final=False):
+        ready = len(self.gains) - self.lookahead
+        if final:
+            # Past the end the detector holds its last value, like sox's drain
+            pad = len(self.signal) + self.lookahead - len(self.gains)
+            if pad > 0:
+                self.gains = np.concatenate([self.gains, np.repeat(self.gains[-1:], pad)])
+            ready = len(self.signal)
+        if ready <= 0:
+            return np.zeros(0, dtype=np.float32)
+        out = self.signal[:ready] * self.gains[self.lookahead:self.lookahead + ready]
+        # sox's samples are 32-bit integers, so its output clips at full scale
+        out = np.clip(out, -1.0, 1.0, out=out).astype(np.float32)
+        self.signal = self.signal[ready:]
+        self.gains = self.gains[ready:]
+        return out
+
+    def _take(self, count):
+        joined = np.concatenate(self.pending) if len(self.pending) > 1 else self.pending[0]
+        head, rest = joined[:count], joined[count:]
+        self.pending = [rest] if len(rest) else []
+        self.pending_count = len(rest)
+        return head
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if len(block):
+            self.pending.append(block)
+            self.pending_count += len(block)
+        detected = []
+        while self.pending_count >= self.chunk:
+            x = self._take(self.chunk)
+            # Gains per chunk while the envelope is still in cache
+            detected.append((x, self._gains(self._detect(x))))
+        if detected:
+            self.signal = np.concatenate([self.signal] + [x for x, _ in detected])
+            self.gains = np.concatenate([self.gains] + [g for _, g in detected])
+        return self._emit()
+
+    __call__ = process
+
+    def flush(self):
+        if self.pending_count:
+            x = self._take(self.pending_count)
+            self.signal = np.concatenate([self.signal, x])
+            self.gains = np.concatenate([self.gains, self._gains(self._detect(x))])
+        if not len(self.signal):
+            return np.zeros(0, dtype=np.float32)
+        return self._emit(final=True)
+
+
+def compand_sox(signal, sr, args=COMPAND_ARGS):
+    """Run signal through the sox binary (32-bit float WAV in and out)."""
+    import soundfile as sf
+    with tempfile.TemporaryDirectory() as workdir:
+        input_path = os.path.join(workdir, "in.wav")
+        output_path = os.path.join(workdir, "out.wav")
+        sf.write(input_path, signal, sr, subtype="FLOAT")
+        subprocess.run(["sox", input_path, output_path, *args], check=True)
+        out, _ = sf.read(output_path, dtype="float32")
+    return out
+
+
+def compand(signal, sr, args=COMPAND_ARGS, backend=None):
+    """
+    Compress a mono signal as `sox in out <args>` would.
+
+    Parameters:
+        signal: mono np.ndarray
+        sr: sample rate
+        args: sox compand arguments (default COMPAND_ARGS)
+        backend: "native" or "sox" (default DETECTFX_COMPANDER)
+    Returns:
+        float32 np.ndarray the same length as signal
+    """
+    backend = backend or BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown compander '{backend}', expected one of {BACKENDS}")
+    if backend == "sox":
+        return compand_sox(signal, sr, args)
+    compander = Compander.from_args(sr, args)
+    return np.concatenate([compander.process(signal), compander.flush()])
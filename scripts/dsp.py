@@ -0,0 +1,643 @@
+"""
+The DSP stages of generate(): effect-chain choice, the saturation, chorus and
+reverb chain, the touch-ups and loudness matching.
+
+All stages take and return mono float signals unless noted. The spans they
+open with instrument.stage() attach to generate()'s trace, and do nothing
+when called outside of one. The chain settings, filter designs and kernels
+defined here are shared with the streaming render (scripts/streaming.py).
+
+pyloudnorm (match_loudness_lufs), soundfile (the *_to_file helpers) and the
+separation service (extract_guitar_demucs) are imported where they are used.
+"""
+import os
+
+import numpy as np
+import scipy.signal as sps
+from scipy.signal import butter, lfilter
+
+from scripts import alignment, chorus, framing, instrument, loader, pitch, reverb, waveshaper
+from scripts.audiobuffer import AudioBuffer
+
+# generate()'s comparison vector, and the deltas each feature is judged against
+FEATURE_NAMES = ["spectral_centroid", "rms", "zcr", "flatness", "mfcc_1"]
+THRESHOLDS = {
+    "spectral_centroid": 500,
+    "rms": 0.02,
+    "zcr": 0.05,
+    "flatness": 0.1,
+    "mfcc_1": 10
+}
+
+# Settings of the fixed stages of the chain. The streaming render
+# (scripts/streaming.py) builds its block processors from the same values.
+TUBE_SCREAMER = {"drive": 6, "output_gain": 1.2}
+FUZZ = {"shape": 10, "hard_limit_db": -10, "wet_db": 0, "dry_db": -20}
+SMOOTHING_CUTOFF = 4500
+PITCH_SEMITONES = -0.5
+HARD_CLIP_THRESHOLD = 0.26
+# match_volume_to_reference leaves the output at 1 / OUTPUT_HEADROOM of full scale
+OUTPUT_HEADROOM = 1.2
+
+
+def apply_delay(input_audio: AudioBuffer, delay_ms=300, feedback_db=-5, mix_db=0, wet_out_db=-6, dry_out_db=0):
+    # Calculate delay amount
+    delay = input_audio.ms_to_frames(delay_ms)
+
+    # Feedback simulated as a quieter repeat, delayed (a view until the gain copies it)
+    wet = input_audio[:max(len(input_audio) - delay, 0)].copy().apply_gain(feedback_db + wet_out_db)
+
+    # The dry signal is attenuated by mix_db while the wet one plays over it
+    mix = input_audio.copy().apply_gain(dry_out_db + mix_db)
+
+    # Combine signals
+    return mix.overlay(wet, position=delay)
+
+
+def map_delta_to_dsp(delta, clean_mfcc, ref_mfcc, feature_names=FEATURE_NAMES, thresholds=THRESHOLDS,
+                     reverb_preset="legacy"):
+    """
+    The effect chain that moves the clean take's features toward the reference's.
+
+    Parameters:
+        delta: reference minus clean feature vector, in feature_names order
+        clean_mfcc, ref_mfcc: MFCC matrices of both inputs (chorus decision)
+        reverb_preset: scripts/reverb.py preset of the chain's reverb
+    Returns:
+        list of effect dicts
+    """
+    effect_chain = []
+
+    for i, feature in enumerate(feature_names):
+        direction = "increase" if delta[i] > 0 else "decrease"
+        magnitude = abs(delta[i])
+        threshold = thresholds.get(feature, 0.1)
+
+        #if magnitude < threshold:
+        #    continue #skip small changes
+
+        if feature == "spectral_centroid":
+            if direction == "increase":
+                effect_chain.append({"effect": "lowpass", "cutoff": 3000})
+            else:
+                effect_chain.append({"effect": "highpass", "cutoff": 3000})
+
+        elif feature == "flatness":
+            if direction == "increase":
+                effect_chain.append({"effect": "compressor", "intensity": "medium"})
+            else:
+                effect_chain.append({"effect": "distortion", "intensity": "light"})
+
+        elif feature == "rms":
+            if direction == "decrease":
+                effect_chain.append({"effect": "gain", "amount_db": 6})
+            else:
+                effect_chain.append({"effect": "compressor", "intensity": "light"})
+
+        elif feature == "zcr":
+            if direction == "increase":
+                effect_chain.append({"effect": "smoothen", "method": "low_pass_fade"})
+
+        elif feature.startswith("mfcc"):
+            effect_chain.append({"effect": "eq", "target": feature, "adjustment": direction})
+
+    if should_apply_chorus(clean_mfcc, ref_mfcc):
+        effect_chain.append({"effect": "chorus"})
+
+    if should_apply_reverb(None, None, delta):
+        effect_chain.append({"effect": "reverb", "preset": reverb_preset})
+
+    return effect_chain
+
+
+def apply_effect_chain(audio: AudioBuffer, effect_chain: list) -> AudioBuffer:
+    """Run the gain/filter/compressor effects on audio, in place where possible."""
+    with instrument.stage("effect:distortion_high"):
+        current_audio = apply_distortion(audio, intensity="high")
+
+    for effect in effect_chain:
+        # chorus and reverb ran earlier in process_full_chain; the rest are no-ops here
+        if effect["effect"] not in ("gain", "lowpass", "highpass", "compressor", "distortion"):
+            continue
+        with instrument.stage(f"effect:{effect['effect']}"):
+            if effect["effect"] == "gain":
+                current_audio.apply_gain(effect["amount_db"])
+
+            elif effect["effect"] == "lowpass":
+                current_audio.low_pass_filter(effect["cutoff"])
+
+            elif effect["effect"] == "highpass":
+                current_audio.high_pass_filter(effect["cutoff"])
+
+            elif effect["effect"] == "compressor":
+                # In-process sox compand (DETECTFX_COMPANDER=sox runs the sox binary instead)
+                current_audio.compand()
+
+            elif effect["effect"] == "distortion":
+                current_audio.apply_gain(10).compress_dynamic_range()
+
+            # "eq" is a placeholder for future EQ
+
+    return current_audio
+
+
+def soft_clip(signal, drive=5, in_place=False):
+    return waveshaper.soft_clip(signal, drive=drive, in_place=in_place)
+
+
+def hard_clip(signal, threshold=HARD_CLIP_THRESHOLD, in_place=False):
+    print("HARD CLIPPED")
+    return waveshaper.hard_clip(signal, threshold=threshold, in_place=in_place)
+
+
+def apply_distortion(audio: AudioBuffer, intensity="medium"):
+    """Normalize and clip audio in place; returns the same buffer."""
+    samples = audio.normalize().samples
+
+    # Choose distortion type
+    if intensity == "light":
+        processed = soft_clip(samples, drive=3, in_place=True)
+    elif intensity == "high":
+        processed = hard_clip(samples, in_place=True)
+    else:  # medium
+        processed = soft_clip(samples, drive=6, in_place=True)
+
+    audio.samples = processed
+    return audio
+
+
+def apply_chorus(signal, sr, depth_ms=30, rate_hz=0.5, voices=1, spread=0.0, stereo=False):
+    """
+    Sawtooth modulated chorus on a fractional delay line.
+    depth_ms is the maximum delay of the modulated copy, rate_hz the LFO rate.
+    """
+    return chorus.chorus(signal, sr, depth_ms=depth_ms, rate_hz=rate_hz,
+                         voices=voices, spread=spread, stereo=stereo)
+
+
+def apply_reverb(signal, sr, decay=None, wet_level=None, preset="legacy"):
+    """
+    Comb/allpass reverb. The "legacy" preset (decay=0.7, wet_level=0.3) is the
+    original plate approximation; "plate", "hall" and "spring" follow the
+    reverb classes the classifier predicts.
+    """
+    return reverb.reverb(signal, sr, preset=preset, decay=decay, wet_level=wet_level)
+
+
+def should_apply_chorus(clean_mfcc, ref_mfcc, threshold=5.0):
+    # Measure spectral modulation increase
+    var_clean = np.var(clean_mfcc, axis=1).mean()
+    var_ref = np.var(ref_mfcc, axis=1).mean()
+    return (var_ref - var_clean) > threshold
+
+
+def should_apply_reverb(clean_features, ref_features, delta_vector, threshold_flatness=0.05, threshold_energy=0.02):
+    flatness_idx = 3  # assuming index 3 = flatness
+    rms_idx = 1       # assuming index 1 = rms
+
+    flatness_delta = delta_vector[flatness_idx]
+    rms_delta = delta_vector[rms_idx]
+
+    return (flatness_delta > threshold_flatness and rms_delta < threshold_energy)
+
+
+def pitch_down(signal, sr, semitones=-1, mode=None):
+    """
+    Pitch-shifts the signal down by a given number of semitones.
+    Negative values lower the pitch.
+
+    mode "legacy" (the default, DETECTFX_PITCH_MODE) keeps the old result:
+    FFT-resampling to the shifted length and straight back was the identity
+    to within 1e-14, so the signal is returned as is, without the two
+    full-length FFTs. mode "shift" really lowers the pitch and keeps the length.
+    """
+    mode = mode or os.getenv("DETECTFX_PITCH_MODE", "legacy")
+    if mode == "shift":
+        return pitch.pitch_shift(signal, sr, semitones)
+    return signal
+
+
+def fuzz_distortion(signal, shape=40, hard_limit_db=-25, wet_db=0, dry_db=-60, in_place=False):
+    """
+    Apply JSFX-style fuzz distortion to a mono audio signal.
+    Parameters:
+        signal: np.ndarray of float32 audio samples (normalized -1 to 1)
+        shape: controls the curvature of the waveshaper
+        hard_limit_db: output clip threshold in dB
+        wet_db: output level of distorted signal (in dB)
+        dry_db: output level of original signal (in dB)
+        in_place: overwrite `signal` instead of allocating a new array
+    Returns:
+        np.ndarray of distorted audio samples
+    """
+    print("Applying fuzz")
+    return waveshaper.fuzz(signal, shape, hard_limit_db, wet_db, dry_db, in_place=in_place)
+
+
+def apply_fuzz_to_file(input_path, output_path,
+                    shape=20, hard_limit_db=-25, wet_db=0, dry_db=-60):
+    """
+    Load a mono audio file, apply fuzz distortion, and write output.
+    input_path: path to input audio file (.wav or .mp3)
+    output_path: path to save the processed file (.wav)
+    """
+    import soundfile as sf
+
+    # Decode (WAV, MP3, ...) and downmix through the shared loader
+    audio = loader.load(input_path)
+    signal, sr = audio.samples.copy(), audio.sr
+
+    # Normalize to -1 to 1
+    signal /= np.max(np.abs(signal))
+
+    # Apply fuzz distortion (signal is our own float32 copy)
+    processed = waveshaper.fuzz(signal, shape, hard_limit_db, wet_db, dry_db, in_place=True)
+
+    # Normalize output to avoid clipping
+    processed /= np.max(np.abs(processed))
+
+    # Save output
+    sf.write(output_path, processed, sr)
+    print(f"✅ Distorted file saved to: {output_path}")
+
+
+def high_pass_coefficients(sr, cutoff=720, order=1):
+    """(b, a) of a Butterworth high-pass, for lfilter."""
+    return butter(order, cutoff / (sr / 2), btype='high')
+
+
+def low_pass_coefficients(sr, cutoff=4000, order=1):
+    """(b, a) of a Butterworth low-pass, for lfilter."""
+    return butter(order, cutoff / (sr / 2), btype='low')
+
+
+def high_pass(signal, sr, cutoff=720):
+    return lfilter(*high_pass_coefficients(sr, cutoff), signal)
+
+
+def low_pass(signal, sr, cutoff=4000):
+    return lfilter(*low_pass_coefficients(sr, cutoff), signal)
+
+
+def smoothing_low_pass(signal, sr, cutoff=4000):
+    """Second-order low-pass of final_processing_touchups (low_pass is first order)."""
+    return lfilter(*low_pass_coefficients(sr, cutoff, order=2), signal)
+
+
+def apply_tube_screamer(signal, sr, drive=5, output_gain=1.0):
+    # Step 1: High-pass filter to tighten low end
+    filtered = high_pass(signal, sr)
+
+    # Step 2: Apply soft clipping distortion
+    clipped = soft_clip(filtered, drive=drive)
+
+    # Step 3: Low-pass filter to tame highs
+    filtered2 = low_pass(clipped, sr)
+
+    # Step 4: Output gain
+    output = filtered2 * output_gain
+
+    # Normalize to avoid clipping
+    return output / np.max(np.abs(output))
+
+
+def apply_tube_screamer_to_file(input_path, output_path, drive=5, output_gain=1.0):
+    import soundfile as sf
+
+    audio = loader.load(input_path)
+    signal, sr = audio.samples.copy(), audio.sr
+    signal /= np.max(np.abs(signal))  # Normalize input
+
+    processed = apply_tube_screamer(signal, sr, drive, output_gain)
+    sf.write(output_path, processed, sr)
+    print(f"✅ Tube Screamer overdrive applied and saved to: {output_path}")
+
+
+def process_full_chain(samples, sr, effect_chain, clean_mfcc=None, ref_mfcc=None):
+    """
+    Run the saturation, modulation/reverb and effect chain stages.
+    Takes mono float samples and returns the processed mono float32 signal.
+    """
+    samples = samples / np.max(np.abs(samples))
+
+    # Step 1: Core saturation effects
+    with instrument.stage("effect:tube_screamer"):
+        samples = apply_tube_screamer(samples, sr, **TUBE_SCREAMER)
+    with instrument.stage("effect:fuzz"):
+        samples = fuzz_distortion(samples, **FUZZ, in_place=True)
+
+    for effect in effect_chain:
+        if effect["effect"] == "chorus":
+            print("🎵 Adding chorus...")
+            with instrument.stage("effect:chorus"):
+                samples = apply_chorus(samples, sr)
+        elif effect["effect"] == "reverb":
+            print("🌫️ Adding reverb...")
+            with instrument.stage("effect:reverb"):
+                samples = apply_reverb(samples, sr, preset=effect.get("preset", "legacy"))
+    samples /= np.max(np.abs(samples))
+
+    # Step 2: Apply remaining effects (gain, filters, compressor) on a float32 buffer
+    audio = apply_effect_chain(AudioBuffer(samples, sr), effect_chain)
+    print("✅ Full processed tone rendered")
+    return audio.samples
+
+
+def match_volume_to_reference(processed, reference, sr_proc, target_loudness=None):
+    """
+    Adjust the volume of the processed audio to match the reference audio.
+
+    Parameters:
+        processed (np.ndarray): Processed mono signal
+        reference (np.ndarray): Reference mono signal
+        sr_proc (int): Sample rate of the processed signal
+        target_loudness (float): Cached LUFS of the normalized reference, if known
+    Returns:
+        np.ndarray: Volume-matched signal
+    """
+    # Normalize both signals (the reference is shared, so never in place)
+    processed = processed / np.max(np.abs(processed))
+    reference = reference / np.max(np.abs(reference))
+
+    # Compute RMS (root mean square) loudness
+    def rms(signal):
+        return np.sqrt(np.mean(signal**2))
+
+    rms_proc = rms(processed)
+    rms_ref = rms(reference)
+
+    # Scale processed signal to match reference RMS
+    gain = rms_ref / (rms_proc + 1e-9)  # avoid division by zero
+    processed_adjusted = processed * gain
+
+    # Normalize final output to prevent clipping
+    processed_adjusted /= np.max(np.abs(processed_adjusted))
+
+    with instrument.stage("match_loudness_lufs"):
+        lufs_matched = match_loudness_lufs(processed_adjusted, sr_proc, reference, target_loudness)
+    lufs_matched /= np.max(np.abs(lufs_matched)) * OUTPUT_HEADROOM  # avoid clipping
+
+    print("✅ Output volume matched to reference")
+    return lufs_matched
+
+
+def final_processing_touchups(processed_audio, reference_audio, sr_proc):
+    """
+    Filtering, pitch, dynamics and undertone stages on mono float signals.
+    Returns the touched-up signal.
+    """
+    # Normalize both signals (the reference is shared, so never in place)
+    processed_audio = processed_audio / np.max(np.abs(processed_audio))
+    reference_audio = reference_audio / np.max(np.abs(reference_audio))
+
+    # Compute RMS energy to determine loudness (accumulated in float64, so
+    # the streaming render's block sums round to the same float32 gain)
+    def rms(signal):
+        return np.sqrt(np.mean(np.square(signal, dtype=np.float64)))
+
+    rms_proc = rms(processed_audio)
+    rms_ref = rms(reference_audio)
+
+    # Compute gain factor to match loudness
+    gain_factor = np.float32(rms_ref / rms_proc)
+    processed_scaled = processed_audio * gain_factor
+
+    # Step 1: Filtering, then high-frequency compression to reduce harsh attack
+    with instrument.stage("compress_highs"):
+        processed_smoothed = smoothing_low_pass(processed_scaled, sr_proc, cutoff=SMOOTHING_CUTOFF)
+
+        processed_smoothed = compress_highs(processed_smoothed, sr_proc)
+
+    # Step 4: Pitch modification (optional but keep late)
+    with instrument.stage("pitch_down"):
+        backgrounded_audio = pitch_down(processed_smoothed, sr_proc, semitones=PITCH_SEMITONES)
+
+    # Step 2: Dynamic compression before adding background/reverb
+    with instrument.stage("match_dynamics"):
+        compressed_audio = match_dynamics(backgrounded_audio, reference_audio, sr_proc)
+
+    # Step 3: Background effects (post compression)
+    with instrument.stage("undertone_matching"):
+        backgrounded_audio = undertone_matching(compressed_audio, sr_proc)
+
+    # Step 5: Final normalization to prevent clipping after all processing
+    backgrounded_audio /= np.max(np.abs(backgrounded_audio))
+
+    return backgrounded_audio
+
+
+def match_loudness_lufs(signal, sr, reference_signal, target_loudness=None):
+    import pyloudnorm as pyln
+
+    meter = pyln.Meter(sr, block_size=0.1)  # use smaller block size
+    if len(signal) < int(sr * 0.1):
+        print("⚠️ Signal too short for LUFS matching. Skipping.")
+        return signal
+
+    current_loudness = meter.integrated_loudness(signal)
+    if target_loudness is None:
+        target_loudness = meter.integrated_loudness(reference_signal)
+
+    gain_db = target_loudness - current_loudness
+    gain_linear = 10 ** (gain_db / 20)
+
+    return signal * gain_linear
+
+
+def bandpass_coefficients(sr, lowcut, highcut):
+    """(b, a) of a second-order Butterworth band-pass, for lfilter."""
+    return butter(2, [lowcut / (sr/2), highcut / (sr/2)], btype='band')
+
+
+def bandpass_filter(signal, sr, lowcut, highcut):
+    return lfilter(*bandpass_coefficients(sr, lowcut, highcut), signal)
+
+
+def high_band_coefficients(sr, highcut=6000):
+    """(b, a) of the band compress_highs works on: highcut to just below Nyquist."""
+    return bandpass_coefficients(sr, highcut, 0.99 * sr//2)
+
+
+def compress_band(signal, band, threshold=0.2, ratio=4.0):
+    """Swap band (a filtered copy of signal) for itself compressed above threshold."""
+    compressed = np.where(np.abs(band) > threshold,
+                        threshold + (np.abs(band) - threshold) / ratio,
+                        band)
+    compressed *= np.sign(band)
+
+    # Subtract original band and add compressed band
+    return signal - band + compressed
+
+
+def compress_highs(signal, sr, threshold=0.2, ratio=4.0, highcut=6000):
+    highs = lfilter(*high_band_coefficients(sr, highcut), signal)
+
+    # Compress only high band
+    return compress_band(signal, highs, threshold, ratio)
+
+
+def match_dynamics(input_signal, ref_signal, sr, threshold_db=-20, ratio=4, attack=0.01, release=0.01):
+    """
+    Matches the dynamics of input_signal to that of ref_signal.
+    Applies compression-style gain shaping to reduce dynamic delta.
+    """
+    # If reference is longer, extract best matching segment before envelope extraction
+
+    ref_signal = framing.trim_leading_silence(ref_signal)
+    input_signal = input_signal / np.max(np.abs(input_signal))
+
+    if len(ref_signal) > len(input_signal):
+        # Coarse envelope match, then a short full-rate FFT refine
+        match = alignment.align(ref_signal, input_signal)
+        print(f"Aligned reference at sample {match.offset} (confidence {match.confidence:.2f})")
+        best_start = match.offset
+        ref_signal = ref_signal[best_start:best_start + len(input_signal)]
+
+    # Ensure both are same length
+    min_len = min(len(input_signal), len(ref_signal))
+    input_signal = input_signal[:min_len]
+    ref_signal = ref_signal[:min_len]
+
+    # --- ALIGN ONSETS BEFORE ENVELOPE EXTRACTION ---
+    # Compute RMS envelopes (frames must start before the last sample's frame,
+    # as the old loop had it, hence the [:-1])
+    input_env_for_onset = framing.rms(input_signal[:-1], frame_size=1024, hop_size=512)
+    ref_env_for_onset = framing.rms(ref_signal[:-1], frame_size=1024, hop_size=512)
+
+    # Normalize
+    input_env_for_onset /= np.max(input_env_for_onset)
+    ref_env_for_onset /= np.max(ref_env_for_onset)
+
+    # Detect onsets
+    input_onset = framing.detect_onset(input_env_for_onset)
+    ref_onset = framing.detect_onset(ref_env_for_onset)
+
+    # Compute offset in samples
+    frame_offset = ref_onset - input_onset
+    samples_per_frame = 512
+    sample_offset = frame_offset * samples_per_frame
+
+    # Shift reference to align onset
+    if sample_offset > 0:
+        ref_signal = ref_signal[sample_offset:]
+    elif sample_offset < 0:
+        ref_signal = np.pad(ref_signal, (abs(sample_offset), 0), mode='constant')
+
+    # Ensure both are same length again after onset shift
+    min_len = min(len(input_signal), len(ref_signal))
+    input_signal = input_signal[:min_len]
+    ref_signal = ref_signal[:min_len]
+
+    # --- END ONSET ALIGNMENT ---
+
+    # Step: Match average RMS loudness
+    def rms(signal):
+        return np.sqrt(np.mean(signal**2))
+
+    ref_rms = rms(ref_signal)
+    input_rms = rms(input_signal)
+
+    if input_rms > 0:
+        gain = ref_rms / input_rms
+    else:
+        gain = 1.0  # fallback to no change
+
+    # Apply constant gain to entire signal
+    output = input_signal * gain
+
+    # Optional: Normalize to prevent clipping
+    output /= np.max(np.abs(output))
+
+    print("Applied average volume matching:")
+    print("Ref RMS:", ref_rms, " | Input RMS:", input_rms, " | Gain:", gain)
+    print("Output shape:", output.shape)
+
+    return output
+
+
+def low_shelf_sos(sr, freq=200, gain_db=1.5):
+    # A Butterworth low-pass: rs only matters to elliptic and Chebyshev II designs
+    return sps.iirfilter(2, freq, rs=gain_db, btype='low', analog=False,
+                         ftype='butter', fs=sr, output='sos')
+
+
+def high_shelf_sos(sr, freq=5000, gain_db=1.0):
+    return sps.iirfilter(2, freq, rs=gain_db, btype='high', analog=False,
+                         ftype='butter', fs=sr, output='sos')
+
+
+def transient_sos(sr):
+    """The 2 kHz high-pass enhance_transients adds back."""
+    return sps.butter(2, 2000, 'hp', fs=sr, output='sos')
+
+
+def apply_low_shelf(signal, sr, freq=200, gain_db=1.5):
+    return sps.sosfilt(low_shelf_sos(sr, freq, gain_db), signal)
+
+
+def apply_high_shelf(signal, sr, freq=5000, gain_db=1.0):
+    return sps.sosfilt(high_shelf_sos(sr, freq, gain_db), signal)
+
+
+def add_transients(signal, transients, boost_db=1.5):
+    return signal + transients * 10 ** (boost_db / 20)
+
+
+def enhance_transients(signal, sr, boost_db=1.5):
+    return add_transients(signal, sps.sosfilt(transient_sos(sr), signal), boost_db)
+
+
+def simple_compressor(signal, threshold=0.25, ratio=2.5):
+    """Compress the peaks above threshold, in place."""
+    over_threshold = np.abs(signal) > threshold
+    signal[over_threshold] = np.sign(signal[over_threshold]) * (
+        threshold + (np.abs(signal[over_threshold]) - threshold) / ratio
+    )
+    return signal
+
+
+def undertone_matching(signal, sr):
+    """
+    Enhances a mono guitar signal to match the tone of a reference by:
+    - Slight low-shelf boost for warmth
+    - Gentle high-shelf boost for brightness
+    - Light transient enhancement
+    - Subtle compression to bring forward
+    Returns:
+        Processed signal (normalized)
+    """
+    processed = apply_low_shelf(signal, sr)
+    processed = apply_high_shelf(processed, sr)
+    processed = enhance_transients(processed, sr)
+    processed = simple_compressor(processed)
+
+    # Normalize
+    return processed / np.max(np.abs(processed))
+
+
+def extract_guitar_demucs(ref_file_path):
+    """
+    Extracts the 'other' stem (likely guitar) with the separation service
+    (htdemucs by default), cached by the reference's audio content.
+    Writes it next to the reference and returns that path, or None if
+    extraction fails.
+    """
+    import soundfile as sf
+    from scripts import separation
+
+    if not os.path.exists(ref_file_path):
+        raise FileNotFoundError(f"Reference file does not exist: {ref_file_path}")
+
+    ref_basename = os.path.splitext(ref_file_path)[0]
+    reference = loader.decode(ref_file_path)
+
+    print(f"Separating stems of: {ref_file_path}")
+    try:
+        other = separation.get_service().separate(*reference, stem="other")
+    except Exception as e:
+        print(f"Error running Demucs: {e}")
+        return None
+
+    output_path = f"{ref_basename}_other.wav"
+    sf.write(output_path, other, reference[1])
+    return output_path
@@ -0,0 +1,203 @@
+"""
+Output encoding for generate().
+
+The request picks the format of the uploaded render:
+
+- wav:  PCM, 16 or 24 bit, or 32-bit float
+- flac: lossless, 16 or 24 bit, usually about half the size of WAV
+- opus: Ogg Opus preview. Opus only runs at 8/12/16/24/48 kHz, so other
+  rates are resampled on the way in.
+- mp3:  MPEG layer III preview (libsndfile >= 1.1)
+
+negotiate() resolves the format from the request, then from the output
+link's extension, then from DETECTFX_OUTPUT_FORMAT. Encoder takes the
+render block by block: the streaming render writes into it directly, and a
+whole render is fed through it in ENCODE_BLOCK pieces. Either way the
+encoded file builds up in a spooled temp file that the upload streams from.
+Encoder counts the time it spends so jobs can report it.
+"""
+import os
+import tempfile
+import time
+
+import soundfile as sf
+
+from scripts.fetch import SPOOL_MAX_BYTES
+
+DEFAULT_FORMAT = os.getenv("DETECTFX_OUTPUT_FORMAT", "wav")
+DEFAULT_BIT_DEPTH = int(os.getenv("DETECTFX_OUTPUT_BIT_DEPTH", "16"))
+# Frames per write when encoding a whole buffer
+ENCODE_BLOCK = 65536
+
+
+class OutputFormat:
+    """One output format: its soundfile container, subtypes and upload content type."""
+
+    def __init__(self, name, container, subtypes, content_type, extensions, rates=None):
+        self.name = name
+        self.container = container
+        # bit depth -> soundfile subtype; a lossy format has the single key None
+        self.subtypes = subtypes
+        self.content_type = content_type
+        self.extensions = extensions
+        # Sample rates the codec accepts, None for any
+        self.rates = rates
+
+    @property
+    def lossless(self):
+        return None not in self.subtypes
+
+    def subtype(self, bit_depth=None):
+        if not self.lossless:
+            if bit_depth is not None:
+                raise ValueError(f"{self.name} is lossy and has no bit depth")
+            return self.subtypes[None]
+        bit_depth = bit_depth or DEFAULT_BIT_DEPTH
+        if bit_depth not in self.subtypes:
+            raise ValueError(f"{self.name} supports bit depths {sorted(self.subtypes)}, not {bit_depth}")
+        return self.subtypes[bit_depth]
+
+    def rate_for(self, sr):
+        """The sample rate to encode sr at: sr itself, or the lowest accepted rate above it."""
+        if self.rates is None or sr in self.rates:
+            return sr
+        higher = [rate for rate in self.rates if rate >= sr]
+        return min(higher) if higher else max(self.rates)
+
+
+FORMATS = {
+    "wav": OutputFormat("wav", "WAV", {16: "PCM_16", 24: "PCM_24", 32: "FLOAT"}, "audio/wav", (".wav",)),
+    "flac": OutputFormat("flac", "FLAC", {16: "PCM_16", 24: "PCM_24"}, "audio/flac", (".flac",)),
+    "opus": OutputFormat("opus", "OGG", {None: "OPUS"}, "audio/ogg", (".opus", ".ogg"),
+                         rates=(8000, 12000, 16000, 24000, 48000)),
+    "mp3": OutputFormat("mp3", "MP3", {None: "MPEG_LAYER_III"}, "audio/mpeg", (".mp3",),
+                        rates=(8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000)),
+}
+
+
+class OutputSpec:
+    """A negotiated output: format plus subtype."""
+
+    def __init__(self, output_format, bit_depth=None):
+        self.format = output_format
+        self.subtype = output_format.subtype(bit_depth)
+        self.bit_depth = (bit_depth or DEFAULT_BIT_DEPTH) if output_format.lossless else None
+
+    @property
+    def content_type(self):
+        return self.format.content_type
+
+    def describe(self):
+        return {"format": self.format.name, "bit_depth": self.bit_depth, "content_type": self.content_type}
+
+
+def format_from_link(link):
+    """The format an output link's extension names, or None."""
+    if not link:
+        return None
+    path = link.split("?", 1)[0].lower()
+    for output_format in FORMATS.values():
+        if path.endswith(output_format.extensions):
+            return output_format.name
+    return None
+
+
+def negotiate(output_format=None, bit_depth=None, output_link=None):
+    """
+    Resolve the output of a job. Raises ValueError for an unknown format or
+    an unsupported bit depth.
+
+    Parameters:
+        output_format: requested format name, or None
+        bit_depth: requested bit depth (lossless formats only), or None for the default
+        output_link: upload path; its extension is used when no format is requested
+    Returns:
+        OutputSpec
+    """
+    name = (output_format or format_from_link(output_link) or DEFAULT_FORMAT).lower()
+    if name not in FORMATS:
+        raise ValueError(f"Unknown output format '{name}', expected one of {sorted(FORMATS)}")
+    linked = format_from_link(output_link)
+    if linked is not None and linked != name:
+        print(f"[ENCODE] output link {output_link} has a .{linked} extension, encoding {name}")
+    return OutputSpec(FORMATS[name], bit_depth)
+
+
+class Encoder:
+    """
+    Streaming encoder: write() consecutive mono blocks at sr, then close().
+    The encoded file is `self.file`, rewound after close(); the caller closes it.
+    """
+
+    def __init__(self, spec, sr, target=None):
+        self.spec = spec
+        self.sr = sr
+        self.rate = spec.format.rate_for(sr)
+        self.resampler = None
+        if self.rate != sr:
+            # Only Opus/MP3 at an unsupported rate resample; scipy stays unimported otherwise
+            from scripts.resample import StreamResampler
+            self.resampler = StreamResampler(sr, self.rate)
+        self.file = target if target is not None else tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        self.frames = 0
+        self.size = None
+        self.seconds = 0.0
+        self.sound = sf.SoundFile(self.file, "w", samplerate=self.rate, channels=1,
+                                  format=spec.format.container, subtype=spec.subtype)
+
+    def write(self, block):
+        start = time.perf_counter()
+        if self.resampler is not None:
+            block = self.resampler(block)
+        if len(block):
+            self.sound.write(block)
+        self.frames += len(block)
+        self.seconds += time.perf_counter() - start
+
+    __call__ = write
+
+    def close(self):
+        """Finish the stream and return the rewound encoded file."""
+        start = time.perf_counter()
+        if self.resampler is not None:
+            tail = self.resampler.flush()
+            if len(tail):
+                self.sound.write(tail)
+            self.frames += len(tail)
+        self.sound.close()
+        self.file.seek(0, os.SEEK_END)
+        self.size = self.file.tell()
+        self.file.seek(0)
+        self.seconds += time.perf_counter() - start
+        return self.file
+
+    def summary(self):
+        return {**self.spec.describe(), "sample_rate": self.rate, "bytes": self.size,
+                "seconds": round(self.frames / self.rate, 3), "encode_s": round(self.seconds, 3)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.sound.close()
+            self.file.close()
+
+
+def encode(samples, sr, spec, block=ENCODE_BLOCK):
+    """
+    Encode a whole mono buffer block by block (no full-size converted copy).
+
+    Parameters:
+        samples: mono float np.ndarray
+        sr: sample rate of samples
+        spec: OutputSpec from negotiate()
+    Returns:
+        the finished Encoder; encoder.file holds the encoded bytes
+    """
+    encoder = Encoder(spec, sr)
+    with encoder:
+        for start in range(0, len(samples), block):
+            encoder.write(samples[start:start + block])
+        encoder.close()
+    return encoder
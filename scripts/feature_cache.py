@@ -0,0 +1,165 @@
+"""
+Content-addressed on-disk cache for analysis results.
+
+Entries are keyed by a SHA-256 of the decoded PCM (or a storage ETag) plus
+CACHE_VERSION, so re-uploads of the same audio hit the cache no matter what
+the object is called, and bumping CACHE_VERSION when feature code changes
+invalidates every old entry. Each entry is a single compressed .npz file.
+The directory is kept under a size budget by evicting least recently used
+entries (file mtime is refreshed on every hit).
+"""
+import hashlib
+import os
+import tempfile
+import weakref
+
+import numpy as np
+
+# Bump whenever scripts/features.py or scripts/analysis.py change their output
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.getenv(
+    "DETECTFX_CACHE_DIR", os.path.join(tempfile.gettempdir(), "detectfx", "features"))
+DEFAULT_MAX_BYTES = int(os.getenv("DETECTFX_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+
+def audio_key(samples, sr, namespace):
+    """Cache key for decoded PCM samples, an array or a mono spool (hashed block by block)."""
+    if isinstance(samples, np.ndarray):
+        samples = np.ascontiguousarray(samples)
+        shape, blocks = samples.shape, [samples]
+    else:
+        shape, blocks = (len(samples),), samples.blocks()
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_VERSION}:{namespace}:{sr}:{samples.dtype.str}:{shape}".encode())
+    for block in blocks:
+        digest.update(memoryview(np.ascontiguousarray(block)).cast("B"))
+    return digest.hexdigest()
+
+
+def etag_key(etag, namespace):
+    """Cache key for a storage object ETag, for when hashing the PCM is not possible."""
+    return hashlib.sha256(f"v{CACHE_VERSION}:{namespace}:etag:{etag}".encode()).hexdigest()
+
+
+class FeatureCache:
+    """Size-bounded LRU cache of named NumPy arrays, one .npz file per key."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        """Return the stored arrays as a dict, or None on a miss."""
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # Truncated or corrupt entry, drop it and treat as a miss
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return arrays
+
+    def put(self, key, **arrays):
+        """Store arrays under key (atomic replace), then enforce the size budget."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+        self.evict()
+
+    def update(self, key, **arrays):
+        """Merge arrays into an existing entry."""
+        merged = self.get(key) or {}
+        merged.update(arrays)
+        self.put(key, **merged)
+
+    def evict(self):
+        """Delete least recently used entries until the directory fits max_bytes."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(os.path.join(self.directory, name))
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_fingerprints = weakref.WeakKeyDictionary()
+
+
+def model_fingerprint(model):
+    """
+    Content hash of a fitted model, so cached predictions are only reused for the
+    exact model that produced them. Computed once per model object.
+    """
+    try:
+        return _fingerprints[model]
+    except (KeyError, TypeError):
+        pass
+    import joblib
+    fingerprint = joblib.hash(model)
+    try:
+        _fingerprints[model] = fingerprint
+    except TypeError:
+        pass
+    return fingerprint
+
+
+def encode_predictions(predictions):
+    """Turn a {effect: probability} dict into arrays that fit in an .npz entry."""
+    return {
+        "prediction_names": np.array(list(predictions.keys()), dtype=np.str_),
+        "prediction_probs": np.array(list(predictions.values()), dtype=np.float64),
+    }
+
+
+def decode_predictions(entry):
+    """Inverse of encode_predictions, keeping the stored order."""
+    return {str(name): float(prob)
+            for name, prob in zip(entry["prediction_names"], entry["prediction_probs"])}
+
+
+_default_cache = None
+
+
+def get_cache():
+    """Process-wide cache in DEFAULT_CACHE_DIR."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = FeatureCache()
+    return _default_cache
@@ -0,0 +1,205 @@
+"""
+Shared-STFT feature extraction used by classify() and generate().
+
+The magnitude spectrogram is computed once and every spectral descriptor
+(MFCC, centroid, bandwidth, rolloff, flatness) is derived from it. RMS and
+zero crossing rate are time-domain frame statistics and never needed an STFT.
+The STFT parameters are librosa's feature defaults, so each descriptor is the
+same number librosa.feature.<name>(y=y) returns.
+
+extract_features_blocks() gives the same record for a signal read block by
+block (a spool), holding only a batch of frames and the per-frame values.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import librosa
+
+from scripts.spool import Spool
+
+N_FFT = 2048
+HOP_LENGTH = 512
+N_MFCC = 13
+# power_to_db's default floor below the loudest mel bin
+TOP_DB = 80.0
+# Frames analysed at once by extract_features_blocks
+BATCH_FRAMES = 256
+
+
+@dataclass(frozen=True)
+class AudioFeatures:
+    """Per-file descriptors. Scalars are means over frames."""
+    sr: int
+    mfcc: np.ndarray  # (n_mfcc, frames)
+    centroid: float
+    bandwidth: float
+    rolloff: float
+    flatness: float
+    rms: float
+    zcr: float
+
+    @property
+    def mfcc_mean(self):
+        return np.mean(self.mfcc, axis=1)
+
+    def classifier_vector(self):
+        """
+        The 16 value row fed to clf.predict_proba:
+        13 MFCC means, ZCR, spectral centroid, spectral bandwidth.
+        """
+        features = np.zeros(16, dtype=np.float32)
+        features[:13] = self.mfcc_mean[:13]
+        features[13] = self.zcr
+        features[14] = self.centroid
+        features[15] = self.bandwidth
+        return features.reshape(1, -1)
+
+    def tone_vector(self):
+        """generate()'s comparison vector: centroid, rolloff, flatness, rms, zcr, MFCC means."""
+        return np.array([self.centroid, self.rolloff, self.flatness, self.rms, self.zcr]
+                        + list(self.mfcc_mean))
+
+
+def magnitude_spectrogram(y, n_fft=N_FFT, hop_length=HOP_LENGTH, center=True):
+    """|STFT| with the framing librosa's spectral features use by default."""
+    return np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length, center=center, pad_mode="constant"))
+
+
+def _spectral(S, sr, n_fft, hop_length):
+    """Per-frame centroid, bandwidth, rolloff, flatness and mel power of magnitude frames S."""
+    centroid = librosa.feature.spectral_centroid(S=S, sr=sr, n_fft=n_fft, hop_length=hop_length)
+    bandwidth = librosa.feature.spectral_bandwidth(S=S, sr=sr, n_fft=n_fft, hop_length=hop_length)
+    rolloff = librosa.feature.spectral_rolloff(S=S, sr=sr, n_fft=n_fft, hop_length=hop_length)
+    flatness = librosa.feature.spectral_flatness(S=S, n_fft=n_fft, hop_length=hop_length)
+    mel = librosa.feature.melspectrogram(S=S ** 2, sr=sr, n_fft=n_fft, hop_length=hop_length)
+    return centroid, bandwidth, rolloff, flatness, mel
+
+
+def extract_features(y, sr, n_mfcc=N_MFCC, n_fft=N_FFT, hop_length=HOP_LENGTH):
+    """
+    Compute every descriptor for a mono signal from a single STFT.
+
+    Parameters:
+        y: mono float np.ndarray
+        sr: sample rate of y
+        n_mfcc: number of MFCC coefficients
+    Returns:
+        AudioFeatures
+    """
+    S = magnitude_spectrogram(y, n_fft=n_fft, hop_length=hop_length)
+    centroid, bandwidth, rolloff, flatness, mel = _spectral(S, sr, n_fft, hop_length)
+
+    # Same as librosa.feature.mfcc(y=y): log power mel spectrogram, then DCT
+    mfcc = librosa.feature.mfcc(S=librosa.power_to_db(mel, top_db=TOP_DB), sr=sr, n_mfcc=n_mfcc)
+    del S, mel
+
+    rms = librosa.feature.rms(y=y, frame_length=n_fft, hop_length=hop_length)
+    zcr = librosa.feature.zero_crossing_rate(y, frame_length=n_fft, hop_length=hop_length)
+
+    return AudioFeatures(
+        sr=sr,
+        mfcc=mfcc,
+        centroid=float(np.mean(centroid)),
+        bandwidth=float(np.mean(bandwidth)),
+        rolloff=float(np.mean(rolloff)),
+        flatness=float(np.mean(flatness)),
+        rms=float(np.mean(rms)),
+        zcr=float(np.mean(zcr)),
+    )
+
+
+def extract_features_blocks(blocks, sr, n_mfcc=N_MFCC, n_fft=N_FFT, hop_length=HOP_LENGTH):
+    """
+    extract_features() of a mono signal that arrives as consecutive blocks.
+
+    Frames are cut as soon as their samples are in, with the signal padded by
+    n_fft // 2 at both ends as the centered framing pads it (zeros, or the
+    edge samples for the zero crossing rate). Only the per-frame values are
+    kept. The log mel frames wait in a Spool until the loudest one is known,
+    which sets power_to_db's TOP_DB floor.
+
+    Parameters:
+        blocks: iterable of consecutive mono float np.ndarray blocks
+        sr: sample rate of the signal
+        n_mfcc: number of MFCC coefficients
+    Returns:
+        AudioFeatures, equal to extract_features() of the joined signal up to
+        float rounding
+    """
+    half = n_fft // 2
+    columns = []
+    log_mel = Spool()
+    top = None
+    # The padded signal from index `base` on; frame t starts at t * hop_length
+    buffer = None
+    base = 0
+    frame = 0
+    edges = None
+    n_mels = None
+
+    def analyse(stop_frame, length):
+        nonlocal buffer, base, frame, top, n_mels
+        while frame < stop_frame:
+            count = min(BATCH_FRAMES, stop_frame - frame)
+            start = frame * hop_length - base
+            chunk = buffer[start:start + (count - 1) * hop_length + n_fft]
+            # The zero crossing rate pads with the edge samples instead of zeros
+            edged = chunk.copy()
+            first = frame * hop_length
+            edged[:max(0, half - first)] = edges[0]
+            if length is not None:
+                edged[max(0, length + half - first):] = edges[1]
+
+            S = magnitude_spectrogram(chunk, n_fft=n_fft, hop_length=hop_length, center=False)
+            centroid, bandwidth, rolloff, flatness, mel = _spectral(S, sr, n_fft, hop_length)
+            mel = librosa.power_to_db(mel, top_db=None)
+            top = mel.max() if top is None else max(top, mel.max())
+            n_mels = mel.shape[0]
+            log_mel.write(np.ravel(mel.T))
+            rms = librosa.feature.rms(y=chunk, frame_length=n_fft, hop_length=hop_length, center=False)
+            zcr = librosa.feature.zero_crossing_rate(edged, frame_length=n_fft, hop_length=hop_length,
+                                                     center=False)
+            columns.append((centroid, bandwidth, rolloff, flatness, rms, zcr))
+            frame += count
+        # Keep what the next frame needs
+        drop = frame * hop_length - base
+        buffer = buffer[drop:]
+        base += drop
+
+    received = 0
+    for block in blocks:
+        if not len(block):
+            continue
+        if buffer is None:
+            buffer = np.zeros(half, dtype=block.dtype)
+            edges = [block[0], None]
+        buffer = np.concatenate([buffer, block])
+        received += len(block)
+        edges[1] = block[-1]
+        complete = (half + received - n_fft) // hop_length + 1 if half + received >= n_fft else 0
+        # Whole batches only, so small blocks do not mean small STFTs
+        analyse(frame + (complete - frame) // BATCH_FRAMES * BATCH_FRAMES, None)
+    buffer = np.concatenate([buffer, np.zeros(half, dtype=buffer.dtype)])
+    analyse(1 + received // hop_length, received)
+
+    # power_to_db(mel) with its TOP_DB floor, then the DCT, a batch at a time
+    floor = top - TOP_DB
+    mfcc = []
+    for batch in log_mel.blocks(BATCH_FRAMES * n_mels):
+        batch = np.maximum(batch.reshape(-1, n_mels).T, floor)
+        mfcc.append(librosa.feature.mfcc(S=batch, sr=sr, n_mfcc=n_mfcc))
+    log_mel.close()
+    mfcc = np.concatenate(mfcc, axis=1)
+
+    centroid, bandwidth, rolloff, flatness, rms, zcr = (np.concatenate(values, axis=-1)
+                                                        for values in zip(*columns))
+    return AudioFeatures(
+        sr=sr,
+        mfcc=mfcc,
+        centroid=float(np.mean(centroid)),
+        bandwidth=float(np.mean(bandwidth)),
+        rolloff=float(np.mean(rolloff)),
+        flatness=float(np.mean(flatness)),
+        rms=float(np.mean(rms)),
+        zcr=float(np.mean(zcr)),
+    )
@@ -0,0 +1,130 @@
+"""
+Async HTTP fetch layer for audio downloads.
+
+One process-wide httpx.AsyncClient keeps a keep-alive connection pool, so
+repeated downloads from Supabase storage reuse TLS connections. Bodies are
+streamed in chunks to a temp file, or to a spooled buffer a decoder can read,
+so the whole file is never held as one `bytes` object. Transient failures are retried with backoff.
+"""
+import asyncio
+import io
+import os
+import tempfile
+
+import httpx
+
+MAX_CONNECTIONS = int(os.getenv("DETECTFX_HTTP_MAX_CONNECTIONS", "50"))
+RETRIES = int(os.getenv("DETECTFX_HTTP_RETRIES", "3"))
+CHUNK_SIZE = 64 * 1024
+# Spooled downloads stay in memory up to this size, then move to disk
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+TIMEOUT = httpx.Timeout(connect=5.0, read=30.0, write=30.0, pool=30.0)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_client = None
+
+
+class FetchError(Exception):
+    """Download failed for good (non-retryable status or retries exhausted)."""
+
+
+def get_client():
+    """The shared AsyncClient, created on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=TIMEOUT,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                max_keepalive_connections=MAX_CONNECTIONS),
+            follow_redirects=True,
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _stream_into(url, sink, retries=RETRIES, headers=None, limit=None):
+    """
+    Stream url into the writable file object `sink`. Returns the response headers.
+    The sink is rewound and truncated before every retry. With `limit`, reading
+    stops once that many bytes have arrived.
+    """
+    client = get_client()
+    for attempt in range(retries + 1):
+        try:
+            async with client.stream("GET", url, headers=headers) as response:
+                if response.status_code in RETRY_STATUS and attempt < retries:
+                    raise httpx.HTTPStatusError(
+                        f"Retryable status {response.status_code}", request=response.request, response=response)
+                if response.status_code not in (200, 206):
+                    raise FetchError(f"Failed to download {url}: HTTP {response.status_code}")
+                sink.seek(0)
+                sink.truncate()
+                received = 0
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    sink.write(chunk)
+                    received += len(chunk)
+                    if limit is not None and received >= limit:
+                        break
+                sink.flush()
+                return response.headers
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            if attempt == retries:
+                raise FetchError(f"Failed to download {url}: {e}") from e
+            await asyncio.sleep(0.25 * 2 ** attempt)
+
+
+async def download_to_tempfile(url, suffix=".wav"):
+    """Stream url to a new temp file. Returns (path, ETag); the caller deletes the file."""
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            headers = await _stream_into(url, f)
+    except BaseException:
+        os.remove(path)
+        raise
+    print("Saved to temp:", path)
+    return path, headers.get("ETag")
+
+
+async def download_to_spool(url):
+    """
+    Stream url into a SpooledTemporaryFile (memory first, disk past SPOOL_MAX_BYTES),
+    rewound and ready for soundfile to decode. Returns (file, ETag).
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        headers = await _stream_into(url, spool)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, headers.get("ETag")
+
+
+async def fetch_head(url, nbytes=64 * 1024):
+    """
+    The first nbytes of url, via a Range request. Returns (bytes, total size),
+    with total size None when the server does not say.
+    """
+    buffer = io.BytesIO()
+    headers = await _stream_into(url, buffer, headers={"Range": f"bytes=0-{nbytes - 1}"}, limit=nbytes)
+    # "bytes 0-65535/1234567" on a 206; a server that ignores Range sends the whole length
+    content_range = headers.get("Content-Range", "")
+    total = content_range.rpartition("/")[2] if content_range else headers.get("Content-Length")
+    return buffer.getvalue()[:nbytes], int(total) if total and total.isdigit() else None
+
+
+async def download_many(urls, suffix=".wav"):
+    """
+    Download every url concurrently over the shared pool.
+    Returns one (path, ETag) tuple or exception per url, in input order.
+    """
+    return await asyncio.gather(*(download_to_tempfile(url, suffix) for url in urls),
+                                return_exceptions=True)
@@ -0,0 +1,148 @@
+"""
+Framing and envelope utilities.
+
+Frames are strided views into the signal (sliding_window_view), never
+copies, and every per-frame statistic is one NumPy reduction over a batch of
+frames. Only the temporaries for one batch of BATCH_FRAMES frames are held at a
+time. Rows are reduced exactly as the old per-frame loops reduced each slice,
+so envelopes, onsets and trim points come out identical.
+
+Frames start every hop_size samples. By default only whole frames count.
+With partial=True, frames that run past the end are included, shortened.
+That matches the chunk loops that sliced signal[i:i + size] up to len(signal).
+"""
+import numpy as np
+
+BATCH_FRAMES = 4096
+
+
+def frame_count(length, frame_size, hop_size, partial=False):
+    """Number of frames framing functions produce for a signal of `length` samples."""
+    if partial:
+        return -(-length // hop_size) if length > 0 else 0
+    return (length - frame_size) // hop_size + 1 if length >= frame_size else 0
+
+
+def frames(signal, frame_size, hop_size):
+    """Read-only (frames, frame_size) view of the whole frames of a 1-D signal."""
+    signal = np.asarray(signal)
+    if len(signal) < frame_size:
+        return np.empty((0, frame_size), dtype=signal.dtype)
+    return np.lib.stride_tricks.sliding_window_view(signal, frame_size)[::hop_size]
+
+
+def _reduce(signal, frame_size, hop_size, reduce, partial=False, scale=None, start=0, stop=None):
+    """
+    reduce(batch) -> one value per row, applied to frames start..stop in batches.
+    With `scale`, frames are divided by it first, as if the signal had been.
+    """
+    signal = np.asarray(signal)
+    whole = frame_count(len(signal), frame_size, hop_size)
+    total = frame_count(len(signal), frame_size, hop_size, partial)
+    stop = total if stop is None else min(stop, total)
+    view = frames(signal, frame_size, hop_size)
+
+    out = []
+    for first in range(start, min(stop, whole), BATCH_FRAMES):
+        batch = view[first:min(first + BATCH_FRAMES, stop, whole)]
+        out.append(reduce(batch if scale is None else batch / scale))
+    # Frames cut short by the end of the signal (fewer than frame_size / hop_size)
+    for index in range(max(start, whole), stop):
+        tail = signal[index * hop_size:index * hop_size + frame_size][np.newaxis]
+        out.append(reduce(tail if scale is None else tail / scale))
+    if not out:
+        return np.zeros(0, dtype=signal.dtype if np.issubdtype(signal.dtype, np.floating) else np.float64)
+    return np.concatenate(out)
+
+
+def _rms_rows(batch):
+    return np.sqrt(np.mean(batch ** 2, axis=1))
+
+
+def _peak_rows(batch):
+    return np.max(np.abs(batch), axis=1)
+
+
+def rms(signal, frame_size=1024, hop_size=512, partial=False, scale=None):
+    """
+    Framed RMS envelope.
+
+    Parameters:
+        signal: mono np.ndarray
+        frame_size: samples per frame
+        hop_size: samples between frame starts
+        partial: include frames cut short by the end of the signal
+        scale: divide frames by this first (e.g. a peak, to skip normalizing a copy)
+    Returns:
+        np.ndarray with one RMS value per frame
+    """
+    return _reduce(signal, frame_size, hop_size, _rms_rows, partial, scale)
+
+
+def peak(signal, frame_size=512, hop_size=None, partial=True):
+    """Framed peak (max |x|) envelope. Frames are back to back unless hop_size is given."""
+    return _reduce(signal, frame_size, hop_size or frame_size, _peak_rows, partial)
+
+
+def rms_blocks(blocks, frame_size=1024, hop_size=512):
+    """
+    rms() of a signal that arrives as consecutive blocks, e.g. from a spool.
+    Only whole frames; the samples of an unfinished frame carry over to the
+    next block. Same values as rms() over the joined signal.
+    """
+    out = []
+    carry = None
+    for block in blocks:
+        line = block if carry is None or not len(carry) else np.concatenate([carry, block])
+        count = frame_count(len(line), frame_size, hop_size)
+        if count:
+            out.append(rms(line, frame_size, hop_size))
+        carry = line[count * hop_size:]
+    return np.concatenate(out) if out else np.zeros(0)
+
+
+def detect_onset(env, threshold=0.1):
+    """First frame where the envelope rises by more than threshold, or 0."""
+    onset_candidates = np.flatnonzero(np.diff(env) > threshold)
+    return onset_candidates[0] if len(onset_candidates) > 0 else 0
+
+
+def leading_silence(signal, threshold=0.01, chunk_size=1024, scale=None):
+    """
+    Start of the first chunk whose RMS is above threshold, or 0 if there is none.
+    Chunks are scanned a batch at a time, so a loud start costs one batch.
+    """
+    total = frame_count(len(signal), chunk_size, chunk_size, partial=True)
+    for first in range(0, total, BATCH_FRAMES):
+        stop = min(first + BATCH_FRAMES, total)
+        batch = _reduce(signal, chunk_size, chunk_size, _rms_rows, True, scale, first, stop)
+        loud = np.flatnonzero(batch > threshold)
+        if len(loud):
+            return (first + int(loud[0])) * chunk_size
+    return 0
+
+
+def leading_silence_blocks(blocks, threshold=0.01, chunk_size=1024, scale=None):
+    """
+    leading_silence() of a signal that arrives as consecutive blocks. Reading
+    stops at the first loud chunk; the last, short chunk counts as well.
+    """
+    carry = np.zeros(0)
+    offset = 0
+    for block in blocks:
+        line = block if not len(carry) else np.concatenate([carry, block])
+        whole = len(line) // chunk_size * chunk_size
+        if whole:
+            loud = np.flatnonzero(rms(line[:whole], chunk_size, chunk_size, scale=scale) > threshold)
+            if len(loud):
+                return offset + int(loud[0]) * chunk_size
+        carry = line[whole:]
+        offset += whole
+    if len(carry) and rms(carry, chunk_size, chunk_size, partial=True, scale=scale)[0] > threshold:
+        return offset
+    return 0
+
+
+def trim_leading_silence(signal, threshold=0.01, chunk_size=1024):
+    """View of signal from its first chunk above threshold (RMS); all silent -> signal."""
+    return signal[leading_silence(signal, threshold, chunk_size):]
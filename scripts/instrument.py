@@ -0,0 +1,355 @@
+"""
+Per-stage instrumentation.
+
+A Trace records every stage of a job (download, decode, analysis, each
+effect, touch-ups, loudness, upload):
+
+- wall time, and CPU time of the process (time.process_time, so other work
+  in the same process counts too, as with admission.PeakSampler)
+- peak RSS while the stage ran, and how far it rose above the RSS at the
+  start. One sampler thread per process polls RSS for every open stage.
+- with DETECTFX_TRACEMALLOC=1, the peak of Python/NumPy allocations
+  (tracemalloc) above the level at the stage's start. Off by default,
+  tracing allocations is not free.
+
+Stages nest: stage() spans record their parent. switch() ends the current
+top-level stage and starts the next, which matches generate()'s
+report_progress. Code deep in the chain calls the module-level stage(),
+which attaches to the trace active in the current context and does nothing
+when there is none (e.g. in the feature pool's processes).
+
+Finished traces go into process-wide Prometheus histograms (record()) that
+/metrics renders. Render jobs trace in their worker process and return the
+trace with their result. The server records it, so all histograms live in
+the server process.
+"""
+import bisect
+import contextvars
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+TRACEMALLOC = os.getenv("DETECTFX_TRACEMALLOC") == "1"
+# Seconds between RSS samples while a stage is open
+RSS_INTERVAL = float(os.getenv("DETECTFX_RSS_INTERVAL", "0.01"))
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+MB_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2000, 4000)
+MB = 1024 * 1024
+
+_current = contextvars.ContextVar("detectfx_trace", default=None)
+
+# Open stages of every trace in this process, polled by the sampler thread
+_open_spans = []
+_spans_changed = threading.Condition()
+_sampler = None
+
+
+def _sample():
+    import psutil
+    process = psutil.Process(os.getpid())
+    while True:
+        with _spans_changed:
+            while not _open_spans:
+                _spans_changed.wait()
+        rss = process.memory_info().rss
+        with _spans_changed:
+            _observe_rss(rss)
+        time.sleep(RSS_INTERVAL)
+
+
+def _observe_rss(rss):
+    # Caller holds _spans_changed
+    for span in _open_spans:
+        if rss > span["_rss_peak"]:
+            span["_rss_peak"] = rss
+
+
+def _remove(spans, span):
+    # By identity: two spans can hold equal values
+    for index, other in enumerate(spans):
+        if other is span:
+            del spans[index]
+            return
+
+
+def _rss():
+    import psutil
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+class Trace:
+    """
+    Stages of one job. start()/stop() (or `with`) bracket the job and make
+    the trace current for stage() calls in this context.
+    With record=True, stop() adds the trace to the process's histograms.
+    """
+
+    def __init__(self, kind, record=True, tracemalloc_enabled=TRACEMALLOC):
+        self.kind = kind
+        self.record = record
+        self.spans = []
+        self._open = []
+        self._switched = None
+        self._tracemalloc = tracemalloc_enabled
+        self._started_tracemalloc = False
+        self._token = None
+        self.finished = False
+        self.wall_s = None
+        self.cpu_s = None
+
+    def start(self):
+        global _sampler
+        # A job that died mid-trace leaves its trace current; close it out
+        stale = _current.get()
+        if stale is not None and not stale.finished:
+            stale.stop()
+        with _spans_changed:
+            if _sampler is None:
+                _sampler = threading.Thread(target=_sample, name="trace-rss", daemon=True)
+                _sampler.start()
+        if self._tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._token = _current.set(self)
+        return self
+
+    def stop(self):
+        if self.finished:
+            return self
+        while self._open:
+            self._end(self._open[-1])
+        self.wall_s = round(time.perf_counter() - self._wall, 4)
+        self.cpu_s = round(time.process_time() - self._cpu, 4)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Stopped from another context; just make sure it is not current here
+            if _current.get() is self:
+                _current.set(None)
+        self.finished = True
+        if self.record:
+            record(self.to_dict())
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def _begin(self, name):
+        span = {"stage": name, "parent": self._open[-1]["stage"] if self._open else None}
+        rss = _rss()
+        span["_rss_start"] = span["_rss_peak"] = rss
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # Bank the enclosing stages' peaks before resetting the global one
+            for other in self._open:
+                other["_traced_peak"] = max(other.get("_traced_peak", 0), peak)
+            tracemalloc.reset_peak()
+            span["_traced_start"] = span["_traced_peak"] = current
+        with _spans_changed:
+            _observe_rss(rss)
+            self._open.append(span)
+            self.spans.append(span)
+            _open_spans.append(span)
+            _spans_changed.notify()
+        span["_wall"] = time.perf_counter()
+        span["_cpu"] = time.process_time()
+        return span
+
+    def _end(self, span):
+        wall = time.perf_counter() - span.pop("_wall")
+        cpu = time.process_time() - span.pop("_cpu")
+        rss = _rss()
+        with _spans_changed:
+            _observe_rss(rss)
+            _remove(self._open, span)
+            _remove(_open_spans, span)
+        peak = max(span.pop("_rss_peak"), rss)
+        span["wall_s"] = round(wall, 4)
+        span["cpu_s"] = round(cpu, 4)
+        span["rss_peak_mb"] = round(peak / MB, 1)
+        span["rss_growth_mb"] = round((peak - span.pop("_rss_start")) / MB, 1)
+        if "_traced_start" in span:
+            traced_peak = span.pop("_traced_peak")
+            if tracemalloc.is_tracing():
+                traced_peak = max(traced_peak, tracemalloc.get_traced_memory()[1])
+            span["tracemalloc_peak_mb"] = round((traced_peak - span.pop("_traced_start")) / MB, 1)
+        print(f"[TRACE] {self.kind}/{span['stage']}: {span['wall_s']:.3f}s wall, {span['cpu_s']:.3f}s cpu, "
+              f"RSS peak {span['rss_peak_mb']} MB (+{span['rss_growth_mb']})")
+
+    @contextmanager
+    def stage(self, name):
+        span = self._begin(name)
+        try:
+            yield span
+        finally:
+            self._end(span)
+
+    def switch(self, name):
+        """End the current top-level stage started by switch() and begin `name`."""
+        if self._switched is not None:
+            self._end(self._switched)
+        self._switched = self._begin(name)
+
+    def timings(self):
+        """Wall seconds per top-level stage (summed over repeats)."""
+        out = {}
+        for span in self.spans:
+            if span["parent"] is None and "wall_s" in span:
+                out[span["stage"]] = round(out.get(span["stage"], 0.0) + span["wall_s"], 4)
+        return out
+
+    def to_dict(self):
+        """The finished stages in start order, JSON-ready."""
+        return {
+            "kind": self.kind,
+            "wall_s": self.wall_s,
+            "cpu_s": self.cpu_s,
+            "stages": [{key: value for key, value in span.items() if not key.startswith("_")}
+                       for span in self.spans if "wall_s" in span],
+        }
+
+
+def current():
+    """The trace active in this context, or None."""
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    """A stage of the current trace; a no-op outside of one."""
+    trace = _current.get()
+    if trace is None or trace.finished:
+        yield None
+        return
+    with trace.stage(name) as span:
+        yield span
+
+
+# ---------------------------------------------------------------------------
+# Prometheus exposition
+# ---------------------------------------------------------------------------
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed label set."""
+
+    def __init__(self, name, help, buckets, labels=("kind", "stage")):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0})
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: {"counts": list(s["counts"]), "sum": s["sum"]} for key, s in self._series.items()}
+        for key, s in sorted(series.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), s["counts"]):
+                total += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, ('le', _number(bound)))} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(s['sum'])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {total}")
+        return lines
+
+
+class Gauge:
+    """Value read at scrape time: callback() returns a number, or {label value tuple: number}."""
+
+    def __init__(self, name, help, callback, labels=()):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labels = tuple(labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.callback()
+        values = value if isinstance(value, dict) else {(): value}
+        for key, number in sorted(values.items()):
+            if number is not None:
+                lines.append(f"{self.name}{_labels(self.labels, key)} {_number(number)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, name, help, buckets, labels=("kind", "stage")):
+        metric = Histogram(name, help, buckets, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, callback, labels=()):
+        metric = Gauge(name, help, callback, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("detectfx_stage_seconds", "Wall time per stage.", SECONDS_BUCKETS)
+STAGE_CPU_SECONDS = REGISTRY.histogram("detectfx_stage_cpu_seconds", "Process CPU time per stage.",
+                                       SECONDS_BUCKETS)
+STAGE_RSS_GROWTH_MB = REGISTRY.histogram("detectfx_stage_rss_growth_mb",
+                                         "Peak RSS above the RSS at the start of the stage, in MB.", MB_BUCKETS)
+STAGE_TRACEMALLOC_MB = REGISTRY.histogram("detectfx_stage_tracemalloc_peak_mb",
+                                          "Peak traced allocations during the stage, in MB "
+                                          "(DETECTFX_TRACEMALLOC=1).", MB_BUCKETS)
+JOB_SECONDS = REGISTRY.histogram("detectfx_job_seconds", "Wall time per job.", SECONDS_BUCKETS, labels=("kind",))
+
+
+def record(trace):
+    """Add a finished trace (Trace.to_dict()) to the histograms."""
+    kind = trace["kind"]
+    for span in trace["stages"]:
+        STAGE_SECONDS.observe(span["wall_s"], kind=kind, stage=span["stage"])
+        STAGE_CPU_SECONDS.observe(span["cpu_s"], kind=kind, stage=span["stage"])
+        STAGE_RSS_GROWTH_MB.observe(span["rss_growth_mb"], kind=kind, stage=span["stage"])
+        if "tracemalloc_peak_mb" in span:
+            STAGE_TRACEMALLOC_MB.observe(span["tracemalloc_peak_mb"], kind=kind, stage=span["stage"])
+    if trace.get("wall_s") is not None:
+        JOB_SECONDS.observe(trace["wall_s"], kind=kind)
+
+
+def render():
+    """Every registered metric in the Prometheus text format."""
+    return REGISTRY.render()
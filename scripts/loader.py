@@ -0,0 +1,266 @@
+"""
+The one audio loader.
+
+Every upload is decoded exactly once to float32 and downmixed to mono. The
+native-rate buffer is kept for rendering. The canonical ANALYSIS_SR buffer
+that feature extraction uses is derived from it on first use. soundfile
+decodes WAV/FLAC/OGG (and MP3 with a recent libsndfile). Anything else goes
+through pydub/ffmpeg, and the result is converted to the same float32 layout.
+
+load_spooled() is the O(block) variant for the streaming render. It decodes
+block by block (soundfile, or an ffmpeg pipe with pydub's sample format) into
+a scripts.spool.Spool, and resamples spools block by block as well.
+
+The resampler backend is pluggable. "kaiser_best" (the default) is the
+resampler librosa.load used. It runs resampy's kaiser_best filter through
+scripts.resample's polyphase path, so features and the thresholds tuned on
+them are unchanged. "polyphase" (a shorter filter) and "soxr" (the soxr
+package, when installed) are faster. They let more energy through near the
+analysis Nyquist, which moves flatness, centroid and MFCCs, so the effect
+chain chosen for a take can differ. DETECTFX_RESAMPLER picks the default.
+"""
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+from scripts import resample as polyphase, spool
+
+# Rate the feature extraction runs at (librosa.load's default rate)
+ANALYSIS_SR = 22050
+RESAMPLER = os.getenv("DETECTFX_RESAMPLER", "kaiser_best")
+
+
+def _kaiser_best(signal, orig_sr, target_sr):
+    return polyphase.resample(signal, orig_sr, target_sr, filter="kaiser_best")
+
+
+def _polyphase(signal, orig_sr, target_sr):
+    return polyphase.resample(signal, orig_sr, target_sr)
+
+
+def _soxr(signal, orig_sr, target_sr):
+    import soxr
+    return soxr.resample(signal, orig_sr, target_sr, quality="HQ").astype(signal.dtype, copy=False)
+
+
+RESAMPLERS = {
+    "kaiser_best": _kaiser_best,
+    "polyphase": _polyphase,
+    "soxr": _soxr,
+}
+
+
+def resampler_name(name=None):
+    """The backend actually used for `name` (default RESAMPLER)."""
+    name = name or RESAMPLER
+    if name not in RESAMPLERS:
+        raise ValueError(f"Unknown resampler '{name}', expected one of {sorted(RESAMPLERS)}")
+    if name == "soxr":
+        try:
+            import soxr  # noqa: F401
+        except ImportError:
+            print("[LOADER] soxr is not installed, resampling with kaiser_best")
+            return "kaiser_best"
+    return name
+
+
+class _SoxrStream:
+    """soxr.ResampleStream as a block processor."""
+
+    def __init__(self, orig_sr, target_sr):
+        import soxr
+        self.stream = soxr.ResampleStream(orig_sr, target_sr, 1, dtype="float32", quality="HQ")
+
+    def __call__(self, block):
+        return self.stream.resample_chunk(np.asarray(block, dtype=np.float32))
+
+    def flush(self):
+        return self.stream.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+
+
+def stream_resampler(orig_sr, target_sr, backend=None):
+    """Block processor (called per block, then flush()) for the chosen backend."""
+    name = resampler_name(backend)
+    if name == "soxr":
+        return _SoxrStream(orig_sr, target_sr)
+    return polyphase.StreamResampler(orig_sr, target_sr, name)
+
+
+def resample(signal, orig_sr, target_sr, backend=None):
+    """
+    Convert a mono float signal between rates with the chosen backend. A
+    spooled signal is converted block by block into a new Spool.
+    """
+    if orig_sr == target_sr:
+        return signal
+    if isinstance(signal, np.ndarray):
+        return RESAMPLERS[resampler_name(backend)](signal, orig_sr, target_sr)
+    process = stream_resampler(orig_sr, target_sr, backend)
+    out = spool.Spool(signal.dtype)
+    for block in signal.blocks():
+        out.write(process(block))
+    out.write(process.flush())
+    return out
+
+
+def decode(source):
+    """
+    Decode an encoded audio file.
+
+    Parameters:
+        source: encoded bytes, a path, or a binary file object
+    Returns:
+        (float32 samples shaped (frames, channels), sample rate)
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    try:
+        return sf.read(source, dtype="float32", always_2d=True)
+    except (sf.LibsndfileError, RuntimeError):
+        from pydub import AudioSegment
+        if hasattr(source, "seek"):
+            source.seek(0)
+        audio = AudioSegment.from_file(source)
+        samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
+        samples = samples.reshape((-1, audio.channels)) / (2 ** (8 * audio.sample_width - 1))
+        return samples, audio.frame_rate
+
+
+# pydub's choice of PCM for an ffmpeg decode, by bits per sample, as raw
+# ffmpeg output: (format and codec, dtype). 24 bits come out left-justified
+# in 32, as pydub widens them.
+FFMPEG_PCM = {8: ("s8", np.int8), 16: ("s16le", np.int16), 24: ("s32le", np.int32), 32: ("s32le", np.int32)}
+
+
+def _ffmpeg_blocks(path, block_size):
+    """decode_blocks() through an ffmpeg pipe, for what libsndfile cannot read."""
+    from pydub import AudioSegment
+    from pydub.utils import mediainfo_json
+
+    stream = next(s for s in mediainfo_json(path)["streams"] if s["codec_type"] == "audio")
+    channels, sr = int(stream["channels"]), int(stream["sample_rate"])
+    # Lossy codecs decode to float; pydub takes those as 16 bit
+    bits = int(stream.get("bits_per_sample") or 0)
+    if stream.get("sample_fmt") == "fltp" or bits not in FFMPEG_PCM:
+        bits = 16
+    fmt, dtype = FFMPEG_PCM[bits]
+    scale = np.float32(2 ** (8 * np.dtype(dtype).itemsize - 1))
+    process = subprocess.Popen([AudioSegment.converter, "-v", "error", "-i", path, "-vn",
+                                "-f", fmt, "-acodec", "pcm_" + fmt, "-"],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def blocks():
+        frame_bytes = channels * np.dtype(dtype).itemsize
+        with process:
+            while True:
+                data = process.stdout.read(block_size * frame_bytes)
+                if not data:
+                    break
+                data = data[:len(data) - len(data) % frame_bytes]
+                yield np.frombuffer(data, dtype=dtype).reshape((-1, channels)).astype(np.float32) / scale
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, "ffmpeg")
+    return sr, channels, blocks()
+
+
+def decode_blocks(source, block_size=spool.DEFAULT_BLOCK_SIZE):
+    """
+    Decode an encoded audio file a block at a time.
+
+    Parameters:
+        source: encoded bytes, a path, or a binary file object
+        block_size: frames per block
+    Returns:
+        (sample rate, channels, iterator of float32 blocks shaped (frames, channels))
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    try:
+        audio = sf.SoundFile(source)
+    except (sf.LibsndfileError, RuntimeError):
+        if isinstance(source, (str, os.PathLike)):
+            return _ffmpeg_blocks(os.fspath(source), block_size)
+        # ffmpeg gets a file on disk, copied over a block at a time
+        source.seek(0)
+        copy = tempfile.NamedTemporaryFile(prefix="detectfx-upload-")
+        shutil.copyfileobj(source, copy)
+        copy.flush()
+        sr, channels, blocks = _ffmpeg_blocks(copy.name, block_size)
+
+        def owned():
+            with copy:
+                yield from blocks
+        return sr, channels, owned()
+
+    def blocks():
+        with audio:
+            yield from audio.blocks(block_size, dtype="float32", always_2d=True)
+    return audio.samplerate, audio.channels, blocks()
+
+
+def to_mono(samples):
+    """(frames, channels) float32 -> 1-D float32 (the first channel as is when mono)."""
+    return samples.mean(axis=1, dtype=np.float32) if samples.shape[1] > 1 else samples[:, 0]
+
+
+class LoadedAudio:
+    """
+    A decoded upload: native-rate mono samples plus the analysis-rate copy.
+    Both are arrays, or Spools when the upload was loaded with load_spooled().
+    """
+
+    def __init__(self, samples, sr, channels=1, analysis_sr=ANALYSIS_SR, resampler=None):
+        self.samples = samples
+        self.sr = sr
+        self.channels = channels
+        self.analysis_sr = analysis_sr
+        self.resampler = resampler_name(resampler)
+        self._analysis = None
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sr
+
+    def analysis(self):
+        """The samples at analysis_sr, resampled once on first use."""
+        if self._analysis is None:
+            self._analysis = resample(self.samples, self.sr, self.analysis_sr, self.resampler)
+        return self._analysis
+
+
+def load(source, analysis_sr=ANALYSIS_SR, resampler=None):
+    """
+    Decode an upload once.
+
+    Parameters:
+        source: encoded bytes, a path, or a binary file object
+        analysis_sr: rate of the analysis copy
+        resampler: backend name in RESAMPLERS (default DETECTFX_RESAMPLER)
+    Returns:
+        LoadedAudio
+    """
+    samples, sr = decode(source)
+    return LoadedAudio(to_mono(samples), sr, samples.shape[1], analysis_sr, resampler)
+
+
+def load_spooled(source, analysis_sr=ANALYSIS_SR, resampler=None, block_size=spool.DEFAULT_BLOCK_SIZE):
+    """
+    load() that never holds the whole upload: it is decoded, downmixed and
+    written to a Spool block by block.
+
+    Parameters:
+        source: encoded bytes, a path, or a binary file object
+        analysis_sr: rate of the analysis copy
+        resampler: backend name in RESAMPLERS (default DETECTFX_RESAMPLER)
+        block_size: frames decoded at a time
+    Returns:
+        LoadedAudio with spooled samples
+    """
+    sr, channels, blocks = decode_blocks(source, block_size)
+    samples = spool.write((to_mono(block) for block in blocks), np.float32)
+    return LoadedAudio(samples, sr, channels, analysis_sr, resampler)
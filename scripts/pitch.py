@@ -0,0 +1,79 @@
+"""
+Duration-preserving pitch shift.
+
+A delay line whose delay ramps steadily is read at a rate other than one
+sample per sample, which shifts the pitch, like a tape played at another
+speed. The delay ramps by (1 - factor) samples per sample across a window of
+window_ms. Two taps half a window apart are crossfaded with sin^2 gains,
+which sum to one, so neither tap's wrap-around is heard. The output keeps
+the input's length, and no resampling or FFT is involved.
+
+PitchShifter carries its delay line between blocks, so the streaming render
+can use it. pitch_shift() runs a whole signal through it.
+"""
+import numpy as np
+
+from scripts.chorus import read_delayed, sawtooth_lfo
+
+DEFAULT_BLOCK_SIZE = 65536
+
+
+class PitchShifter:
+    """
+    Streaming pitch shifter: feed consecutive blocks of one signal through
+    process(). Blocks come out exactly as pitch_shift() renders the whole signal.
+    """
+
+    def __init__(self, sr, semitones=-1.0, window_ms=50):
+        self.sr = sr
+        self.factor = 2 ** (semitones / 12)
+        self.window = max(4, int((window_ms / 1000) * sr))
+        # Sawtooth rate that moves the delay (1 - factor) samples per sample
+        self.rate_hz = (1 - self.factor) * sr / self.window
+        self.position = 0
+        self.history = None
+
+    def process(self, block):
+        x = np.asarray(block)
+        if not np.issubdtype(x.dtype, np.floating):
+            x = x.astype(np.float32)
+        count = x.shape[0]
+        if self.factor == 1 or count == 0:
+            return x.copy()
+
+        history = self.window + 2
+        if self.history is None:
+            self.history = np.zeros(history, dtype=x.dtype)
+        line = np.concatenate([self.history, x, np.zeros(2, dtype=x.dtype)])
+        index = np.arange(history + self.position, history + self.position + count)
+
+        out = np.zeros(count, dtype=x.dtype)
+        for phase in (0.0, 0.5):
+            ramp = sawtooth_lfo(self.position, count, self.sr, self.rate_hz, phase)
+            gain = np.square(np.sin(np.pi * ramp)).astype(x.dtype)
+            out += read_delayed(line, index, ramp * self.window, "linear", origin=self.position) * gain
+
+        self.history = line[count:count + history].copy()
+        self.position += count
+        return out
+
+    __call__ = process
+
+
+def pitch_shift(signal, sr, semitones=-1.0, window_ms=50, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Shift the pitch of a mono signal, keeping its length.
+
+    Parameters:
+        signal: mono np.ndarray
+        sr: sample rate
+        semitones: shift in semitones; negative lowers the pitch
+        window_ms: crossfade window. Longer is smoother on sustained notes,
+                   shorter smears transients less
+        block_size: samples per block; the output does not depend on it
+    Returns:
+        np.ndarray the same length as signal
+    """
+    shifter = PitchShifter(sr, semitones, window_ms)
+    return np.concatenate([shifter.process(signal[start:start + block_size])
+                           for start in range(0, len(signal), block_size)] or [signal[:0]])
@@ -0,0 +1,183 @@
+"""
+Polyphase rational resampling.
+
+scipy.signal.resample works in the frequency domain over the whole signal.
+Its cost depends on the prime factors of the length, so an upload with an
+awkward length can take many times longer than its neighbours. Polyphase
+filtering (scipy.signal.resample_poly) costs the same per sample whatever
+the length.
+
+A conversion by target/orig is reduced to integers up/down. The anti-alias
+filter depends only on (up, down) and is designed once and kept in an LRU
+cache. Rates that are not simple ratios, such as a pitch factor, are first
+approximated by a fraction with a bounded denominator.
+
+Two filters are available. "polyphase" is resample_poly's default short
+Kaiser filter. "kaiser_best" is the windowed sinc of resampy's kaiser_best,
+which librosa.load resamples with by default, laid out as polyphase taps.
+Its output is librosa's to float rounding, at polyphase cost.
+"""
+from fractions import Fraction
+from functools import lru_cache
+
+import numpy as np
+from scipy.signal import firwin, resample_poly as _resample_poly, upfirdn
+from scipy.special import i0
+
+# Rates uploads and analysis commonly use; warm_up() designs every pair
+COMMON_RATES = (16000, 22050, 32000, 44100, 48000, 88200, 96000)
+# Largest up/down for non-integer ratios; keeps filters at most ~20k taps
+MAX_DENOMINATOR = 1000
+# Filter half length in taps per unit of max(up, down), and Kaiser beta; the
+# defaults of resample_poly
+HALF_WIDTH = 10
+KAISER_BETA = 5.0
+# resampy's kaiser_best: zero crossings per side, Kaiser beta and roll-off
+# (fraction of the lower Nyquist), as stored in its kaiser_best.npz table
+KAISER_BEST_ZEROS = 50
+KAISER_BEST_BETA = 12.984585247040185
+KAISER_BEST_ROLLOFF = 0.9173473712608761
+
+
+def ratio(orig_sr, target_sr, max_denominator=MAX_DENOMINATOR):
+    """
+    (up, down) integers with up / down == target_sr / orig_sr, or the closest
+    fraction with down <= max_denominator when the ratio is not rational enough.
+    """
+    fraction = Fraction(target_sr) / Fraction(orig_sr)
+    if max(fraction.numerator, fraction.denominator) > max_denominator:
+        fraction = Fraction(float(target_sr) / float(orig_sr)).limit_denominator(max_denominator)
+    return fraction.numerator, fraction.denominator
+
+
+@lru_cache(maxsize=64)
+def design(up, down):
+    """Kaiser windowed low-pass used to resample by up/down (read-only, cached)."""
+    max_rate = max(up, down)
+    taps = firwin(2 * HALF_WIDTH * max_rate + 1, 1.0 / max_rate, window=("kaiser", KAISER_BETA))
+    taps.setflags(write=False)
+    return taps
+
+
+@lru_cache(maxsize=64)
+def design_kaiser_best(up, down):
+    """
+    resampy's kaiser_best windowed sinc sampled at the up-sampled rate, scaled
+    for resample_poly (read-only, cached). Below 1 the ratio stretches the
+    sinc, so its cutoff is the roll-off times the target's Nyquist.
+    """
+    scale = min(1.0, up / down)
+    half = int(np.ceil(KAISER_BEST_ZEROS * up / scale))
+    # Each tap's distance from the centre in zero crossings of the sinc
+    zeros = np.abs(np.arange(-half, half + 1)) * (scale / up)
+    taper = i0(KAISER_BEST_BETA * np.sqrt(np.clip(1 - np.square(zeros / KAISER_BEST_ZEROS), 0, None)))
+    taps = KAISER_BEST_ROLLOFF * np.sinc(KAISER_BEST_ROLLOFF * zeros) * taper / i0(KAISER_BEST_BETA)
+    # resample_poly multiplies by up; resampy's kernel already sums to 1 per phase
+    taps *= scale / up
+    taps.setflags(write=False)
+    return taps
+
+
+FILTERS = {
+    "polyphase": design,
+    "kaiser_best": design_kaiser_best,
+}
+
+
+def resample_poly(signal, up, down, axis=0, filter="polyphase"):
+    """resample_poly with a cached FILTERS design; keeps the input's float dtype."""
+    signal = np.asarray(signal)
+    if up == down:
+        return signal
+    out = _resample_poly(signal, up, down, axis=axis, window=FILTERS[filter](up, down))
+    if np.issubdtype(signal.dtype, np.floating):
+        out = out.astype(signal.dtype, copy=False)
+    return out
+
+
+def resample(signal, orig_sr, target_sr, axis=0, filter="polyphase"):
+    """
+    Convert signal from orig_sr to target_sr.
+
+    Parameters:
+        signal: np.ndarray, time along `axis`
+        orig_sr: current sample rate
+        target_sr: wanted sample rate
+        filter: name in FILTERS
+    Returns:
+        np.ndarray at target_sr (the input itself when the rates match)
+    """
+    if orig_sr == target_sr:
+        return signal
+    up, down = ratio(orig_sr, target_sr)
+    return resample_poly(signal, up, down, axis=axis, filter=filter)
+
+
+class StreamResampler:
+    """
+    resample() for a mono signal that arrives in blocks: feed consecutive
+    blocks through process() and call flush() at the end. Output m is
+    sum_n x[n] * h[m * down + half - n * up], the same sum resample_poly
+    evaluates. Each output is computed from the same inputs and taps whatever
+    the block sizes, so any blocking gives the same samples.
+    """
+
+    def __init__(self, orig_sr, target_sr, filter="polyphase"):
+        self.up, self.down = ratio(orig_sr, target_sr)
+        self.taps = FILTERS[filter](self.up, self.down) * self.up
+        self.half = (len(self.taps) - 1) // 2
+        # Input samples under the filter for any one output
+        self.width = -(-len(self.taps) // self.up)
+        # upfirdn's output k lines up with output m when its input starts at
+        # an index s with s * up = half (mod down); align is that residue
+        self.align = self.half * pow(self.up, -1, self.down) % self.down if self.down > 1 else 0
+        # Input from absolute index self.start on; zeros stand in before the signal
+        self.buffer = np.zeros(self.width - 1)
+        self.start = 1 - self.width
+        self.received = 0
+        self.produced = 0
+
+    def _outputs(self, stop):
+        """Outputs self.produced..stop-1, then drop the input no later output needs."""
+        if stop <= self.produced:
+            return np.zeros(0, dtype=np.float32)
+        newest = ((stop - 1) * self.down + self.half) // self.up
+        needed = newest + 1 - self.start
+        if needed > len(self.buffer):
+            # Past the end of the signal (flush only)
+            self.buffer = np.concatenate([self.buffer, np.zeros(needed - len(self.buffer))])
+        lead = (self.start - self.align) % self.down
+        segment = self.buffer[:needed]
+        if lead:
+            segment = np.concatenate([np.zeros(lead), segment])
+        first = (self.produced * self.down + self.half - (self.start - lead) * self.up) // self.down
+        out = upfirdn(self.taps, segment, self.up, self.down)[first:first + stop - self.produced]
+        self.produced = stop
+
+        oldest = (self.produced * self.down + self.half) // self.up - self.width + 1
+        if oldest > self.start:
+            self.buffer = self.buffer[oldest - self.start:]
+            self.start = oldest
+        return out.astype(np.float32)
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        self.buffer = np.concatenate([self.buffer, block])
+        self.received += len(block)
+        # Output m is ready once input (m * down + half) // up has arrived
+        return self._outputs(max(0, (self.received * self.up - 1 - self.half) // self.down + 1))
+
+    __call__ = process
+
+    def flush(self):
+        """The remaining outputs, up to resample_poly's length ceil(n * up / down)."""
+        return self._outputs(-(-self.received * self.up // self.down))
+
+
+def warm_up(rates=COMMON_RATES, filter="polyphase"):
+    """Design the filters for every pair of common rates ahead of the first job."""
+    for orig_sr in rates:
+        for target_sr in rates:
+            if orig_sr != target_sr:
+                FILTERS[filter](*ratio(orig_sr, target_sr))
+    return FILTERS[filter].cache_info()
@@ -1,130 +1,278 @@
+import os
 
-def classify(ref_link, clf):
-    import joblib
-    import json
-    import pandas as pd
-    import librosa
+# Define list of effect classes directly
+classes = [
+    "Blues Driver",
+    "Chorus",
+    "Clean",
+    "Digital Delay",
+    "Flanger",
+    "Hall Reverb",
+    "Phaser",
+    "Plate Reverb",
+    "RAT",
+    "Spring Reverb",
+    "Sweep Echo",
+    "Tape Echo",
+    "Tube Screamer"
+]
+
+# Process pool used by classify_batch for feature extraction
+FEATURE_WORKERS = int(os.getenv("DETECTFX_FEATURE_WORKERS", "2"))
+DOWNLOAD_WORKERS = int(os.getenv("DETECTFX_DOWNLOAD_WORKERS", "8"))
+_feature_pool = None
+
+
+class DecodeError(Exception):
+    """The uploaded file could not be decoded as audio."""
+
+
+def log_memory(tag=""):
+    import psutil
+    process = psutil.Process(os.getpid())
+    mem = process.memory_info().rss / 1024 / 1024  # in MB
+    print(f"[MEMORY] {tag}: {mem:.2f} MB")
+
+
+def download_audio_from_supabase(url):
+    """Download url to a temp file. Returns (path, ETag) or (None, None) on failure."""
     import tempfile
-    import numpy as np
     import requests
-    import psutil
-    import os
+
+    response = requests.get(url)
+    if response.status_code == 200:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
+            tmp_file.write(response.content)
+        print("Saved to temp:", tmp_file.name)
+        log_memory("Generated tmp file")
+        return tmp_file.name, response.headers.get("ETag")
+    else:
+        print("Failed to download:", response.status_code)
+        return None, None
+
+
+def extract_features(file_path):
+    """
+    Decode file_path and compute its 16 value classifier row.
+    Returns (cache key, cache entry dict with at least "features"), or (None, None)
+    when the file cannot be decoded. Runs in classify_batch's worker processes.
+    """
     import gc
+    from scripts import instrument, loader
+    from scripts.features import extract_features as extract_audio_features
+    from scripts.feature_cache import get_cache, audio_key
+
+    try:
+        print("trying to load via loader")
+        with instrument.stage("decode"):
+            audio = loader.load(file_path)
+        y, sr = audio.samples, audio.sr
+        print("Loaded audio:", file_path)
+    except Exception as e:
+        print("❌ Failed to load audio:", str(e))
+        return None, None
+
+    # Same audio under a different name: reuse the stored analysis
+    key = audio_key(y, sr, "classify")
+    entry = get_cache().get(key)
+    if entry is not None:
+        print("Feature cache hit (PCM hash)")
+        return key, entry
+
+    # One STFT for MFCC, centroid and bandwidth; ZCR is time-domain
+    # 13 MFCC + 1 ZCR + 1 spectral_centroid + 1 spectral_bandwidth = 16 features
+    with instrument.stage("features"):
+        features = extract_audio_features(y, sr).classifier_vector()
+
+    # Clean up audio data
+    del y, sr, audio
+
+    # Force garbage collection to free memory immediately
+    gc.collect()
+
+    return key, {"features": features}
 
-    def log_memory(tag=""):
-        process = psutil.Process(os.getpid())
-        mem = process.memory_info().rss / 1024 / 1024  # in MB
-        print(f"[MEMORY] {tag}: {mem:.2f} MB")
+
+def cached_prediction(entry, fingerprint):
+    """Stored predictions of a cache entry, if they came from the same model."""
+    from scripts.feature_cache import decode_predictions
+    if entry is not None and "prediction_names" in entry and str(entry["model"]) == fingerprint:
+        return decode_predictions(entry)
+    return None
+
+
+def predictions_from_probs(probs):
+    """{effect: probability}, most likely effect first."""
+    prediction_results = {}
+    for effect, prob in sorted(zip(classes, probs), key=lambda x: x[1], reverse=True):
+        prediction_results[effect] = float(prob)
+    return prediction_results
 
 
+def store_prediction(key, etag, features, prediction_results, fingerprint):
+    import numpy as np
+    from scripts.feature_cache import get_cache, etag_key, encode_predictions
+
+    cache = get_cache()
+    stored = {"features": features, "model": np.array(fingerprint),
+              **encode_predictions(prediction_results)}
+    cache.put(key, **stored)
+    if etag:
+        cache.put(etag_key(etag, "classify"), **stored)
+
+
+def classify(ref_link, clf):
     #ref_link is the link to file on supabase storage, need to add logic to retrieve from supabase here
-    
+
     log_memory("starting out")
-    def download_audio_from_supabase(url, save_path = "temp_audio.wav"):
-        tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-        response = requests.get(url)
-        if response.status_code == 200:
-            tmp_file.write(response.content)
-            tmp_file.close()
-            print("Saved to temp:", tmp_file.name)
-            log_memory("Generated tmp file")
-            return tmp_file.name
-        else:
-            print("Failed to download:", response.status_code)
-            return None
-        
-    file_path = download_audio_from_supabase(ref_link)
+    file_path, etag = download_audio_from_supabase(ref_link)
     print("Downloaded file path")
     log_memory("Downloaded file path")
-    
-    # Load trained model
-    
-    log_memory("Loaded model")
-
-    # Define list of effect classes directly
-    classes = [
-        "Blues Driver",
-        "Chorus",
-        "Clean",
-        "Digital Delay",
-        "Flanger",
-        "Hall Reverb",
-        "Phaser",
-        "Plate Reverb",
-        "RAT",
-        "Spring Reverb",
-        "Sweep Echo",
-        "Tape Echo",
-        "Tube Screamer"
-    ]
 
+    return classify_file(file_path, etag, clf)
 
 
+def classify_file(file_path, etag, clf):
+    """
+    Classify an already downloaded file and delete it afterwards.
+    The async /results handler downloads with scripts.fetch and runs this in a thread.
+    Raises DecodeError when the file is not audio that can be decoded.
+    """
+    from scripts import instrument
+    from scripts.feature_cache import get_cache, etag_key, model_fingerprint
+
     print("loaded model")
-    def extract_features(file_path):
-        try:
-            print("trying to load via librosa")
-            y, sr = librosa.load(file_path, sr=None)
-            print("Loaded audio:", file_path)
-        except Exception as e:
-            print("❌ Failed to load audio with librosa:", str(e))
-            return None
-        
-        # Pre-allocate result array to avoid list appends and concatenation
-        # 13 MFCC + 1 ZCR + 1 spectral_centroid + 1 spectral_bandwidth = 16 features
-        features = np.zeros(16, dtype=np.float32)
-        
-        # Extract MFCC features
-        mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-        features[:13] = np.mean(mfcc, axis=1)
-        del mfcc  # Explicitly delete large intermediate array
-        
-        # Extract zero crossing rate
-        zcr = librosa.feature.zero_crossing_rate(y)
-        features[13] = np.mean(zcr)
-        del zcr  # Clean up
-        
-        # Extract spectral centroid
-        spec_cent = librosa.feature.spectral_centroid(y=y, sr=sr)
-        features[14] = np.mean(spec_cent)
-        del spec_cent  # Clean up
-        
-        # Extract spectral bandwidth
-        spec_bw = librosa.feature.spectral_bandwidth(y=y, sr=sr)
-        features[15] = np.mean(spec_bw)
-        del spec_bw  # Clean up
-        
-        # Clean up audio data
-        del y, sr
-        
-        # Force garbage collection to free memory immediately
-        gc.collect()
-        
-        return features.reshape(1, -1)
+    fingerprint = model_fingerprint(clf)
 
+    # Same storage object as before: skip decoding and analysis entirely
+    etag_entry = get_cache().get(etag_key(etag, "classify")) if etag else None
+    prediction_results = cached_prediction(etag_entry, fingerprint)
+    if prediction_results is not None:
+        print("Feature cache hit (ETag)")
+        os.remove(file_path)
+        return prediction_results
 
     #file_path = "Reference guitar path"
 
-    features = extract_features(file_path)
+    key, entry = extract_features(file_path)
+    os.remove(file_path)
+    if entry is None:
+        raise DecodeError("Could not decode audio")
     log_memory("Extracted features")
-    probs = clf.predict_proba(features)[0]
-    prediction_results = {}
-    # Show top effects with confidence
-    for effect, prob in sorted(zip(classes, probs), key=lambda x: x[1], reverse=True):
-        prediction_results[effect] = float(prob)
-        print(f"{effect:<15}: {prob*100:.2f}%")
-    log_memory("Generated predictions")
+
+    prediction_results = cached_prediction(entry, fingerprint)
+    if prediction_results is None:
+        with instrument.stage("predict"):
+            probs = clf.predict_proba(entry["features"])[0]
+        prediction_results = predictions_from_probs(probs)
+        # Show top effects with confidence
+        for effect, prob in prediction_results.items():
+            print(f"{effect:<15}: {prob*100:.2f}%")
+        log_memory("Generated predictions")
+        store_prediction(key, etag, entry["features"], prediction_results, fingerprint)
     print(prediction_results)
 
+    return prediction_results
 
-    df = pd.read_csv("./public/egfxset_metadata_updated.csv")
 
-    
-    return prediction_results
+def _get_feature_pool():
+    """Worker processes for feature extraction, started on first use."""
+    global _feature_pool
+    if _feature_pool is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn, not fork: the server process has threads running
+        _feature_pool = ProcessPoolExecutor(max_workers=FEATURE_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _feature_pool
+
+
+def classify_batch(ref_links, clf):
+    """
+    Classify many files at once.
+
+    Downloads run concurrently in threads, feature extraction runs in a process
+    pool, and every row that still needs a prediction goes through a single
+    clf.predict_proba call. Returns one dict per link, in input order, holding
+    either "result" or "error".
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    log_memory("starting batch")
+    with ThreadPoolExecutor(max_workers=max(1, min(DOWNLOAD_WORKERS, len(ref_links)))) as downloads:
+        downloaded = list(downloads.map(download_audio_from_supabase, ref_links))
+    log_memory("Downloaded batch")
+
+    return classify_downloaded_batch(ref_links, downloaded, clf)
+
+
+def classify_downloaded_batch(ref_links, downloaded, clf):
+    """
+    The part of classify_batch after the downloads. `downloaded` holds one
+    (path, ETag) pair per link, with path None when that download failed.
+    Every downloaded file is deleted before returning.
+    """
+    import numpy as np
+    from scripts import instrument
+    from scripts.feature_cache import get_cache, etag_key, model_fingerprint
+
+    fingerprint = model_fingerprint(clf)
+    items = [{"link": link} for link in ref_links]
+
+    pending = {}
+    for item, (file_path, etag) in zip(items, downloaded):
+        item["etag"] = etag
+        if file_path is None:
+            item["error"] = "Failed to download"
+            continue
+        etag_entry = get_cache().get(etag_key(etag, "classify")) if etag else None
+        prediction_results = cached_prediction(etag_entry, fingerprint)
+        if prediction_results is not None:
+            item["result"] = prediction_results
+            os.remove(file_path)
+            continue
+        item["path"] = file_path
+        pending[id(item)] = _get_feature_pool().submit(extract_features, file_path)
+
+    to_predict = []
+    # Decoding and features run in the pool's processes; this stage is the wait for them
+    with instrument.stage("features"):
+        for item in items:
+            future = pending.get(id(item))
+            if future is None:
+                continue
+            try:
+                key, entry = future.result()
+            except Exception as e:
+                item["error"] = f"Feature extraction failed: {e}"
+                continue
+            finally:
+                os.remove(item.pop("path"))
+            if entry is None:
+                item["error"] = "Could not decode audio"
+                continue
+            prediction_results = cached_prediction(entry, fingerprint)
+            if prediction_results is not None:
+                item["result"] = prediction_results
+                continue
+            item["key"] = key
+            item["features"] = entry["features"]
+            to_predict.append(item)
+    log_memory("Extracted batch features")
+
+    if to_predict:
+        with instrument.stage("predict"):
+            probs = clf.predict_proba(np.vstack([item["features"] for item in to_predict]))
+        for item, row in zip(to_predict, probs):
+            item["result"] = predictions_from_probs(row)
+            store_prediction(item["key"], item["etag"], item["features"], item["result"], fingerprint)
+    log_memory("Generated batch predictions")
+
+    return [{key: item[key] for key in ("link", "result", "error") if key in item} for item in items]
 
 # scripts/retrieveEffects.py
 def testClassify(file_path: str):
     print(f"🔍 Classifying file at: {file_path}")
     return "DummyEffect"
 
-#print(classify("./testing/reference_guitar_2.wav"))
\ No newline at end of file
+#print(classify("./testing/reference_guitar_2.wav"))
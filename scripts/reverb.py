@@ -0,0 +1,286 @@
+"""
+Comb/allpass reverb engine.
+
+A feedback comb y[n] = x[n - d] + g * y[n - d] only couples samples that are
+exactly d apart. Folding the signal into rows of length d turns it into a
+first-order recursion down the rows, so each comb and allpass stage is a single
+scipy.signal.lfilter call over an (N / d, d) view instead of a Python loop.
+
+ReverbWet renders the same wet path block by block for the streaming render,
+carrying comb, allpass, filter and pre-delay state between blocks.
+"""
+import numpy as np
+from scipy.signal import butter, lfilter, sosfilt
+
+# Presets named after the reverb classes classify() predicts, plus "legacy" which
+# reproduces the original apply_reverb (four parallel combs with decay ** k gains)
+PRESETS = {
+    "legacy": {
+        "comb_ms": (12, 17, 23, 31),
+        "decay": 0.7,
+        "allpass_ms": (),
+        "allpass_gain": 0.0,
+        "pre_delay_ms": 0,
+        "highpass_hz": None,
+        "lowpass_hz": None,
+        "wet_level": 0.3,
+    },
+    "plate": {
+        "comb_ms": (29.7, 37.1, 41.1, 43.7),
+        "rt60": 1.8,
+        "allpass_ms": (5.0, 1.7),
+        "allpass_gain": 0.7,
+        "pre_delay_ms": 0,
+        "highpass_hz": None,
+        "lowpass_hz": 9000,
+        "wet_level": 0.3,
+    },
+    "hall": {
+        "comb_ms": (50.3, 56.1, 61.7, 68.3, 73.9, 79.7),
+        "rt60": 3.2,
+        "allpass_ms": (7.9, 2.3, 1.1),
+        "allpass_gain": 0.7,
+        "pre_delay_ms": 25,
+        "highpass_hz": 80,
+        "lowpass_hz": 5000,
+        "wet_level": 0.35,
+    },
+    "spring": {
+        "comb_ms": (23.3, 27.7),
+        "rt60": 1.2,
+        # Long chain of short allpasses gives the dispersive "boing" of a tank
+        "allpass_ms": (1.1, 1.3, 1.7, 2.3, 2.9, 3.1, 3.7, 4.1),
+        "allpass_gain": 0.6,
+        "pre_delay_ms": 0,
+        "highpass_hz": 300,
+        "lowpass_hz": 4000,
+        "wet_level": 0.25,
+    },
+}
+
+CLASS_PRESETS = {
+    "Plate Reverb": "plate",
+    "Hall Reverb": "hall",
+    "Spring Reverb": "spring",
+}
+
+
+def preset_for_class(class_name, default="legacy"):
+    """Map a classify() effect name to a reverb preset name."""
+    return CLASS_PRESETS.get(class_name, default)
+
+
+def choose_preset(name=None):
+    """
+    Preset for generate()'s reverb_preset: a PRESETS name, a classify() reverb
+    class ("Hall Reverb") or None for "legacy". Raises ValueError otherwise.
+    """
+    if name is None:
+        return "legacy"
+    preset = preset_for_class(name, default=name)
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown reverb preset '{name}', expected one of {sorted(PRESETS)} "
+                         f"or {sorted(CLASS_PRESETS)}")
+    return preset
+
+
+def _fold(signal, delay):
+    """Zero pad the signal to a multiple of `delay` and view it as (rows, delay)."""
+    n = signal.shape[0]
+    rows = -(-n // delay)
+    padded = np.zeros(rows * delay, dtype=signal.dtype)
+    padded[:n] = signal
+    return padded.reshape(rows, delay)
+
+
+def comb_filter(signal, delay, gain):
+    """
+    Feedback comb: y[n] = x[n - delay] + gain * y[n - delay], zero before `delay`.
+    """
+    n = signal.shape[0]
+    if delay <= 0 or delay >= n:
+        return np.zeros_like(signal)
+    folded = _fold(signal, delay)
+    return lfilter([0.0, 1.0], [1.0, -gain], folded, axis=0).reshape(-1)[:n]
+
+
+def allpass_filter(signal, delay, gain):
+    """
+    Schroeder allpass: y[n] = -gain * x[n] + x[n - delay] + gain * y[n - delay].
+    """
+    n = signal.shape[0]
+    if delay <= 0 or delay >= n:
+        return signal.copy()
+    folded = _fold(signal, delay)
+    return lfilter([-gain, 1.0], [1.0, -gain], folded, axis=0).reshape(-1)[:n]
+
+
+def rt60_gain(delay_samples, sr, rt60):
+    """Comb feedback gain that decays by 60 dB in rt60 seconds."""
+    return 10 ** (-3 * delay_samples / (rt60 * sr))
+
+
+def _resolve(sr, preset, decay, wet_level):
+    """Preset parameters, comb delays/gains and wet level for one reverb call."""
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown reverb preset '{preset}', expected one of {sorted(PRESETS)}")
+    params = PRESETS[preset]
+    wet_level = params["wet_level"] if wet_level is None else wet_level
+
+    delays = [int((ms / 1000.0) * sr) for ms in params["comb_ms"]]
+    if "decay" in params:
+        g = params["decay"] if decay is None else decay
+        gains = [g ** (i + 1) for i in range(len(delays))]
+    else:
+        rt60 = params["rt60"] if decay is None else decay
+        gains = [rt60_gain(d, sr, rt60) for d in delays]
+    return params, delays, gains, wet_level
+
+
+def reverb(signal, sr, preset="legacy", decay=None, wet_level=None, normalize=True):
+    """
+    Parallel comb bank followed by a series allpass chain.
+
+    Parameters:
+        signal: mono np.ndarray
+        sr: sample rate
+        preset: name in PRESETS ("legacy", "plate", "hall", "spring")
+        decay: override the preset decay. Geometric comb gain for "legacy",
+               RT60 in seconds for the others
+        wet_level: override the preset dry/wet mix (0 = dry, 1 = wet)
+        normalize: peak normalize the wet signal and the output like the
+                   original apply_reverb did
+    Returns:
+        np.ndarray of reverberated audio
+    """
+    params, delays, gains, wet_level = _resolve(sr, preset, decay, wet_level)
+
+    x = np.asarray(signal)
+    if not np.issubdtype(x.dtype, np.floating):
+        x = x.astype(np.float32)
+
+    wet = np.zeros_like(x)
+    for d, g in zip(delays, gains):
+        wet += comb_filter(x, d, g)
+
+    for ms in params["allpass_ms"]:
+        wet = allpass_filter(wet, int((ms / 1000.0) * sr), params["allpass_gain"])
+
+    nyquist = sr / 2
+    if params["highpass_hz"] and params["highpass_hz"] < nyquist:
+        wet = sosfilt(butter(2, params["highpass_hz"], btype="high", fs=sr, output="sos"), wet)
+    if params["lowpass_hz"] and params["lowpass_hz"] < nyquist:
+        wet = sosfilt(butter(2, params["lowpass_hz"], btype="low", fs=sr, output="sos"), wet)
+
+    pre_delay = int((params["pre_delay_ms"] / 1000.0) * sr)
+    if 0 < pre_delay < len(wet):
+        wet[pre_delay:] = wet[:-pre_delay].copy()
+        wet[:pre_delay] = 0
+
+    if normalize:
+        wet = wet / (np.max(np.abs(wet)) + 1e-9)
+    output = (1 - wet_level) * x + wet_level * wet
+    if normalize:
+        output = output / (np.max(np.abs(output)) + 1e-9)
+    return output
+
+
+class _DelayFeedback:
+    """
+    Streaming comb (feedforward=0) or allpass (feedforward=-gain) stage.
+
+    y[n] = feedforward * x[n] + x[n - delay] + gain * y[n - delay], with the last
+    `delay` inputs and outputs kept between blocks. Blocks are walked in steps
+    of `delay` samples, so every step only reads the previous step. The
+    arithmetic matches lfilter's, so the output equals comb_filter/allpass_filter.
+    """
+
+    def __init__(self, delay, gain, feedforward):
+        self.delay = delay
+        self.gain = gain
+        self.feedforward = feedforward
+        self.x_history = None
+        self.y_history = None
+
+    def __call__(self, block):
+        d, g = self.delay, self.gain
+        if self.x_history is None:
+            self.x_history = np.zeros(d, dtype=block.dtype)
+            self.y_history = np.zeros(d, dtype=block.dtype)
+        n = block.shape[0]
+        out = np.empty_like(block)
+        prev_x, prev_y = self.x_history, self.y_history
+        for start in range(0, n, d):
+            m = min(d, n - start)
+            feedback = prev_x[:m] + g * prev_y[:m]
+            if self.feedforward:
+                out[start:start + m] = self.feedforward * block[start:start + m] + feedback
+            else:
+                out[start:start + m] = feedback
+            prev_x, prev_y = block[start:start + m], out[start:start + m]
+        if n >= d:
+            self.x_history = block[n - d:].copy()
+            self.y_history = out[n - d:].copy()
+        else:
+            self.x_history = np.concatenate([self.x_history[n:], block])
+            self.y_history = np.concatenate([self.y_history[n:], out])
+        return out
+
+
+class ReverbWet:
+    """
+    Streaming form of reverb()'s wet path: comb bank, allpass chain, tone
+    filters and pre-delay, before any normalization. `length` is the length of
+    the whole signal, which decides (as in reverb()) which delays are too long
+    to apply at all.
+    """
+
+    def __init__(self, sr, length, preset="legacy", decay=None):
+        params, delays, gains, _ = _resolve(sr, preset, decay, None)
+        self.combs = [_DelayFeedback(d, g, 0.0) for d, g in zip(delays, gains) if 0 < d < length]
+        self.allpasses = []
+        for ms in params["allpass_ms"]:
+            d = int((ms / 1000.0) * sr)
+            if 0 < d < length:
+                self.allpasses.append(_DelayFeedback(d, params["allpass_gain"], -params["allpass_gain"]))
+
+        self.filters = []
+        nyquist = sr / 2
+        if params["highpass_hz"] and params["highpass_hz"] < nyquist:
+            self.filters.append(butter(2, params["highpass_hz"], btype="high", fs=sr, output="sos"))
+        if params["lowpass_hz"] and params["lowpass_hz"] < nyquist:
+            self.filters.append(butter(2, params["lowpass_hz"], btype="low", fs=sr, output="sos"))
+        self.filter_states = [None] * len(self.filters)
+
+        pre_delay = int((params["pre_delay_ms"] / 1000.0) * sr)
+        self.pre_delay = pre_delay if 0 < pre_delay < length else 0
+        self.pre_history = None
+
+    def __call__(self, block):
+        x = np.asarray(block)
+        if not np.issubdtype(x.dtype, np.floating):
+            x = x.astype(np.float32)
+
+        wet = np.zeros_like(x)
+        for comb in self.combs:
+            wet += comb(x)
+        for allpass in self.allpasses:
+            wet = allpass(wet)
+
+        for i, sos in enumerate(self.filters):
+            if self.filter_states[i] is None:
+                self.filter_states[i] = np.zeros((sos.shape[0], 2))
+            wet, self.filter_states[i] = sosfilt(sos, wet, zi=self.filter_states[i])
+
+        if self.pre_delay:
+            if self.pre_history is None:
+                self.pre_history = np.zeros(self.pre_delay, dtype=wet.dtype)
+            line = np.concatenate([self.pre_history, wet])
+            self.pre_history = line[len(wet):]
+            wet = line[:len(wet)]
+        return wet
+
+
+def wet_level_for(preset="legacy", wet_level=None):
+    """Dry/wet mix reverb() uses for a preset."""
+    return PRESETS[preset]["wet_level"] if wet_level is None else wet_level
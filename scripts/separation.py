@@ -0,0 +1,297 @@
+"""
+Stem separation service.
+
+One long-lived worker process loads the separation model (htdemucs by
+default) once and takes requests over a multiprocessing queue:
+
+- Everything runs on the CPU. The worker hides CUDA devices before torch is
+  imported.
+- Long references are separated in overlapping segments of SEGMENT_SECONDS,
+  and the overlaps are crossfaded. The model's working memory depends on
+  the segment, not on the length of the reference.
+- Stems go to a content-addressed FeatureCache keyed by the decoded PCM,
+  the model and the stem name. The same reference is never separated twice,
+  whatever the upload is called.
+
+SeparationService.separate() is the entry point; get_service() returns the
+process-wide instance. The worker starts on first use and exits with its
+parent process.
+"""
+import atexit
+import itertools
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+
+import numpy as np
+
+from scripts.feature_cache import FeatureCache, audio_key
+
+SEPARATION_MODEL = os.getenv("DETECTFX_DEMUCS_MODEL", "htdemucs")
+# Seconds of audio per model pass, and how much consecutive passes overlap
+SEGMENT_SECONDS = int(os.getenv("DETECTFX_SEPARATION_SEGMENT", "30"))
+OVERLAP_SECONDS = 2
+# torch intra-op threads in the worker
+SEPARATION_THREADS = int(os.getenv("DETECTFX_SEPARATION_THREADS", "2"))
+# How long separate() waits for the worker
+SEPARATION_TIMEOUT = int(os.getenv("DETECTFX_SEPARATION_TIMEOUT", "900"))
+
+STEM_CACHE_DIR = os.getenv(
+    "DETECTFX_STEM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "detectfx", "stems"))
+STEM_CACHE_MAX_BYTES = int(os.getenv("DETECTFX_STEM_CACHE_MB", "1024")) * 1024 * 1024
+
+
+class SeparationError(Exception):
+    """The worker could not separate the audio."""
+
+
+def _fade_weights(length, overlap, first, last):
+    """Crossfade weights of one segment: linear ramps over the overlaps it shares."""
+    weights = np.ones(length, dtype=np.float32)
+    ramp = min(overlap, length)
+    if not first and ramp:
+        weights[:ramp] = np.linspace(0, 1, ramp + 2, dtype=np.float32)[1:-1]
+    if not last and ramp:
+        weights[-ramp:] = np.linspace(1, 0, ramp + 2, dtype=np.float32)[1:-1]
+    return weights
+
+
+def _model_channels(samples, channels):
+    """
+    (channels, frames) float32 mix for a model with `channels` inputs, as
+    demucs converts audio: mono is repeated, a mono model gets the downmix,
+    extra channels are dropped. Stereo references keep their two channels.
+    """
+    from scripts import loader
+
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim == 1:
+        samples = samples[:, np.newaxis]
+    if samples.shape[1] == channels:
+        return np.ascontiguousarray(samples.T)
+    if samples.shape[1] == 1:
+        return np.repeat(samples.T, channels, axis=0)
+    if channels == 1:
+        return loader.to_mono(samples)[np.newaxis]
+    if samples.shape[1] > channels:
+        return np.ascontiguousarray(samples[:, :channels].T)
+    raise SeparationError(f"cannot feed {samples.shape[1]} channels to a {channels} channel model")
+
+
+def separate_array(model, samples, sr, segment_seconds=SEGMENT_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    """
+    Separate a signal with a loaded demucs model.
+
+    Parameters:
+        model: demucs model (see _load_model)
+        samples: np.ndarray shaped (frames,) or (frames, channels)
+        sr: sample rate of samples
+        segment_seconds: audio per model pass
+        overlap_seconds: overlap between consecutive passes, crossfaded
+    Returns:
+        {stem name: float32 np.ndarray (frames, model channels) at sr}
+    """
+    import torch
+    from demucs.apply import apply_model
+    from scripts import loader
+
+    # (channels, frames) at the model's rate and channel count
+    mix = _model_channels(samples, model.audio_channels)
+    mix = np.stack([loader.resample(channel, sr, model.samplerate) for channel in mix])
+
+    # Normalize by the downmix like the demucs CLI; undone on the way out
+    reference = mix.mean(axis=0)
+    center, scale = float(reference.mean()), float(reference.std()) or 1.0
+    mix = (mix - center) / scale
+
+    frames = mix.shape[1]
+    segment = max(1, int(segment_seconds * model.samplerate))
+    overlap = min(int(overlap_seconds * model.samplerate), segment // 2)
+    hop = segment - overlap
+    starts = list(range(0, max(frames - overlap, 1), hop))
+
+    stems = np.zeros((len(model.sources), model.audio_channels, frames), dtype=np.float32)
+    total = np.zeros(frames, dtype=np.float32)
+    for i, start in enumerate(starts):
+        stop = min(start + segment, frames)
+        chunk = torch.from_numpy(np.ascontiguousarray(mix[:, start:stop]))
+        with torch.no_grad():
+            estimate = apply_model(model, chunk[None], device="cpu", split=True, overlap=0.25,
+                                   progress=False)[0].numpy()
+        weights = _fade_weights(stop - start, overlap, i == 0, i == len(starts) - 1)
+        stems[:, :, start:stop] += estimate * weights
+        total[start:stop] += weights
+        print(f"[SEPARATION] segment {i + 1}/{len(starts)}")
+    stems /= np.maximum(total, 1e-6)
+    stems = stems * scale + center
+
+    return {name: np.ascontiguousarray(
+                np.stack([loader.resample(channel, model.samplerate, sr) for channel in stems[index]], axis=1))
+            for index, name in enumerate(model.sources)}
+
+
+def _load_model(name):
+    import torch
+    from demucs.pretrained import get_model
+    torch.set_num_threads(SEPARATION_THREADS)
+    model = get_model(name)
+    model.cpu()
+    model.eval()
+    return model
+
+
+def _serve(requests, results, model_name):
+    """Worker entry point: load the model once, then separate requests until None arrives."""
+    # CPU only, whatever the machine has
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    try:
+        model = _load_model(model_name)
+    except Exception as e:
+        results.put((None, None, f"could not load {model_name}: {e}"))
+        return
+    print(f"[SEPARATION] {model_name} loaded, sources {list(model.sources)}")
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        request_id, samples, sr = request
+        try:
+            results.put((request_id, separate_array(model, samples, sr), None))
+        except Exception as e:
+            results.put((request_id, None, f"{type(e).__name__}: {e}"))
+
+
+class SeparationService:
+    """Runs one separation worker process and caches the stems it returns."""
+
+    def __init__(self, model=SEPARATION_MODEL, cache=None):
+        self.model = model
+        self.cache = cache if cache is not None else FeatureCache(STEM_CACHE_DIR, STEM_CACHE_MAX_BYTES)
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._waiting = {}
+        self._process = None
+        self._requests = None
+        self._results = None
+        self._listener = None
+
+    def _key(self, samples, sr, stem):
+        return audio_key(samples, sr, f"stem:{self.model}:{stem}")
+
+    def _start(self):
+        # spawn, not fork: the caller may have threads (and torch) running
+        context = multiprocessing.get_context("spawn")
+        self._requests = context.Queue()
+        self._results = context.Queue()
+        self._process = context.Process(target=_serve, args=(self._requests, self._results, self.model),
+                                        name="detectfx-separation",
+                                        daemon=not multiprocessing.current_process().daemon)
+        self._process.start()
+        self._listener = threading.Thread(target=self._listen, args=(self._results,),
+                                          name="separation-results", daemon=True)
+        self._listener.start()
+        print(f"[SEPARATION] worker started (pid {self._process.pid})")
+
+    def _listen(self, results):
+        while True:
+            message = results.get()
+            if message is None:
+                return
+            request_id, stems, error = message
+            with self._lock:
+                if request_id is None:
+                    # The model failed to load; fail everything waiting
+                    waiting, self._waiting = list(self._waiting.values()), {}
+                    self._process = None
+                else:
+                    waiting = [self._waiting.pop(request_id, None)]
+            for future in waiting:
+                if future is None:
+                    continue
+                if error is None:
+                    future.set_result(stems)
+                else:
+                    future.set_exception(SeparationError(error))
+
+    def submit(self, samples, sr):
+        """Queue samples for separation; the Future resolves to {stem: samples}."""
+        future = Future()
+        with self._lock:
+            if self._process is None or not self._process.is_alive():
+                self._start()
+            request_id = next(self._ids)
+            self._waiting[request_id] = future
+            self._requests.put((request_id, np.asarray(samples, dtype=np.float32), sr))
+        return future
+
+    def _wait(self, future, timeout):
+        """future.result(), failing early if the worker process dies."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return future.result(timeout=min(1.0, max(0.0, deadline - time.monotonic())))
+            except FuturesTimeout:
+                pass
+            with self._lock:
+                process = self._process
+            if process is not None and not process.is_alive():
+                with self._lock:
+                    if self._process is process:
+                        self._process = None
+                raise SeparationError(f"separation worker exited with code {process.exitcode}")
+            if time.monotonic() >= deadline:
+                raise SeparationError(f"no stems after {timeout} s")
+
+    def separate(self, samples, sr, stem="other", timeout=SEPARATION_TIMEOUT):
+        """
+        One stem of samples, from the cache or the worker.
+
+        Parameters:
+            samples: np.ndarray shaped (frames,) or (frames, channels)
+            sr: sample rate
+            stem: source name of the model ("other" holds the guitar for htdemucs)
+            timeout: seconds to wait for the worker
+        Returns:
+            float32 np.ndarray (frames, channels) at sr
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        key = self._key(samples, sr, stem)
+        entry = self.cache.get(key)
+        if entry is not None:
+            print(f"[SEPARATION] stem cache hit ({stem})")
+            return entry["samples"]
+
+        stems = self._wait(self.submit(samples, sr), timeout)
+        if stem not in stems:
+            raise SeparationError(f"{self.model} has no stem '{stem}', only {sorted(stems)}")
+        for name, separated in stems.items():
+            self.cache.put(self._key(samples, sr, name), samples=separated)
+        return stems[stem]
+
+    def shutdown(self):
+        with self._lock:
+            process, self._process = self._process, None
+            if process is None:
+                return
+            self._requests.put(None)
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+        self._results.put(None)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """Process-wide SeparationService, shut down at exit."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = SeparationService()
+            atexit.register(_service.shutdown)
+        return _service
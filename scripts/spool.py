@@ -0,0 +1,112 @@
+"""
+Disk-backed signals for block-by-block processing.
+
+A Spool holds a 1-D signal in an unlinked temp file. It is never mapped, so
+its samples do not count against RSS, and it is read back one block at a
+time. Peak and energy are tracked as blocks are written, so a pass that only
+needs them does not read the file again.
+
+Spools stand in for whole arrays wherever a job must stay O(block) in memory:
+decoded inputs (scripts.loader.load_spooled), their resampled and trimmed
+derivatives (scripts.analysis), and the intermediates of the streaming
+render (scripts.streaming). len() works on them as on an array.
+"""
+import tempfile
+
+import numpy as np
+
+DEFAULT_BLOCK_SIZE = 65536
+
+
+class Spool:
+    """
+    A signal written once, block by block, then read back in blocks. The peak
+    and sum of squares are tracked as blocks are written.
+    """
+
+    def __init__(self, dtype=None):
+        self.file = tempfile.TemporaryFile(prefix="detectfx-spool-")
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.length = 0
+        self.peak = None
+        self.sumsq = 0.0
+
+    def __len__(self):
+        return self.length
+
+    def write(self, block):
+        if self.dtype is None:
+            self.dtype = block.dtype
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+        if len(block) == 0:
+            return
+        # Same dtype as the whole-file max, so dividing by it rounds the same way
+        peak = np.max(np.abs(block))
+        self.peak = peak if self.peak is None else max(self.peak, peak)
+        self.sumsq += float(np.dot(block.astype(np.float64), block.astype(np.float64)))
+        self.file.seek(self.length * self.dtype.itemsize)
+        self.file.write(block.tobytes())
+        self.length += len(block)
+
+    def blocks(self, block_size=DEFAULT_BLOCK_SIZE, start=0, stop=None):
+        """Read samples start..stop back in blocks of block_size."""
+        stop = self.length if stop is None else min(stop, self.length)
+        itemsize = self.dtype.itemsize if self.dtype is not None else 1
+        for offset in range(start, stop, block_size):
+            count = min(block_size, stop - offset)
+            buffer = bytearray(count * itemsize)
+            # Seek every time, so readers of one spool can interleave
+            self.file.seek(offset * itemsize)
+            self.file.readinto(buffer)
+            yield np.frombuffer(buffer, dtype=self.dtype)
+
+    def read(self, start=0, stop=None):
+        """Samples start..stop as one array (for short windows)."""
+        stop = self.length if stop is None else min(stop, self.length)
+        parts = list(self.blocks(max(1, stop - start), start, stop))
+        return parts[0] if parts else np.zeros(0, dtype=self.dtype)
+
+    def slice(self, start):
+        """The signal from sample `start` on, without copying it."""
+        return SpoolSlice(self, start)
+
+    def rms(self):
+        return np.sqrt(self.sumsq / self.length) if self.length else 0.0
+
+    def close(self):
+        self.file.close()
+
+
+class SpoolSlice:
+    """The tail of a Spool from `start` on, read through the same file."""
+
+    def __init__(self, spool, start):
+        self.spool = spool
+        self.start = min(start, spool.length)
+        self.dtype = spool.dtype
+
+    @property
+    def length(self):
+        return self.spool.length - self.start
+
+    def __len__(self):
+        return self.length
+
+    def blocks(self, block_size=DEFAULT_BLOCK_SIZE, start=0, stop=None):
+        stop = self.length if stop is None else min(stop, self.length)
+        return self.spool.blocks(block_size, self.start + start, self.start + stop)
+
+    def read(self, start=0, stop=None):
+        stop = self.length if stop is None else min(stop, self.length)
+        return self.spool.read(self.start + start, self.start + stop)
+
+    def slice(self, start):
+        return SpoolSlice(self.spool, self.start + start)
+
+
+def write(blocks, dtype=None):
+    """A Spool holding the concatenation of blocks."""
+    spool = Spool(dtype)
+    for block in blocks:
+        spool.write(block)
+    return spool
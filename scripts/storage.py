@@ -0,0 +1,290 @@
+"""
+Storage client for generate().
+
+get_storage() returns a process-wide client that keeps its connection pool
+across jobs (render workers are long-lived). fetch_many() downloads every
+input concurrently. Each body is streamed in chunks into a spooled temp file
+(memory first, disk past fetch.SPOOL_MAX_BYTES) that the decoder reads
+directly.
+
+Backends, picked by DETECTFX_STORAGE_URL:
+- unset: Supabase storage at VITE_SUPABASE_URL with VITE_SUPABASE_ANON_KEY
+- http(s)://host: any server with Supabase's storage paths, e.g. the
+  stand-in from `python -m scripts.storage serve DIR`
+- file:///dir: objects are files under dir; nothing goes over the network
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from scripts.fetch import CHUNK_SIZE, RETRIES, RETRY_STATUS, SPOOL_MAX_BYTES
+
+BUCKET = "detectfx-bucket"
+STORAGE_URL = os.getenv("DETECTFX_STORAGE_URL")
+MAX_CONNECTIONS = int(os.getenv("DETECTFX_STORAGE_MAX_CONNECTIONS", "8"))
+
+
+class StorageError(Exception):
+    """An object could not be downloaded or uploaded."""
+
+
+class HTTPStorage:
+    """Supabase's storage REST API over one pooled httpx.Client (thread-safe)."""
+
+    def __init__(self, base_url, key=None, bucket=BUCKET):
+        import httpx
+        self.base_url = base_url.rstrip("/")
+        self.bucket = bucket
+        headers = {"apikey": key, "Authorization": f"Bearer {key}"} if key else {}
+        self.public = not key
+        self.client = httpx.Client(
+            headers=headers,
+            timeout=httpx.Timeout(connect=5.0, read=60.0, write=60.0, pool=30.0),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+            follow_redirects=True,
+        )
+
+    def _url(self, path, public=False):
+        scope = "object/public" if public else "object"
+        return f"{self.base_url}/storage/v1/{scope}/{self.bucket}/{quote(path)}"
+
+    def _request(self, send, what):
+        """send() with retries on transport errors and RETRY_STATUS; returns its result."""
+        import httpx
+        for attempt in range(RETRIES + 1):
+            try:
+                return send()
+            except (httpx.TransportError, _Retry) as e:
+                if attempt == RETRIES:
+                    raise StorageError(f"{what}: {e}") from e
+                time.sleep(0.25 * 2 ** attempt)
+
+    def open(self, path):
+        """Stream an object into a rewound SpooledTemporaryFile; the caller closes it."""
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+
+        def send():
+            with self.client.stream("GET", self._url(path, self.public)) as response:
+                _check(response, f"download {path}")
+                spool.seek(0)
+                spool.truncate()
+                for chunk in response.iter_bytes(CHUNK_SIZE):
+                    spool.write(chunk)
+        try:
+            self._request(send, f"download {path}")
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool
+
+    def upload(self, path, data, content_type="audio/wav", cache_seconds=3600):
+        """Upload (and overwrite) an object from bytes or a binary file object."""
+        headers = {"content-type": content_type, "cache-control": f"max-age={cache_seconds}",
+                   "x-upsert": "true"}
+
+        if hasattr(data, "read"):
+            # Streamed from the file in chunks; the length keeps the request unchunked
+            data.seek(0, os.SEEK_END)
+            headers["content-length"] = str(data.tell())
+
+        def send():
+            if hasattr(data, "seek"):
+                data.seek(0)
+            body = iter(lambda: data.read(CHUNK_SIZE), b"") if hasattr(data, "read") else data
+            _check(self.client.post(self._url(path), content=body, headers=headers), f"upload {path}")
+        self._request(send, f"upload {path}")
+        return {"path": path, "bucket": self.bucket}
+
+    def close(self):
+        self.client.close()
+
+
+class _Retry(Exception):
+    pass
+
+
+def _check(response, what):
+    if response.status_code in RETRY_STATUS:
+        raise _Retry(f"HTTP {response.status_code}")
+    if response.status_code >= 400:
+        response.read()
+        raise StorageError(f"{what}: HTTP {response.status_code} {response.text[:200]}")
+
+
+class FileStorage:
+    """Objects are files under root/<bucket>/ (offline stand-in)."""
+
+    def __init__(self, root, bucket=BUCKET):
+        self.root = os.path.join(root, bucket)
+        self.bucket = bucket
+
+    def _path(self, path):
+        full = os.path.normpath(os.path.join(self.root, path))
+        if not full.startswith(os.path.normpath(self.root) + os.sep):
+            raise StorageError(f"object path escapes the bucket: {path}")
+        return full
+
+    def open(self, path):
+        try:
+            return open(self._path(path), "rb")
+        except FileNotFoundError as e:
+            raise StorageError(f"download {path}: not found") from e
+
+    def upload(self, path, data, content_type="audio/wav", cache_seconds=3600):
+        full = self._path(path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if hasattr(data, "read"):
+                    data.seek(0)
+                    shutil.copyfileobj(data, f, CHUNK_SIZE)
+                else:
+                    f.write(data)
+            os.replace(tmp_path, full)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return {"path": path, "bucket": self.bucket}
+
+    def close(self):
+        pass
+
+
+def fetch_many(storage, paths):
+    """
+    Open every path concurrently. Returns the file objects in input order;
+    if any download fails the others are closed and the error is raised.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(paths)), thread_name_prefix="storage") as pool:
+        futures = [pool.submit(storage.open, path) for path in paths]
+    files, error = [], None
+    for future in futures:
+        try:
+            files.append(future.result())
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        for f in files:
+            f.close()
+        raise error
+    return files
+
+
+def from_env():
+    """Storage backend for DETECTFX_STORAGE_URL (see the module docstring)."""
+    if STORAGE_URL and STORAGE_URL.startswith("file://"):
+        return FileStorage(STORAGE_URL[len("file://"):])
+    if STORAGE_URL:
+        return HTTPStorage(STORAGE_URL, os.getenv("DETECTFX_STORAGE_KEY"))
+    from dotenv import load_dotenv
+    load_dotenv()
+    return HTTPStorage(os.getenv("VITE_SUPABASE_URL"), os.getenv("VITE_SUPABASE_ANON_KEY"))
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Process-wide storage client, created on first use."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = from_env()
+        return _storage
+
+
+def set_storage(storage):
+    """Replace the process-wide client, e.g. with a FileStorage for offline runs."""
+    global _storage
+    with _storage_lock:
+        _storage = storage
+
+
+def serve(root, port=8765, bucket=BUCKET):
+    """
+    HTTP stand-in for Supabase storage over FileStorage(root): GET on the
+    public and authenticated object paths, POST/PUT uploads.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import unquote, urlparse
+
+    storage = FileStorage(root, bucket)
+    prefixes = [f"/storage/v1/object/public/{bucket}/", f"/storage/v1/object/{bucket}/"]
+
+    class Handler(BaseHTTPRequestHandler):
+        def _object(self):
+            path = unquote(urlparse(self.path).path)
+            for prefix in prefixes:
+                if path.startswith(prefix):
+                    return path[len(prefix):]
+            return None
+
+        def _reply(self, status, body=b"", content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            name = self._object()
+            try:
+                f = storage.open(name) if name else None
+            except StorageError:
+                f = None
+            if f is None:
+                return self._reply(404, b'{"error": "not found"}')
+            with f:
+                size = os.fstat(f.fileno()).st_size
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+        def do_POST(self):
+            name = self._object()
+            if not name:
+                return self._reply(404, b'{"error": "not found"}')
+            length = self.headers.get("Content-Length")
+            if length is not None:
+                body = self.rfile.read(int(length))
+            else:
+                body = _read_chunked(self.rfile)
+            storage.upload(name, body)
+            self._reply(200, f'{{"Key": "{bucket}/{name}"}}'.encode())
+
+        do_PUT = do_POST
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    print(f"[STORAGE] serving {storage.root} on http://127.0.0.1:{port}")
+    server.serve_forever()
+
+
+def _read_chunked(stream):
+    body = bytearray()
+    while True:
+        size = int(stream.readline().strip() or b"0", 16)
+        if size == 0:
+            stream.readline()
+            return bytes(body)
+        body += stream.read(size)
+        stream.readline()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Offline stand-in for Supabase storage")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("root", help="directory holding <bucket>/<object path> files")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    serve(args.root, args.port)
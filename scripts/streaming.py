@@ -0,0 +1,414 @@
+"""
+Block-streaming render mode.
+
+render() runs the same chain as scripts/dsp.py's process_full_chain,
+final_processing_touchups and match_volume_to_reference, but on fixed-size
+blocks. Its inputs may be spooled signals (scripts.spool), which a stream
+job's AnalysisContext decodes, resamples, trims and analyses block by block
+as well. Nothing the length of the take is then held in memory: peak memory
+is set by the block size, not the take length. Arrays are accepted too and
+are only read, never copied.
+
+- IIR filters carry their lfilter/sosfilt state (zi) from block to block.
+- Chorus and reverb keep ring buffers (chorus.Chorus, reverb.ReverbWet).
+- The AudioBuffer filters and compressor (scripts.audiobuffer) and the
+  compander (scripts.compander, or sox) are stateful block processors.
+
+The stage kernels, filter designs and settings are scripts/dsp.py's own, so
+the block processors below only add the state. tests/test_streaming.py
+checks that both renders give the same output.
+
+The whole-file chain peak-normalizes (and RMS-matches) at several points.
+Those need a statistic of the entire signal before the next sample can be
+produced, so each one is a barrier. The pass before it writes its output to a
+Spool, which tracks peak and energy as blocks arrive. The next pass reads
+the spool back one block at a time.
+
+A few whole-file stages reduce to scalings, so no pass is spent on them:
+- pitch_down in its default "legacy" mode is the identity. Its "shift" mode
+  is a stateful block processor (pitch.PitchShifter).
+- match_volume_to_reference's RMS and LUFS gains are undone by the peak
+  normalization that follows them.
+"""
+import os
+import subprocess
+import threading
+
+import numpy as np
+from scipy.signal import lfilter, sosfilt
+
+from scripts import alignment, chorus, compander, dsp, framing, pitch, reverb, waveshaper
+from scripts.audiobuffer import Gain, OnePoleHighPass, OnePoleLowPass, RMSCompressor
+from scripts.spool import Spool
+
+DEFAULT_BLOCK_SIZE = int(os.getenv("DETECTFX_STREAM_BLOCK", "65536"))
+
+
+def array_blocks(samples, block_size=DEFAULT_BLOCK_SIZE, start=0, stop=None):
+    """Blocks (views) of an in-memory signal."""
+    stop = len(samples) if stop is None else min(stop, len(samples))
+    for offset in range(start, stop, block_size):
+        yield samples[offset:min(offset + block_size, stop)]
+
+
+def signal_blocks(signal, block_size=DEFAULT_BLOCK_SIZE, start=0, stop=None):
+    """Blocks of a render input, an array or a spooled signal (scripts.spool)."""
+    if isinstance(signal, np.ndarray):
+        return array_blocks(signal, block_size, start, stop)
+    return signal.blocks(block_size, start, stop)
+
+
+def read(signal, start, stop):
+    """Samples start..stop of a render input."""
+    if isinstance(signal, np.ndarray):
+        return signal[start:stop]
+    return signal.read(start, stop)
+
+
+def run(blocks, processors, sink):
+    """
+    Push blocks through processors into sink (a Spool, or any callable taking
+    blocks). A processor may return fewer or more samples than it was given;
+    processors with a flush() method are drained at the end.
+    """
+    write = sink.write if isinstance(sink, Spool) else sink
+    for block in blocks:
+        for process in processors:
+            block = process(block)
+        write(block)
+    for i, process in enumerate(processors):
+        flush = getattr(process, "flush", None)
+        if flush is None:
+            continue
+        tail = flush()
+        for later in processors[i + 1:]:
+            tail = later(tail)
+        write(tail)
+    return sink
+
+
+def spool(blocks, processors):
+    return run(blocks, processors, Spool())
+
+
+# ---------------------------------------------------------------------------
+# Block processors. Each is called with consecutive blocks of one signal and
+# returns the processed block, computed exactly as the whole-file stage would.
+# ---------------------------------------------------------------------------
+
+class Divide:
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, block):
+        return block / self.value
+
+
+class Multiply:
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, block):
+        return block * self.value
+
+
+class Map:
+    """Sample-wise function."""
+
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, block):
+        return self.function(block)
+
+
+class IIR:
+    """lfilter(b, a) with its delay line carried between blocks."""
+
+    def __init__(self, b, a):
+        self.b, self.a = b, a
+        self.zi = np.zeros(max(len(a), len(b)) - 1)
+
+    def __call__(self, block):
+        out, self.zi = lfilter(self.b, self.a, block, zi=self.zi)
+        return out
+
+
+class SOS:
+    """sosfilt(sos) with its section states carried between blocks."""
+
+    def __init__(self, sos):
+        self.sos = sos
+        self.zi = np.zeros((sos.shape[0], 2))
+
+    def __call__(self, block):
+        out, self.zi = sosfilt(self.sos, block, zi=self.zi)
+        return out
+
+
+class CompressHighs:
+    """dsp.compress_highs, with the band-pass state carried between blocks."""
+
+    def __init__(self, sr):
+        self.band = IIR(*dsp.high_band_coefficients(sr))
+
+    def __call__(self, signal):
+        return dsp.compress_band(signal, self.band(signal))
+
+
+class EnhanceTransients:
+    """dsp.enhance_transients, with the high-pass state carried between blocks."""
+
+    def __init__(self, sr):
+        self.highpass = SOS(dsp.transient_sos(sr))
+
+    def __call__(self, signal):
+        return dsp.add_transients(signal, self.highpass(signal))
+
+
+class SoxCompander:
+    """
+    Streams 32-bit float blocks through one sox process running COMPAND_ARGS.
+    A reader thread drains sox's stdout, so writes never deadlock. Output
+    lags the input by sox's buffering, and the rest comes out in flush().
+    """
+
+    def __init__(self, sr, args=compander.COMPAND_ARGS):
+        raw = ["-t", "raw", "-r", str(sr), "-e", "floating-point", "-b", "32", "-c", "1"]
+        self.process = subprocess.Popen(["sox", *raw, "-", *raw, "-", *args],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.output = bytearray()
+        self.lock = threading.Lock()
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def _read(self):
+        while True:
+            chunk = self.process.stdout.read1(1 << 16)
+            if not chunk:
+                return
+            with self.lock:
+                self.output += chunk
+
+    def _take(self):
+        with self.lock:
+            usable = len(self.output) - len(self.output) % 4
+            data = bytes(self.output[:usable])
+            del self.output[:usable]
+        return np.frombuffer(data, dtype=np.float32).copy()
+
+    def __call__(self, block):
+        self.process.stdin.write(block.astype(np.float32).tobytes())
+        return self._take()
+
+    def flush(self):
+        self.process.stdin.close()
+        self.reader.join()
+        if self.process.wait() != 0:
+            raise subprocess.CalledProcessError(self.process.returncode, "sox")
+        return self._take()
+
+
+# ---------------------------------------------------------------------------
+# The render itself
+# ---------------------------------------------------------------------------
+
+def _peak(blocks):
+    peak = None
+    for block in blocks:
+        if len(block):
+            value = np.max(np.abs(block))
+            peak = value if peak is None else max(peak, value)
+    return peak
+
+
+def _sumsq(blocks):
+    return sum(float(np.dot(block.astype(np.float64), block.astype(np.float64))) for block in blocks)
+
+
+def _full_chain(samples, sr, effect_chain, block_size):
+    """process_full_chain. Returns a Spool of float32 samples."""
+    # Normalize, then the tube screamer up to its own normalization
+    peak = _peak(signal_blocks(samples, block_size))
+    screamed = spool(signal_blocks(samples, block_size), [
+        Divide(peak),
+        IIR(*dsp.high_pass_coefficients(sr)),
+        Map(lambda x: dsp.soft_clip(x, drive=dsp.TUBE_SCREAMER["drive"])),
+        IIR(*dsp.low_pass_coefficients(sr)),
+        Multiply(dsp.TUBE_SCREAMER["output_gain"]),
+    ])
+
+    source = screamed
+    pending = [
+        Divide(screamed.peak),
+        Map(lambda x: waveshaper.fuzz(x, **dsp.FUZZ, in_place=True)),
+    ]
+    for effect in effect_chain:
+        if effect["effect"] == "chorus":
+            print("🎵 Adding chorus...")
+            pending.append(chorus.Chorus(sr))
+        elif effect["effect"] == "reverb":
+            print("🌫️ Adding reverb...")
+            preset = effect.get("preset", "legacy")
+            # The wet path is normalized on its own, then the mix is normalized
+            dry = spool(source.blocks(block_size), pending)
+            source.close()
+            wet = spool(dry.blocks(block_size), [reverb.ReverbWet(sr, dry.length, preset)])
+            wet_level = reverb.wet_level_for(preset)
+            wet_scale = wet.peak + 1e-9
+            mixed = Spool()
+            for x, w in zip(dry.blocks(block_size), wet.blocks(block_size)):
+                mixed.write((1 - wet_level) * x + wet_level * (w / wet_scale))
+            dry.close()
+            wet.close()
+            source, pending = mixed, [Divide(mixed.peak + 1e-9)]
+
+    chained = spool(source.blocks(block_size), pending)
+    source.close()
+
+    # The AudioBuffer stage (apply_effect_chain): hard clip distortion first.
+    # Its own normalization divides by the peak of an already normalized
+    # signal, which is exactly 1, so it needs no pass.
+    segment_effects = [
+        Divide(chained.peak),
+        Map(lambda x: waveshaper.hard_clip(x.astype(np.float32), threshold=dsp.HARD_CLIP_THRESHOLD, in_place=True)),
+    ]
+    for effect in effect_chain:
+        if effect["effect"] == "gain":
+            segment_effects.append(Gain(effect["amount_db"]))
+        elif effect["effect"] == "lowpass":
+            segment_effects.append(OnePoleLowPass(sr, effect["cutoff"]))
+        elif effect["effect"] == "highpass":
+            segment_effects.append(OnePoleHighPass(sr, effect["cutoff"]))
+        elif effect["effect"] == "compressor":
+            if compander.BACKEND == "sox":
+                segment_effects.append(SoxCompander(sr))
+            else:
+                segment_effects.append(compander.Compander.from_args(sr))
+        elif effect["effect"] == "distortion":
+            segment_effects.append(Gain(10))
+            segment_effects.append(RMSCompressor(sr))
+
+    processed = spool(chained.blocks(block_size), segment_effects)
+    chained.close()
+    print("✅ Full processed tone rendered")
+    return processed
+
+
+def _touchups(processed, reference, sr, block_size, pitch_mode="legacy"):
+    """final_processing_touchups + match_volume_to_reference. Returns a Spool."""
+    ref_peak = _peak(signal_blocks(reference, block_size))
+    rms_ref = np.sqrt(_sumsq(b / ref_peak for b in signal_blocks(reference, block_size)) / len(reference))
+    rms_proc = processed.rms() / float(processed.peak)
+    gain_factor = np.float32(rms_ref / rms_proc)
+
+    # Filtering, high band compression and pitch_down
+    stages = [
+        Divide(processed.peak),
+        Multiply(gain_factor),
+        IIR(*dsp.low_pass_coefficients(sr, dsp.SMOOTHING_CUTOFF, order=2)),
+        CompressHighs(sr),
+    ]
+    if pitch_mode == "shift":
+        stages.append(pitch.PitchShifter(sr, semitones=dsp.PITCH_SEMITONES))
+    smoothed = spool(processed.blocks(block_size), stages)
+    processed.close()
+
+    # match_dynamics: line the reference up with the input, then match RMS
+    input_peak = smoothed.peak
+    n = smoothed.length
+    # trim_leading_silence of the normalized reference, without normalizing a copy
+    ref_start = framing.leading_silence_blocks(signal_blocks(reference, block_size), scale=ref_peak)
+    ref_len = len(reference) - ref_start
+    if ref_len > n:
+        # Same alignment.align() as match_dynamics, fed from the spool
+        start = ref_start
+        match = alignment.align_envelopes(
+            alignment.envelope(b / ref_peak for b in signal_blocks(reference, block_size, start)),
+            alignment.envelope(b / input_peak for b in smoothed.blocks(block_size)),
+            ref_len, n,
+            lambda a, b: read(reference, start + a, start + b) / ref_peak,
+            lambda a, b: smoothed.read(a, b) / input_peak)
+        print(f"Aligned reference at sample {match.offset} (confidence {match.confidence:.2f})")
+        ref_start += match.offset
+        ref_len = n
+    min_len = min(n, ref_len)
+
+    # match_dynamics' onset envelopes leave out the frame ending at the last sample
+    frames = framing.frame_count(min_len - 1, 1024, 512)
+    input_env = framing.rms_blocks(b / input_peak for b in smoothed.blocks(block_size, stop=min_len))[:frames]
+    ref_env = framing.rms_blocks(b / ref_peak for b in signal_blocks(reference, block_size, ref_start,
+                                                                     ref_start + min_len))[:frames]
+    frame_offset = (framing.detect_onset(ref_env / np.max(ref_env))
+                    - framing.detect_onset(input_env / np.max(input_env)))
+    sample_offset = frame_offset * 512
+    # Positive: drop the start of the reference; negative: pad it with silence
+    ref_lead = 0
+    if sample_offset > 0:
+        ref_start += sample_offset
+        ref_len = min_len - sample_offset
+    elif sample_offset < 0:
+        ref_lead = -sample_offset
+        ref_len = min_len + ref_lead
+    else:
+        ref_len = min_len
+    min_len = min(min_len, ref_len)
+
+    ref_sumsq = _sumsq(b / ref_peak for b in signal_blocks(
+        reference, block_size, ref_start, ref_start + max(0, min_len - ref_lead)))
+    ref_rms = np.sqrt(ref_sumsq / min_len)
+    input_sumsq = _sumsq(b / input_peak for b in smoothed.blocks(block_size, stop=min_len))
+    input_rms = np.sqrt(input_sumsq / min_len)
+    gain = ref_rms / input_rms if input_rms > 0 else 1.0
+    output_peak = _peak(b / input_peak * gain for b in smoothed.blocks(block_size, stop=min_len))
+    print("Applied average volume matching:")
+    print("Ref RMS:", ref_rms, " | Input RMS:", input_rms, " | Gain:", gain)
+
+    # undertone_matching
+    undertoned = spool(smoothed.blocks(block_size, stop=min_len), [
+        Divide(input_peak),
+        Multiply(gain),
+        Divide(output_peak),
+        SOS(dsp.low_shelf_sos(sr)),
+        SOS(dsp.high_shelf_sos(sr)),
+        EnhanceTransients(sr),
+        Map(dsp.simple_compressor),
+    ])
+    smoothed.close()
+    return undertoned
+
+
+def render(samples, sr, effect_chain, reference, sink, block_size=DEFAULT_BLOCK_SIZE, progress=None,
+           pitch_mode=None):
+    """
+    Streaming equivalent of process_full_chain -> final_processing_touchups ->
+    match_volume_to_reference.
+
+    Parameters:
+        samples: mono float clean signal, an array or a spooled signal
+        sr: sample rate
+        effect_chain: effect list from map_delta_to_dsp
+        reference: mono float (trimmed) reference signal, an array or a spooled signal
+        sink: callable receiving the finished float64 blocks in order
+        block_size: samples per block; bounds the intermediate signals held in memory
+        progress: optional callback, called with "touchups" and "loudness"
+                  as those stages start
+        pitch_mode: pitch_down mode, "legacy" or "shift" (default DETECTFX_PITCH_MODE)
+    Returns:
+        number of samples written to sink
+    """
+    processed = _full_chain(samples, sr, effect_chain, block_size)
+    if progress is not None:
+        progress("touchups")
+    pitch_mode = pitch_mode or os.getenv("DETECTFX_PITCH_MODE", "legacy")
+    undertoned = _touchups(processed, reference, sr, block_size, pitch_mode)
+    if progress is not None:
+        progress("loudness")
+
+    # The touch-ups end on two peak normalizations, and the volume match
+    # leaves the signal at 1 / OUTPUT_HEADROOM of full scale
+    length = undertoned.length
+    run(undertoned.blocks(block_size), [Divide(undertoned.peak), Divide(dsp.OUTPUT_HEADROOM)], sink)
+    undertoned.close()
+    print("✅ Output volume matched to reference")
+    return length
@@ -0,0 +1,97 @@
+"""
+Start-up warm-up.
+
+Each hook runs one request path once on a second of synthetic audio, so a
+fresh process (a dyno after a restart, a new render worker) pays for its
+imports and first calls at start-up rather than on its first request:
+scipy.signal, librosa's lazily loaded submodules, pyloudnorm, soundfile's
+codecs, filter design.
+
+- classify_path(): decode and the classifier's feature extraction (the
+  server process, /results)
+- render_path(): generate()'s analysis, the whole-file chain and the
+  streaming render (render workers, src/jobs.py)
+
+Neither touches storage, the feature cache or a model. The server runs them
+at start-up unless DETECTFX_WARM_UP=0; see src/main.py.
+"""
+import contextlib
+import io
+import os
+import time
+
+import numpy as np
+
+WARM_UP = os.getenv("DETECTFX_WARM_UP", "1") == "1"
+WARM_UP_SR = 44100
+WARM_UP_SECONDS = 1.0
+
+
+def _take(seed, sr=WARM_UP_SR, seconds=WARM_UP_SECONDS):
+    """A few decaying notes with a little noise, as 16-bit WAV bytes."""
+    import soundfile as sf
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    signal = np.zeros(len(t))
+    for start in np.arange(0, seconds, 0.25):
+        tail = t >= start
+        signal[tail] += np.sin(2 * np.pi * rng.uniform(82, 660) * (t[tail] - start)) * np.exp(-4 * (t[tail] - start))
+    signal += 0.01 * rng.standard_normal(len(t))
+    buffer = io.BytesIO()
+    sf.write(buffer, (signal / np.max(np.abs(signal))).astype(np.float32), sr, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def classify_path():
+    """Decode one take and compute its classifier row."""
+    from scripts import loader
+    from scripts.features import extract_features
+
+    audio = loader.load(_take(0))
+    extract_features(audio.samples, audio.sr).classifier_vector()
+
+
+def render_path():
+    """generate()'s analysis and both render modes, without storage or encoding."""
+    from scripts import dsp, streaming
+    from scripts.analysis import AnalysisContext
+
+    job = AnalysisContext()
+    clean = job.add("clean", _take(0))
+    reference = job.add("reference", _take(1))
+    guitar = reference.trimmed().at_rate(clean.sr)
+    delta = guitar.tone_vector() - clean.tone_vector()
+    # Every effect map_delta_to_dsp can pick, whatever the two takes say
+    effect_chain = dsp.map_delta_to_dsp(delta, clean.mfcc(), guitar.mfcc()) + [
+        {"effect": "lowpass", "cutoff": 3000}, {"effect": "compressor", "intensity": "light"},
+        {"effect": "gain", "amount_db": 6}, {"effect": "chorus"}, {"effect": "reverb"}]
+
+    processed = dsp.process_full_chain(clean.samples, clean.sr, effect_chain)
+    processed = dsp.final_processing_touchups(processed, guitar.samples, clean.sr)
+    dsp.match_volume_to_reference(processed, guitar.samples, clean.sr, target_loudness=guitar.loudness())
+    streaming.render(clean.samples, clean.sr, effect_chain, guitar.samples, lambda block: None)
+
+
+def warm_up(*paths, quiet=True):
+    """
+    Run the given warm-up paths (default both) and report how long each took.
+    quiet swallows the stages' print output; only use it where nothing else
+    prints concurrently (redirect_stdout is process-wide).
+
+    Returns:
+        {path name: seconds}, None for a path that failed
+    """
+    paths = paths or (classify_path, render_path)
+    seconds = {}
+    for path in paths:
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+                path()
+            seconds[path.__name__] = round(time.perf_counter() - start, 3)
+        except Exception as e:
+            # A failed warm-up only means a slower first request
+            print(f"[WARMUP] {path.__name__} failed: {type(e).__name__}: {e}")
+            seconds[path.__name__] = None
+    print(f"[WARMUP] {seconds}")
+    return seconds
@@ -133,6 +133,26 @@ const AudioEffectsApplier: React.FC = () => {
         return publicUrl;
     }
 
+    const waitForJob = async (job_id: string) => {
+      while (true) {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        const res = await fetch(`${import.meta.env.VITE_BACKEND_ENDPOINT}/jobs/${job_id}`);
+        if (!res.ok){
+          //console.log("Error polling job: ", res.status);
+          return false;
+        }
+        const job = await res.json();
+        //console.log("Job", job_id, job.status, job.stage, job.progress);
+        if (job.status === "done"){
+          return true;
+        }
+        if (job.status === "failed"){
+          //console.log("Generation failed: ", job.error);
+          return false;
+        }
+      }
+    }
+
     const sendData = async (process_id: string, userID: string, cleanUUID: string, referenceUUID: string, cleanName: string, referenceName: string, clean_storage_link: string, reference_storage_link: string, generated_id: string, generated_name: string, generated_storage_link: string) => {
     if (!uploadedCleanFile || !uploadedReferenceFile) return;
     
@@ -158,7 +178,12 @@ const AudioEffectsApplier: React.FC = () => {
 
         }
 
-        const data = await res.json();
+        //generation runs as a background job, poll until it finishes
+        const {job_id} = await res.json();
+        const finished = await waitForJob(job_id);
+        if (!finished){
+          return;
+        }
         //console.log("Ready to access generated file ", generated_name, " at ", generated_storage_link);
         const publicGeneratedFileUrl = await getPublicURL("detectfx-bucket", generated_storage_link);
         //console.log("Generated total file path:", publicGeneratedFileUrl);
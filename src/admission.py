@@ -0,0 +1,416 @@
+"""
+Memory-budget admission control for /results and /generate.
+
+Before any audio is decoded, each piece of work gets an estimate of its peak
+memory. The estimate is a linear model in the number of decoded samples
+(frames * channels), which is read from the file header. The work then
+reserves that many MB from one MemoryBudget shared by both endpoints, and
+releases them when it finishes. When the budget is full, work waits in
+arrival order; a /results request that waits too long gets a 503 with
+Retry-After. A single job estimated above the whole budget is charged the
+whole budget, so it runs alone instead of never running.
+
+Every finished piece of work reports its measured peak. stats() compares the
+measured peaks with the estimates, so the model below can be checked and
+recalibrated.
+
+DETECTFX_MEMORY_LIMIT_MB is the memory limit, by default the 512 MB of the
+dyno (a smaller cgroup limit wins when no value is set). DETECTFX_MEMORY_BUDGET_MB
+overrides the budget, which otherwise is BUDGET_FRACTION of the limit minus
+the resident footprint: the server process and every child process it keeps
+(render workers, the feature pool, the separation worker). Measured peaks are
+growth above each process's idle RSS, so that footprint is never charged to
+work. It is measured again whenever no admitted work is running, since the
+child processes start lazily and keep what their first jobs imported.
+"""
+import asyncio
+import collections
+import io
+import os
+import struct
+import threading
+import time
+from dataclasses import dataclass
+
+import psutil
+
+ADMISSION_WAIT = float(os.getenv("DETECTFX_ADMISSION_WAIT", "10"))
+RETRY_AFTER = int(os.getenv("DETECTFX_ADMISSION_RETRY_AFTER", "30"))
+BUDGET_FRACTION = 0.8
+# A standard-1X / basic dyno
+DYNO_MEMORY_MB = 512
+
+# (base MB, bytes per decoded sample) of each kind of work, fitted to peaks
+# measured on 15-120 s takes with a cold feature cache. Render bases are set
+# from freshly spawned job workers, so they cover the first-use imports.
+# A stream render decodes, analyses and renders both inputs block by block
+# (see scripts/streaming.py), so its peak is flat: 13 MB over the imports for
+# a 15 s take, 16 MB for a 240 s one. Its per-sample term only covers the
+# per-frame analysis products (MFCC matrix, frame descriptors).
+ESTIMATE_MODELS = {
+    "classify": (135, 70),
+    "render_whole": (220, 120),
+    "render_stream": (240, 1),
+}
+
+# How much of a file is fetched to read its header
+HEAD_BYTES = 64 * 1024
+# With no usable header, assume a 128 kbps stereo MP3 at 44.1 kHz
+FALLBACK_SAMPLES_PER_BYTE = 44100 * 2 / 16000
+
+
+@dataclass(frozen=True)
+class AudioInfo:
+    """What admission needs to know about an input, read without decoding it."""
+    frames: int
+    sr: int
+    channels: int
+    exact: bool
+
+    @property
+    def samples(self):
+        return self.frames * self.channels
+
+    @property
+    def duration(self):
+        return self.frames / self.sr if self.sr else 0.0
+
+
+def _fallback_info(total_bytes):
+    samples = int(total_bytes * FALLBACK_SAMPLES_PER_BYTE)
+    return AudioInfo(frames=samples // 2, sr=44100, channels=2, exact=False)
+
+
+def _wav_info(head, total_bytes):
+    """Parse a RIFF/WAVE header. Returns None if head is not a WAV file."""
+    if len(head) < 12 or head[:4] not in (b"RIFF", b"RF64") or head[8:12] != b"WAVE":
+        return None
+    offset = 12
+    channels = sr = frame_bytes = None
+    while offset + 8 <= len(head):
+        chunk_id, size = head[offset:offset + 4], struct.unpack("<I", head[offset + 4:offset + 8])[0]
+        body = offset + 8
+        if chunk_id == b"fmt " and body + 16 <= len(head):
+            channels, sr = struct.unpack("<HI", head[body + 2:body + 8])
+            frame_bytes = struct.unpack("<H", head[body + 12:body + 14])[0]
+        elif chunk_id == b"data":
+            if not (channels and sr and frame_bytes):
+                return None
+            # Streamed or RF64 files leave the size unset; use the file length
+            if size in (0, 0xFFFFFFFF) and total_bytes:
+                size = total_bytes - body
+            return AudioInfo(frames=size // frame_bytes, sr=sr, channels=channels, exact=True)
+        offset = body + size + (size & 1)
+    return None
+
+
+def probe_bytes(head, total_bytes=None):
+    """
+    AudioInfo from the first bytes of an encoded file.
+
+    Parameters:
+        head: the first bytes of the file (HEAD_BYTES is plenty for WAV/FLAC)
+        total_bytes: size of the whole file, if known
+    Returns:
+        AudioInfo; exact=False when the size had to be guessed from total_bytes
+    """
+    import soundfile as sf
+
+    total_bytes = total_bytes or len(head)
+    info = _wav_info(head, total_bytes)
+    if info is not None:
+        return info
+    # FLAC keeps the total frame count in its first block. For other formats
+    # libsndfile can only count frames when it has the whole file.
+    if len(head) >= total_bytes or head[:4] == b"fLaC":
+        try:
+            info = sf.info(io.BytesIO(head))
+            if info.frames > 0:
+                return AudioInfo(frames=info.frames, sr=info.samplerate, channels=info.channels, exact=True)
+        except (sf.LibsndfileError, RuntimeError):
+            pass
+    return _fallback_info(total_bytes)
+
+
+def probe_file(path):
+    """AudioInfo for a file on disk."""
+    import soundfile as sf
+
+    try:
+        info = sf.info(path)
+        if info.frames > 0:
+            return AudioInfo(frames=info.frames, sr=info.samplerate, channels=info.channels, exact=True)
+    except (sf.LibsndfileError, RuntimeError):
+        pass
+    return _fallback_info(os.path.getsize(path))
+
+
+def estimate_mb(kind, *inputs):
+    """Estimated peak MB of one piece of work of `kind` over the given AudioInfos."""
+    base, per_sample = ESTIMATE_MODELS[kind]
+    return base + per_sample * sum(info.samples for info in inputs) / 1024 / 1024
+
+
+def render_kind(render_mode=None):
+    """The ESTIMATE_MODELS key of a /generate render in the given (or configured) mode."""
+    render_mode = render_mode or os.getenv("DETECTFX_RENDER_MODE", "whole")
+    return "render_stream" if render_mode == "stream" else "render_whole"
+
+
+def memory_limit_mb():
+    """
+    Memory available to this container: DETECTFX_MEMORY_LIMIT_MB if set, else
+    the dyno size, or the cgroup limit when that is smaller. A dyno shows the
+    host's physical memory and no cgroup limit, so neither is a safe default.
+    """
+    if os.getenv("DETECTFX_MEMORY_LIMIT_MB"):
+        return float(os.getenv("DETECTFX_MEMORY_LIMIT_MB"))
+    limit = DYNO_MEMORY_MB * 1024 * 1024
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v2 says "max", v1 a huge number, when there is no limit
+        if value.isdigit() and int(value) < limit:
+            return int(value) / 1024 / 1024
+    return limit / 1024 / 1024
+
+
+def footprint_mb():
+    """RSS of this process plus all of its child processes, in MB."""
+    process = psutil.Process(os.getpid())
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            # Exited since children() listed it
+            pass
+    return total / 1024 / 1024
+
+
+class PeakSampler:
+    """
+    Context manager that samples this process's RSS in a background thread.
+    peak_mb is the highest RSS seen above the RSS at entry. Other work that
+    runs in the same process at the same time is counted too.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self, process, start):
+        peak = start
+        while True:
+            peak = max(peak, process.memory_info().rss)
+            self.peak_mb = (peak - start) / 1024 / 1024
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        process = psutil.Process(os.getpid())
+        self._thread = threading.Thread(target=self._sample, args=(process, process.memory_info().rss),
+                                        name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+class MemoryBudget:
+    """
+    A semaphore counted in MB. Waiters are admitted strictly in arrival order,
+    so a large job at the head of the line is not starved by small ones.
+    acquire() blocks a thread; acquire_async() polls from the event loop.
+    Both return the MB actually charged (release that amount), or None on timeout.
+
+    With fraction set, total_mb follows the resident footprint: it is
+    limit_mb * fraction - footprint_mb(), measured again by remeasure() and
+    every time the last admitted work is released.
+    """
+
+    def __init__(self, total_mb, limit_mb=None, fraction=None):
+        self.total_mb = total_mb
+        self.limit_mb = limit_mb
+        self.fraction = fraction
+        self.footprint_mb = None
+        self.in_use_mb = 0.0
+        self.peak_in_use_mb = 0.0
+        self.admitted = 0
+        self.waited = 0
+        self.timed_out = 0
+        self._waiting = collections.deque()
+        self._cond = threading.Condition()
+        self._estimates = {}
+
+    @classmethod
+    def from_env(cls):
+        limit = memory_limit_mb()
+        if os.getenv("DETECTFX_MEMORY_BUDGET_MB"):
+            total = float(os.getenv("DETECTFX_MEMORY_BUDGET_MB"))
+            print(f"[ADMISSION] Memory limit {limit:.0f} MB, budget {total:.0f} MB")
+            return cls(total, limit)
+        budget = cls(0.0, limit, BUDGET_FRACTION)
+        budget.remeasure()
+        return budget
+
+    def _remeasure(self):
+        """Set total_mb from the current footprint. Call with the lock held and nothing admitted."""
+        footprint = footprint_mb()
+        total = max(1.0, self.limit_mb * self.fraction - footprint)
+        if self.footprint_mb is None or abs(total - self.total_mb) >= 1.0:
+            print(f"[ADMISSION] Memory limit {self.limit_mb:.0f} MB, resident {footprint:.0f} MB, "
+                  f"budget {total:.0f} MB")
+        self.footprint_mb = footprint
+        self.total_mb = total
+
+    def remeasure(self):
+        """
+        Measure the resident footprint again, e.g. once worker processes have
+        started. Skipped while admitted work is running, whose memory would be
+        counted as footprint; the release of the last of it measures instead.
+        """
+        if self.fraction is None:
+            return
+        with self._cond:
+            if self.in_use_mb == 0:
+                self._remeasure()
+                self._cond.notify_all()
+
+    def _warn_alone(self, mb):
+        if mb > self.total_mb:
+            print(f"[ADMISSION] Estimate {mb:.0f} MB exceeds the {self.total_mb:.0f} MB budget, running it alone")
+
+    def _take(self, ticket, mb):
+        """
+        Admit ticket if it is first in line and fits. Call with the lock held.
+        Returns the MB charged, or None. The cap is applied here because a
+        remeasure() can shrink the budget while ticket waits.
+        """
+        cost = min(mb, self.total_mb)
+        if self._waiting[0] is not ticket or self.in_use_mb + cost > self.total_mb:
+            return None
+        self._waiting.popleft()
+        self.in_use_mb += cost
+        self.peak_in_use_mb = max(self.peak_in_use_mb, self.in_use_mb)
+        self.admitted += 1
+        # The next in line may fit as well
+        self._cond.notify_all()
+        return cost
+
+    def _give_up(self, ticket):
+        self._waiting.remove(ticket)
+        self.timed_out += 1
+        self._cond.notify_all()
+
+    def acquire(self, mb, timeout=None):
+        self._warn_alone(mb)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            ticket = object()
+            self._waiting.append(ticket)
+            cost = self._take(ticket, mb)
+            if cost is not None:
+                return cost
+            self.waited += 1
+            while True:
+                cost = self._take(ticket, mb)
+                if cost is not None:
+                    return cost
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._give_up(ticket)
+                    return None
+                self._cond.wait(remaining)
+
+    async def acquire_async(self, mb, timeout=None, poll=0.05):
+        self._warn_alone(mb)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        ticket = object()
+        with self._cond:
+            self._waiting.append(ticket)
+            cost = self._take(ticket, mb)
+            if cost is not None:
+                return cost
+            self.waited += 1
+        try:
+            while True:
+                await asyncio.sleep(poll)
+                with self._cond:
+                    cost = self._take(ticket, mb)
+                    if cost is not None:
+                        return cost
+                    if deadline is not None and time.monotonic() >= deadline:
+                        self._give_up(ticket)
+                        return None
+        except asyncio.CancelledError:
+            # Client went away while waiting
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    self._cond.notify_all()
+            raise
+
+    def release(self, cost):
+        with self._cond:
+            self.in_use_mb -= cost
+            # Float sums of the costs may not come back to exactly 0
+            if self.in_use_mb < 1e-6:
+                self.in_use_mb = 0.0
+            if self.in_use_mb == 0 and self.fraction is not None:
+                # Idle: whatever the processes still hold is footprint now
+                self._remeasure()
+            self._cond.notify_all()
+
+    def observe(self, kind, estimate_mb, measured_mb):
+        """Record the measured peak of a finished piece of work next to its estimate."""
+        with self._cond:
+            record = self._estimates.setdefault(kind, {
+                "count": 0, "underestimates": 0, "ratio_sum": 0.0, "max_ratio": 0.0,
+                "last_estimate_mb": None, "last_measured_mb": None,
+            })
+            ratio = measured_mb / estimate_mb if estimate_mb else 0.0
+            record["count"] += 1
+            record["underestimates"] += measured_mb > estimate_mb
+            record["ratio_sum"] += ratio
+            record["max_ratio"] = max(record["max_ratio"], ratio)
+            record["last_estimate_mb"] = round(estimate_mb, 1)
+            record["last_measured_mb"] = round(measured_mb, 1)
+        print(f"[ADMISSION] {kind}: estimated {estimate_mb:.0f} MB, measured {measured_mb:.0f} MB")
+        if measured_mb > estimate_mb:
+            print(f"[ADMISSION] {kind} peak exceeded its estimate by {measured_mb - estimate_mb:.0f} MB")
+
+    def stats(self):
+        """Numbers reported by /admission and /watchdog."""
+        with self._cond:
+            estimates = {
+                kind: {
+                    "count": record["count"],
+                    "underestimates": record["underestimates"],
+                    "mean_ratio": round(record["ratio_sum"] / record["count"], 3),
+                    "max_ratio": round(record["max_ratio"], 3),
+                    "last_estimate_mb": record["last_estimate_mb"],
+                    "last_measured_mb": record["last_measured_mb"],
+                }
+                for kind, record in self._estimates.items()
+            }
+            return {
+                "limit_mb": None if self.limit_mb is None else round(self.limit_mb, 1),
+                "footprint_mb": None if self.footprint_mb is None else round(self.footprint_mb, 1),
+                "budget_mb": round(self.total_mb, 1),
+                "in_use_mb": round(self.in_use_mb, 1),
+                "peak_in_use_mb": round(self.peak_in_use_mb, 1),
+                "waiting": len(self._waiting),
+                "admitted": self.admitted,
+                "waited": self.waited,
+                "timed_out": self.timed_out,
+                "estimates": estimates,
+            }
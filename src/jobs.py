@@ -0,0 +1,302 @@
+"""
+Background render jobs for /generate.
+
+Jobs run generate() in a bounded pool of worker processes, so a long render
+neither holds the HTTP request open nor blocks a server thread. Each job gets
+an ID that /jobs/{id} reports on. Workers send stage updates back through a
+multiprocessing queue, and a listener thread in the server process folds
+them into the job records.
+
+DETECTFX_JOB_WORKERS sets the number of worker processes. DETECTFX_JOB_QUEUE
+sets how many jobs may wait behind them before submit() refuses new work.
+
+With a MemoryBudget attached, a dispatcher thread holds each job back until
+a worker is free and the job's estimated memory fits in the budget. Workers
+report their measured peak, which goes back to the budget for comparison.
+
+With warm_up=True every worker runs scripts.warmup.render_path() as it
+starts, and start_workers() starts them before the first job arrives. Once
+they are up, the budget measures their idle footprint (see src/admission.py).
+"""
+import collections
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent import futures
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from scripts import instrument
+
+JOB_WORKERS = int(os.getenv("DETECTFX_JOB_WORKERS", "1"))
+JOB_QUEUE_DEPTH = int(os.getenv("DETECTFX_JOB_QUEUE", "8"))
+# Finished jobs are forgotten after this many seconds
+JOB_TTL = int(os.getenv("DETECTFX_JOB_TTL", "3600"))
+
+# Stages generate() reports, in order
+STAGES = ["downloading", "analysing", "processing", "touchups", "loudness", "encoding", "uploading"]
+
+# Set in each worker process by _init_worker
+_progress_queue = None
+
+
+class QueueFull(Exception):
+    """No room for another job; the caller should retry later."""
+
+
+def _init_worker(progress_queue, warm_up=False):
+    global _progress_queue
+    _progress_queue = progress_queue
+    if warm_up:
+        from scripts import warmup
+        warmup.warm_up(warmup.render_path)
+
+
+def _ready():
+    return os.getpid()
+
+
+def _report(job_id, stage):
+    _progress_queue.put((job_id, stage, time.time()))
+
+
+def _run_job(job_id, clean_link, reference_link, output_link, output_format=None, bit_depth=None,
+             reverb_preset=None):
+    """Worker entry point; returns generate()'s output summary."""
+    from scripts.audiotest import generate
+    from src.admission import PeakSampler
+    _report(job_id, "started")
+    with PeakSampler() as sampler:
+        try:
+            return generate(clean_link, reference_link, output_link,
+                            progress=lambda stage: _report(job_id, stage),
+                            output_format=output_format, bit_depth=bit_depth, reverb_preset=reverb_preset)
+        finally:
+            _progress_queue.put((job_id, "memory", sampler.peak_mb))
+
+
+class JobQueue:
+    """Submits render jobs to the worker pool and tracks their status."""
+
+    def __init__(self, workers=JOB_WORKERS, queue_depth=JOB_QUEUE_DEPTH, budget=None, warm_up=False):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.budget = budget
+        self.warm_up = warm_up
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._progress = None
+        self._listener = None
+        # Jobs waiting for a worker and for memory, used with a budget
+        self._pending = collections.deque()
+        self._pending_ready = threading.Condition(self._lock)
+        self._free_workers = threading.Semaphore(workers)
+        self._dispatcher = None
+        self._stopping = False
+
+    def _start(self):
+        # spawn, not fork: the server process has threads running
+        context = multiprocessing.get_context("spawn")
+        if self._progress is None:
+            self._progress = context.Queue()
+            self._listener = threading.Thread(target=self._listen, name="job-progress", daemon=True)
+            self._listener.start()
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                         initializer=_init_worker, initargs=(self._progress, self.warm_up))
+
+    def _listen(self):
+        while True:
+            message = self._progress.get()
+            if message is None:
+                return
+            job_id, stage, at = message
+            if stage == "memory":
+                self._measured(job_id, at)
+                continue
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] in ("done", "failed"):
+                    continue
+                if stage == "started":
+                    job["status"] = "running"
+                    job["started_at"] = at
+                    continue
+                job["stage"] = stage
+                job["stages"][stage] = at
+                if stage in STAGES:
+                    job["progress"] = round(STAGES.index(stage) / len(STAGES), 2)
+
+    def _measured(self, job_id, peak_mb):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["memory_peak_mb"] = round(peak_mb, 1)
+            kind, estimate = job["memory_kind"], job["memory_estimate_mb"]
+        if self.budget is not None and estimate is not None:
+            self.budget.observe(kind, estimate, peak_mb)
+
+    def _dispatch(self):
+        """Dispatcher thread: start pending jobs in order as workers and memory free up."""
+        while True:
+            with self._lock:
+                while not self._pending and not self._stopping:
+                    self._pending_ready.wait()
+                if self._stopping:
+                    return
+                job_id, args = self._pending.popleft()
+                estimate = self._jobs[job_id]["memory_estimate_mb"]
+            self._free_workers.acquire()
+            cost = self.budget.acquire(estimate) if estimate is not None else 0.0
+            with self._lock:
+                if self._stopping:
+                    self.budget.release(cost)
+                    return
+                self._jobs[job_id]["memory_reserved_mb"] = round(cost, 1)
+            print(f"[JOBS] {job_id} admitted ({cost:.0f} MB reserved)")
+            self._start_job(job_id, args, cost)
+
+    def _start_job(self, job_id, args, cost=None):
+        try:
+            try:
+                future = self._pool.submit(_run_job, job_id, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); start a fresh pool
+                print("[JOBS] Worker pool broken, restarting")
+                self._pool.shutdown(wait=False)
+                self._start()
+                future = self._pool.submit(_run_job, job_id, *args)
+        except Exception as e:
+            # The pool refused the job (shut down, args that do not pickle, a
+            # failed restart). It fails like a job that raised, which gives its
+            # worker and memory back, so the jobs behind it still run.
+            future = futures.Future()
+            future.set_exception(e)
+        future.add_done_callback(lambda f: self._finished(job_id, f, cost))
+
+    def _finished(self, job_id, future, cost=None):
+        if cost is not None:
+            # Reserved by the dispatcher
+            self.budget.release(cost)
+            self._free_workers.release()
+        with self._lock:
+            job = self._jobs[job_id]
+            job["finished_at"] = time.time()
+            error = RuntimeError("cancelled") if future.cancelled() else future.exception()
+            if error is None:
+                job["status"] = "done"
+                job["stage"] = "done"
+                job["progress"] = 1.0
+                # Format, size, encode time, seconds per stage and the stage trace
+                job["output"] = future.result()
+                trace = (job["output"] or {}).get("trace")
+            else:
+                job["status"] = "failed"
+                job["error"] = str(error) or type(error).__name__
+        if error is None:
+            # The worker traced the render; the histograms live in this process
+            if trace:
+                instrument.record(trace)
+            print(f"[JOBS] {job_id} done")
+        else:
+            print(f"[JOBS] {job_id} failed: {error}")
+
+    def _prune(self):
+        cutoff = time.time() - JOB_TTL
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job["finished_at"] is not None and job["finished_at"] < cutoff]:
+            del self._jobs[job_id]
+
+    def active(self):
+        """Jobs queued or running."""
+        with self._lock:
+            return sum(job["status"] in ("queued", "running") for job in self._jobs.values())
+
+    def submit(self, clean_link, reference_link, output_link, memory_mb=None, memory_kind=None,
+               output_format=None, bit_depth=None, reverb_preset=None):
+        """
+        Queue a render and return its job ID. Raises QueueFull when at capacity.
+        memory_mb is the job's estimated peak, reserved from the budget while it runs.
+        output_format, bit_depth and reverb_preset are passed to generate().
+        """
+        with self._lock:
+            self._prune()
+            active = sum(job["status"] in ("queued", "running") for job in self._jobs.values())
+            if active >= self.workers + self.queue_depth:
+                raise QueueFull(f"{active} jobs already queued or running")
+            if self._pool is None:
+                self._start()
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "stage": None,
+                "progress": 0.0,
+                "stages": {},
+                "output_link": output_link,
+                "output_format": output_format,
+                "output": None,
+                "error": None,
+                "memory_kind": memory_kind,
+                "memory_estimate_mb": None if memory_mb is None else round(memory_mb, 1),
+                "memory_reserved_mb": None,
+                "memory_peak_mb": None,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+            }
+            args = (clean_link, reference_link, output_link, output_format, bit_depth, reverb_preset)
+            if self.budget is not None:
+                if self._dispatcher is None:
+                    self._dispatcher = threading.Thread(target=self._dispatch, name="job-dispatch", daemon=True)
+                    self._dispatcher.start()
+                self._pending.append((job_id, args))
+                self._pending_ready.notify()
+        if self.budget is None:
+            self._start_job(job_id, args)
+        print(f"[JOBS] {job_id} queued ({active + 1} active)")
+        return job_id
+
+    def start_workers(self):
+        """Start every worker now (warming it up) instead of on the first jobs."""
+        with self._lock:
+            if self._pool is None:
+                self._start()
+            pool = self._pool
+        # The pool spawns a worker per task while none is idle
+        ready = [pool.submit(_ready) for _ in range(self.workers)]
+        print(f"[JOBS] starting {self.workers} worker(s)")
+        if self.budget is not None:
+            # The warmed-up workers' idle RSS comes off the budget
+            threading.Thread(target=self._remeasure_when_ready, args=(ready,),
+                             name="job-workers-ready", daemon=True).start()
+
+    def _remeasure_when_ready(self, ready):
+        futures.wait(ready)
+        self.budget.remeasure()
+
+    def get(self, job_id, trace=False):
+        """A copy of the job record, or None if unknown (or expired). The stage trace only with trace=True."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            record = {**job, "stages": dict(job["stages"])}
+        if record["output"] is not None and not trace:
+            record["output"] = {key: value for key, value in record["output"].items() if key != "trace"}
+        return record
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            self._stopping = True
+            self._pending.clear()
+            self._pending_ready.notify_all()
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+        self._progress.put(None)
+        self._pool = None
+        self._progress = None
@@ -1,28 +1,35 @@
 #fastapi server
-from fastapi import FastAPI, HTTPException, APIRouter
+from fastapi import FastAPI, HTTPException, APIRouter, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 import psutil
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Optional, List
 import sys
 import os
-import joblib
-import requests
+import threading
 
 # Add the parent directory (main_dir) to the Python path
 
 # Now you can import the function from scripts
-from scripts.retrieveEffects import classify, testClassify
-from scripts.audiotest import generate
+from scripts.retrieveEffects import classify_file, classify_downloaded_batch, testClassify, FEATURE_WORKERS, DecodeError
+from scripts import fetch, encoding, instrument, warmup
+from src.model_registry import ModelRegistry, MODEL_DIR
+from src.jobs import JobQueue, QueueFull
+from src import admission
 
 
 
 
 router = APIRouter()
-HEROKU_API_KEY = os.getenv("HEROKU_API_KEY")
-HEROKU_APP_NAME = os.getenv("HEROKU_APP_NAME")
-HEROKU_LINK = os.getenv("VITE_BACKEND_ENDPOINT")
-RAM_LIMIT_MB = 400
+MAX_BATCH_SIZE = int(os.getenv("DETECTFX_MAX_BATCH", "32"))
 
+# Work is admitted against one memory budget instead of restarting the dyno
+# once it is already over the limit
+budget = admission.MemoryBudget.from_env()
+
+#memory report for monitoring, the budget does the limiting
 @router.get("/watchdog")
 def watchdog():
     process = psutil.Process(os.getpid())
@@ -30,43 +37,63 @@ def watchdog():
 
     print(f"[WATCHDOG] Memory usage: {mem:.2f} MB")
 
-    if mem > RAM_LIMIT_MB:
-        print("[WATCHDOG] Memory threshold exceeded. Restarting dyno...")
-
-        if not HEROKU_API_KEY or not HEROKU_APP_NAME:
-            raise HTTPException(status_code=500, detail="Heroku credentials not set")
-
-        response = requests.delete(
-            f"https://api.heroku.com/apps/{HEROKU_APP_NAME}/dynos",
-            headers={
-                "Accept": "application/vnd.heroku+json; version=3",
-                "Authorization": f"Bearer {HEROKU_API_KEY}"
-            }
-        )
+    over = budget.limit_mb is not None and mem > budget.limit_mb
+    return {"status": "Over limit" if over else "OK", "memory": f"{mem:.2f} MB",
+            "admission": budget.stats()}
 
-        if response.status_code == 202:
-            return {"status": "Restart triggered", "memory": f"{mem:.2f} MB"}
-        else:
-            raise HTTPException(status_code=500, detail=f"Heroku restart failed: {response.text}")
 
-    return {"status": "OK", "memory": f"{mem:.2f} MB"}
+# Models load lazily on first use, or at startup with DETECTFX_WARM_MODELS=1
+models = ModelRegistry.from_env()
+ADMIN_TOKEN = os.getenv("DETECTFX_ADMIN_TOKEN")
+# /generate renders run out of band in worker processes
+jobs = JobQueue(budget=budget, warm_up=warmup.WARM_UP)
 
+# Budget and queue state, read at scrape time next to the stage histograms
+instrument.REGISTRY.gauge("detectfx_memory_budget_mb", "Memory budget for admitted work, in MB.",
+                          lambda: budget.stats()["budget_mb"])
+instrument.REGISTRY.gauge("detectfx_memory_in_use_mb", "Memory reserved by admitted work, in MB.",
+                          lambda: budget.stats()["in_use_mb"])
+instrument.REGISTRY.gauge("detectfx_admission_waiting", "Requests waiting for memory.",
+                          lambda: budget.stats()["waiting"])
+instrument.REGISTRY.gauge("detectfx_admission_timed_out", "Requests refused after waiting for memory.",
+                          lambda: budget.stats()["timed_out"])
+instrument.REGISTRY.gauge("detectfx_admission_estimate_ratio",
+                          "Mean measured / estimated peak memory per kind of work.",
+                          lambda: {(kind,): record["mean_ratio"]
+                                   for kind, record in budget.stats()["estimates"].items()},
+                          labels=("kind",))
+instrument.REGISTRY.gauge("detectfx_jobs_active", "Render jobs queued or running.", jobs.active)
 
+app = FastAPI()
+app.include_router(router)
 
-WATCHDOG_URL = f"{HEROKU_LINK}/watchdog"
+@app.on_event("startup")
+def warm_up_models():
+    if os.getenv("DETECTFX_WARM_MODELS") == "1":
+        models.warm_up()
 
-def ping_watchdog():
-    try:
-        res = requests.get(WATCHDOG_URL)
-        print("[WATCHDOG] Pinged:", res.status_code, res.json())
-    except Exception as e:
-        print("[WATCHDOG] Error:", e)
+# Imports and first calls of the classify and render paths happen now rather
+# than on the first request (DETECTFX_WARM_UP=0 turns it off). In the
+# background, so the server starts listening at once.
+@app.on_event("startup")
+def warm_up_paths():
+    if not warmup.WARM_UP:
+        return
+    threading.Thread(target=warm_up_classify, name="warm-up", daemon=True).start()
+    jobs.start_workers()
 
+def warm_up_classify():
+    warmup.warm_up(warmup.classify_path, quiet=False)
+    # What the imports added to the server process is footprint, not work
+    budget.remeasure()
 
-clf = joblib.load('./data/EGF_trained_model.pkl')
+@app.on_event("shutdown")
+async def close_http_pool():
+    await fetch.close_client()
 
-app = FastAPI()
-app.include_router(router)
+@app.on_event("shutdown")
+def stop_job_workers():
+    jobs.shutdown()
 
 app.add_middleware(
     CORSMiddleware,
@@ -83,30 +110,179 @@ app.add_middleware(
 
 class InputData(BaseModel):
     supabase_file_link:str
+    model:Optional[str] = None
+class BatchInputData(BaseModel):
+    supabase_file_links:List[str]
+    model:Optional[str] = None
 class GenerationInputData(BaseModel):
     clean_file_link:str
     reference_file_link:str
     output_file_link:str
+    # wav, flac, opus or mp3; defaults to the output link's extension
+    output_format:Optional[str] = None
+    # 16/24 (or 32 for float WAV), lossless formats only
+    bit_depth:Optional[int] = None
+    # legacy, plate, hall or spring, or a classified reverb ("Hall Reverb"); defaults to legacy
+    reverb_preset:Optional[str] = None
 
 @app.get("/")
 def homePage():
     return {"message": "hello world"}
 
+async def run_admitted(kind, estimate_mb, func, *args, measure=True):
+    """
+    Run func in the threadpool once estimate_mb fits in the memory budget, and
+    record its measured peak (unless measure=False). Raises 503 if it does not
+    fit within ADMISSION_WAIT.
+    """
+    cost = await budget.acquire_async(estimate_mb, timeout=admission.ADMISSION_WAIT)
+    if cost is None:
+        raise HTTPException(status_code=503, detail="Server is at its memory budget, try again later",
+                            headers={"Retry-After": str(admission.RETRY_AFTER)})
+    try:
+        with admission.PeakSampler() as sampler:
+            result = await run_in_threadpool(func, *args)
+    finally:
+        budget.release(cost)
+    if measure:
+        budget.observe(kind, estimate_mb, sampler.peak_mb)
+    return result
+
 #post results to frontend
-#perform classifications, return result
+#perform classifications, return result; ?trace=true adds the per-stage trace
 @app.post("/results")
-def returnResults(data:InputData):
+async def returnResults(data:InputData, trace:bool = False):
     print("Recieved post request")
     print("Classifying: ", data.supabase_file_link)
-    ping_watchdog()
-    return {"result": classify(data.supabase_file_link, clf)}
+    # Blocking calls go to the threadpool so the event loop keeps serving
+    try:
+        clf = await run_in_threadpool(models.get, data.model)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    with instrument.Trace("classify") as job_trace:
+        try:
+            with job_trace.stage("download"):
+                file_path, etag = await fetch.download_to_tempfile(data.supabase_file_link)
+        except fetch.FetchError as e:
+            raise HTTPException(status_code=502, detail=str(e))
+        # Downloads stream to disk; decoding is what needs the memory
+        estimate = admission.estimate_mb("classify", admission.probe_file(file_path))
+        try:
+            result = await run_admitted("classify", estimate, classify_file, file_path, etag, clf)
+        except HTTPException:
+            os.remove(file_path)
+            raise
+        except DecodeError as e:
+            # classify_file already deleted the file
+            raise HTTPException(status_code=422, detail=str(e))
+    if trace:
+        return {"result": result, "trace": job_trace.to_dict()}
+    return {"result": result}
 
-@app.post("/generate")
-def returnResults(data:GenerationInputData):
+#classify many files in one request, results come back in input order
+@app.post("/results/batch")
+async def returnBatchResults(data:BatchInputData, trace:bool = False):
+    print("Recieved batch post request")
+    print("Classifying", len(data.supabase_file_links), "files")
+    if not data.supabase_file_links:
+        raise HTTPException(status_code=400, detail="No files to classify")
+    if len(data.supabase_file_links) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_SIZE} files per batch")
+    try:
+        clf = await run_in_threadpool(models.get, data.model)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    with instrument.Trace("classify_batch") as job_trace:
+        # All downloads share the pooled client; failed ones are reported per item
+        with job_trace.stage("download"):
+            downloaded = [(None, None) if isinstance(result, Exception) else result
+                          for result in await fetch.download_many(data.supabase_file_links)]
+        # At most FEATURE_WORKERS files are decoded at once, so reserve for the largest ones
+        estimates = sorted((admission.estimate_mb("classify", admission.probe_file(path))
+                            for path, _ in downloaded if path is not None), reverse=True)
+        try:
+            # Decoding happens in the feature pool's processes, out of the sampler's sight
+            results = await run_admitted("classify_batch", sum(estimates[:FEATURE_WORKERS]),
+                                         classify_downloaded_batch, data.supabase_file_links, downloaded, clf,
+                                         measure=False)
+        except HTTPException:
+            for path, _ in downloaded:
+                if path is not None:
+                    os.remove(path)
+            raise
+    if trace:
+        return {"results": results, "trace": job_trace.to_dict()}
+    return {"results": results}
+
+@app.get("/models")
+def listModels():
+    return {"models": models.stats()}
+
+#per-stage time and memory histograms plus budget/queue gauges, Prometheus text format
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(instrument.render(), media_type="text/plain; version=0.0.4")
+
+#memory budget use, and estimated vs measured peaks per kind of work
+@app.get("/admission")
+def admissionStats():
+    return budget.stats()
+
+class ModelReloadData(BaseModel):
+    path:Optional[str] = None
+
+#hot swap a model version without restarting the server
+@app.post("/models/{name}/reload")
+def reloadModel(name:str, data:ModelReloadData, x_admin_token:Optional[str] = Header(default=None)):
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model reload not allowed")
+    path = data.path
+    # Only pickles from the model directory may be loaded
+    if path is not None:
+        model_dir = os.path.realpath(MODEL_DIR)
+        if os.path.commonpath([model_dir, os.path.realpath(path)]) != model_dir:
+            raise HTTPException(status_code=400, detail="Model path must be inside the model directory")
+    try:
+        return {"model": name, "stats": models.reload(name, path)}
+    except (KeyError, FileNotFoundError) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+#queue a render, poll /jobs/{job_id} for progress
+@app.post("/generate", status_code=202)
+async def returnResults(data:GenerationInputData):
     print("Recieved post request")
     print("Classifying: ", data.clean_file_link, data.reference_file_link, ", outputting to:", data.output_file_link)
-    ping_watchdog()
-    return {"result": generate(data.clean_file_link, data.reference_file_link, data.output_file_link)}
+    try:
+        output_spec = encoding.negotiate(data.output_format, data.bit_depth, data.output_file_link)
+        # Imported here, scipy.signal is not needed at start-up
+        from scripts.reverb import choose_preset
+        reverb_preset = choose_preset(data.reverb_preset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Size the job from the file headers; the worker downloads the files itself
+    try:
+        inputs = [admission.probe_bytes(*await fetch.fetch_head(link, admission.HEAD_BYTES))
+                  for link in (data.clean_file_link, data.reference_file_link)]
+    except fetch.FetchError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    kind = admission.render_kind()
+    estimate = admission.estimate_mb(kind, *inputs)
+    print(f"[ADMISSION] {kind} of {sum(info.duration for info in inputs):.1f}s of audio, estimated {estimate:.0f} MB")
+    try:
+        job_id = jobs.submit(data.clean_file_link, data.reference_file_link, data.output_file_link,
+                             memory_mb=estimate, memory_kind=kind,
+                             output_format=output_spec.format.name, bit_depth=output_spec.bit_depth,
+                             reverb_preset=reverb_preset)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(admission.RETRY_AFTER)})
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}", **output_spec.describe()}
+
+@app.get("/jobs/{job_id}")
+def jobStatus(job_id:str, trace:bool = False):
+    job = jobs.get(job_id, trace=trace)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
 
 @app.post("/testresults")
 def returnResults(data:InputData):
@@ -0,0 +1,161 @@
+"""
+Named classifier models, loaded lazily (or at warm-up) and hot-swappable.
+
+Models are loaded with joblib's mmap_mode so the NumPy arrays inside an
+uncompressed pickle are memory-mapped read-only: every uvicorn worker then
+shares the same page-cache pages instead of holding a private copy.
+Compressed pickles cannot be mapped; joblib falls back to a normal load and
+stats() reports mmap=False for them. export_for_mmap() rewrites a model
+uncompressed so it can be mapped.
+"""
+import os
+import threading
+import time
+import warnings
+
+import joblib
+import psutil
+
+MODEL_DIR = os.getenv("DETECTFX_MODEL_DIR", "./data")
+DEFAULT_MODELS = f"default={os.path.join(MODEL_DIR, 'EGF_trained_model.pkl')}"
+
+
+def _rss_bytes():
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+class LoadedModel:
+    """A loaded model plus the numbers reported by /models."""
+
+    def __init__(self, name, path, model, load_seconds, resident_bytes, mmap):
+        self.name = name
+        self.path = path
+        self.model = model
+        self.load_seconds = load_seconds
+        self.resident_bytes = resident_bytes
+        self.mmap = mmap
+        self.loaded_at = time.time()
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "loaded": True,
+            "load_seconds": round(self.load_seconds, 4),
+            "resident_mb": round(self.resident_bytes / 1024 / 1024, 2),
+            "mmap": self.mmap,
+            "loaded_at": self.loaded_at,
+        }
+
+
+def load_model(name, path, mmap_mode="r"):
+    """joblib.load with mmap, timing the load and the RSS it added."""
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        model = joblib.load(path, mmap_mode=mmap_mode)
+    load_seconds = time.perf_counter() - start
+    # joblib warns when the file is compressed and cannot be memory-mapped
+    mmap = mmap_mode is not None and not any("mmap" in str(w.message) for w in caught)
+    resident = max(0, _rss_bytes() - rss_before)
+    print(f"[MODELS] Loaded '{name}' from {path} in {load_seconds:.2f}s "
+          f"(+{resident / 1024 / 1024:.1f} MB, mmap={mmap})")
+    return LoadedModel(name, path, model, load_seconds, resident, mmap)
+
+
+def export_for_mmap(src_path, dst_path):
+    """Rewrite a (possibly compressed) model pickle uncompressed so it can be mapped."""
+    joblib.dump(joblib.load(src_path), dst_path, compress=0)
+
+
+class ModelRegistry:
+    """Thread-safe name -> model mapping with lazy loading and hot swap."""
+
+    def __init__(self, mmap_mode="r"):
+        self.mmap_mode = mmap_mode
+        self.default = None
+        self._paths = {}
+        self._models = {}
+        self._lock = threading.RLock()
+        self._loading = {}
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build a registry from DETECTFX_MODELS, a comma separated list of
+        name=path entries. The first entry is the default model.
+        """
+        registry = cls()
+        spec = os.getenv("DETECTFX_MODELS", DEFAULT_MODELS)
+        for entry in spec.split(","):
+            if not entry.strip():
+                continue
+            name, _, path = entry.partition("=")
+            registry.register(name.strip(), path.strip())
+        return registry
+
+    def register(self, name, path, default=False):
+        with self._lock:
+            self._paths[name] = path
+            if default or self.default is None:
+                self.default = name
+
+    def names(self):
+        with self._lock:
+            return list(self._paths)
+
+    def _name_lock(self, name):
+        with self._lock:
+            return self._loading.setdefault(name, threading.Lock())
+
+    def get(self, name=None):
+        """Return the model registered as `name` (default model if None), loading it on first use."""
+        name = name or self.default
+        with self._lock:
+            if name not in self._paths:
+                raise KeyError(f"Unknown model '{name}'")
+            loaded = self._models.get(name)
+        if loaded is not None:
+            return loaded.model
+
+        # Only one thread loads a given model; others wait for it
+        with self._name_lock(name):
+            with self._lock:
+                loaded = self._models.get(name)
+                path = self._paths[name]
+            if loaded is None:
+                loaded = load_model(name, path, self.mmap_mode)
+                with self._lock:
+                    self._models[name] = loaded
+        return loaded.model
+
+    def warm_up(self, names=None):
+        """Load models ahead of the first request."""
+        for name in names or self.names():
+            self.get(name)
+
+    def reload(self, name, path=None):
+        """
+        Hot swap: load the new version next to the old one, then replace it.
+        Requests already holding the old model finish with it.
+        """
+        with self._lock:
+            if name not in self._paths and path is None:
+                raise KeyError(f"Unknown model '{name}'")
+            path = path or self._paths[name]
+        loaded = load_model(name, path, self.mmap_mode)
+        with self._lock:
+            self._paths[name] = path
+            self._models[name] = loaded
+            if self.default is None:
+                self.default = name
+        return loaded.stats()
+
+    def stats(self):
+        with self._lock:
+            report = {}
+            for name, path in self._paths.items():
+                loaded = self._models.get(name)
+                report[name] = loaded.stats() if loaded else {"path": path, "loaded": False}
+                report[name]["default"] = name == self.default
+            return report
@@ -0,0 +1,35 @@
+"""The float32 effect chain against the pydub AudioSegment chain it replaced."""
+import numpy as np
+import pytest
+
+pydub = pytest.importorskip("pydub")
+
+from benchmarks.signals import plucked_take
+from scripts import dsp, waveshaper
+from scripts.audiobuffer import AudioBuffer
+
+
+def effect_chain_pydub(samples, sr, effect_chain):
+    """The original apply_effect_chain: int16 AudioSegments, gain and distortion only."""
+    x = samples / np.max(np.abs(samples))
+    x = waveshaper.hard_clip(x.astype(np.float32), threshold=dsp.HARD_CLIP_THRESHOLD)
+    audio = pydub.AudioSegment((x * 32767).astype(np.int16).tobytes(), frame_rate=sr, sample_width=2, channels=1)
+    for effect in effect_chain:
+        if effect["effect"] == "gain":
+            audio = audio + effect["amount_db"]
+        elif effect["effect"] == "distortion":
+            audio = (audio + 10).compress_dynamic_range()
+    return np.array(audio.get_array_of_samples(), dtype=np.float32) / 32767
+
+
+def test_gain_and_distortion_clip_like_pydub():
+    sr = 22050
+    x = plucked_take(1.0, sr, seed=3)
+    chain = [{"effect": "gain", "amount_db": 6}, {"effect": "distortion", "intensity": "light"}]
+    out = dsp.apply_effect_chain(AudioBuffer(x.copy(), sr), chain).samples
+    expected = effect_chain_pydub(x, sr, chain)
+    assert np.max(np.abs(out)) <= 1.0
+    out, expected = out / np.max(np.abs(out)), expected / np.max(np.abs(expected))
+    # 16-bit rounding of every pydub step is all that is left
+    assert 20 * np.log10(np.sqrt(np.mean((out - expected) ** 2))) < -60
+    np.testing.assert_allclose(out, expected, rtol=0, atol=2e-3)
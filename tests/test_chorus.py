@@ -0,0 +1,48 @@
+"""The chorus: interpolation="none" reproduces the original generate() loop, and blocking never changes the output."""
+import numpy as np
+import pytest
+from scipy.signal import sawtooth
+
+from benchmarks.signals import noise
+from scripts import chorus
+
+
+def chorus_loop(signal, sr, depth_ms=30, rate_hz=0.5):
+    """The original apply_chorus from generate()."""
+    depth_samples = int((depth_ms / 1000) * sr)
+    mod = (sawtooth(2 * np.pi * rate_hz * np.arange(len(signal)) / sr) + 1) / 2
+    mod *= depth_samples
+
+    chorus_signal = np.zeros_like(signal)
+    for i in range(len(signal)):
+        delay = int(mod[i])
+        if i - delay >= 0:
+            chorus_signal[i] = signal[i - delay]
+    return (signal + chorus_signal) / 2
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("sr,depth_ms,rate_hz", [(8000, 30, 0.5), (22050, 30, 0.5), (11025, 12, 2.0)])
+def test_no_interpolation_matches_loop(dtype, sr, depth_ms, rate_hz):
+    # Long enough for a few LFO cycles, where the truncated delays wrap
+    x = noise(int(2.5 / rate_hz * sr), dtype)
+    expected = chorus_loop(x, sr, depth_ms, rate_hz)
+    np.testing.assert_array_equal(chorus.chorus(x, sr, depth_ms, rate_hz, interpolation="none"), expected)
+
+
+@pytest.mark.parametrize("block_size", [1, 500, 4096])
+def test_no_interpolation_matches_loop_in_blocks(block_size):
+    x = noise(8000, np.float32, seed=1)
+    expected = chorus_loop(x, 8000)
+    np.testing.assert_array_equal(chorus.chorus(x, 8000, interpolation="none", block_size=block_size), expected)
+
+
+@pytest.mark.parametrize("interpolation", chorus.INTERPOLATIONS)
+def test_streaming_blocks_match_whole(interpolation):
+    x = noise(8000, np.float64, seed=2)
+    expected = chorus.chorus(x, 8000, interpolation=interpolation)
+    stream = chorus.Chorus(8000, interpolation=interpolation)
+    # Uneven block sizes, as the streaming render may hand over
+    edges = [0, 1, 700, 701, 3000, len(x)]
+    out = np.concatenate([stream(x[a:b]) for a, b in zip(edges, edges[1:])])
+    np.testing.assert_array_equal(out, expected)
@@ -0,0 +1,45 @@
+"""The native compander against sox's compand."""
+import numpy as np
+import pytest
+
+from scripts import compander
+
+# Steady-state gain (dB) of `sox in out <COMPAND_ARGS>` on a constant input at
+# each level (dBFS), measured with libsox 14.4.2. The -70 and -60 dB corners
+# are rounded; the 0 dB one is not.
+SOX_GAINS = [
+    (-76, -5.002), (-72, -3.496), (-70, -1.338), (-68, 3.0), (-64, 19.0), (-61, 29.831),
+    (-60, 31.009), (-59, 31.839), (-57, 32.45), (-54, 31.0), (-30, 15.0), (-1, -4.333),
+]
+
+
+@pytest.mark.parametrize("level_db, gain_db", SOX_GAINS)
+def test_transfer_curve_matches_sox(level_db, gain_db):
+    params = compander.parse_compand_args()
+    curve = compander.transfer_curve(params["points"], params["knee_db"])
+    assert curve([level_db])[0] - level_db + params["gain_db"] == pytest.approx(gain_db, abs=0.005)
+
+
+def test_gain_table_matches_curve():
+    c = compander.Compander.from_args(44100)
+    envelope = np.geomspace(1e-6, 1.5, 5000)
+    level_db = 20 * np.log10(envelope)
+    expected = c.curve(level_db) - level_db + c.gain_db
+    np.testing.assert_allclose(20 * np.log10(c._gains(envelope)), expected, rtol=0, atol=1e-4)
+
+
+@pytest.mark.parametrize("attack, decay", [(0.3, 1.0), (0.001, 0.01), (0.0001, 0.0002), (0, 0.5)])
+def test_detector_matches_loop(attack, decay):
+    rng = np.random.default_rng(0)
+    x = (rng.uniform(-1, 1, 30000) * np.exp(-np.linspace(0, 6, 30000))).astype(np.float32)
+    expected = compander.Compander(44100, attack=attack, decay=decay)._loop(np.abs(x.astype(np.float64)), 10 ** (-90 / 20))
+    c = compander.Compander(44100, attack=attack, decay=decay)
+    out = np.concatenate([c._detect(x[i:i + c.chunk]) for i in range(0, len(x), c.chunk)])
+    np.testing.assert_allclose(out, expected, rtol=1e-9, atol=1e-15)
+
+
+def test_output_clips_at_full_scale():
+    x = np.full(44100, 0.9, dtype=np.float32)
+    c = compander.Compander(44100, gain_db=12)
+    out = np.concatenate([c.process(x), c.flush()])
+    assert np.max(np.abs(out)) == 1.0
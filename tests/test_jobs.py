@@ -0,0 +1,34 @@
+"""JobQueue's dispatcher when the worker pool refuses a job."""
+import time
+
+from src import admission, jobs
+
+
+def wait_for(queue, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.01)
+    return queue.get(job_id)
+
+
+def test_refused_job_fails_and_frees_its_reservation():
+    budget = admission.MemoryBudget(1000)
+    queue = jobs.JobQueue(workers=1, queue_depth=4, budget=budget)
+    queue._start()
+    # submit() on a shut down pool raises RuntimeError
+    queue._pool.shutdown()
+    try:
+        first = queue.submit("clean", "reference", "output", memory_mb=600)
+        second = queue.submit("clean", "reference", "output", memory_mb=600)
+        # The second job is only dispatched once the first gave its worker and MB back
+        for job_id in (first, second):
+            job = wait_for(queue, job_id)
+            assert job["status"] == "failed"
+            assert "shutdown" in job["error"]
+        assert budget.in_use_mb == 0
+        assert queue.active() == 0
+    finally:
+        queue.shutdown()
@@ -0,0 +1,37 @@
+"""The kaiser_best polyphase filter against librosa's resampy path."""
+import librosa
+import numpy as np
+import pytest
+
+from scripts import loader, resample
+
+
+@pytest.mark.parametrize("orig_sr, atol", [(44100, 1e-5), (16000, 1e-5), (48000, 2e-4)])
+def test_kaiser_best_matches_librosa(orig_sr, atol):
+    # resampy interpolates its filter table when the ratio is not 1/n, hence 48 kHz's looser bound
+    rng = np.random.default_rng(0)
+    x = (rng.uniform(-1, 1, 2 * orig_sr) * np.exp(-np.linspace(0, 4, 2 * orig_sr))).astype(np.float32)
+    expected = librosa.resample(x, orig_sr=orig_sr, target_sr=loader.ANALYSIS_SR, res_type="kaiser_best")
+    out = loader.resample(x, orig_sr, loader.ANALYSIS_SR, "kaiser_best")
+    assert out.dtype == np.float32
+    assert out.shape == expected.shape
+    np.testing.assert_allclose(out, expected, rtol=0, atol=atol)
+
+
+def test_kaiser_best_is_the_default():
+    assert loader.resampler_name() == "kaiser_best"
+
+
+def test_kaiser_best_taps_are_cached_read_only():
+    taps = resample.design_kaiser_best(*resample.ratio(44100, loader.ANALYSIS_SR))
+    assert taps is resample.design_kaiser_best(*resample.ratio(44100, loader.ANALYSIS_SR))
+    assert not taps.flags.writeable
+
+
+@pytest.mark.parametrize("filter", sorted(resample.FILTERS))
+@pytest.mark.parametrize("orig_sr, target_sr", [(44100, 22050), (48000, 22050), (22050, 44100)])
+def test_stream_resampler_matches_resample(filter, orig_sr, target_sr):
+    x = np.random.default_rng(1).uniform(-1, 1, orig_sr // 2).astype(np.float32)
+    process = resample.StreamResampler(orig_sr, target_sr, filter)
+    out = np.concatenate([process(x[i:i + 777]) for i in range(0, len(x), 777)] + [process.flush()])
+    np.testing.assert_array_equal(out, resample.resample(x, orig_sr, target_sr, filter=filter))
@@ -0,0 +1,76 @@
+"""reverb.reverb, its comb filter and preset plumbing; the legacy preset is held to the original comb loops."""
+import numpy as np
+import pytest
+
+from benchmarks.signals import noise
+from scripts import reverb
+
+
+def reverb_loop(signal, sr, decay=0.7, wet_level=0.3):
+    """The original apply_reverb from generate()."""
+    delay_times_ms = [12, 17, 23, 31]  # short, dense reflections
+    gains = [decay ** (i + 1) for i in range(len(delay_times_ms))]
+    out = np.zeros_like(signal)
+
+    for delay_ms, g in zip(delay_times_ms, gains):
+        delay_samples = int((delay_ms / 1000.0) * sr)
+        echo = np.zeros_like(signal)
+        for i in range(delay_samples, len(signal)):
+            echo[i] = signal[i - delay_samples] + g * echo[i - delay_samples]
+        out += echo
+
+    # Normalize reverb and mix with dry
+    out = out / (np.max(np.abs(out)) + 1e-9)
+    output = (1 - wet_level) * signal + wet_level * out
+    return output / (np.max(np.abs(output)) + 1e-9)
+
+
+@pytest.mark.parametrize("sr", [8000, 22050])
+def test_legacy_preset_matches_loop_float32(sr):
+    x = noise(sr, np.float32, decay=6)
+    out = reverb.reverb(x, sr, preset="legacy")
+    assert out.dtype == np.float32
+    # Within one float32 ulp of full scale: lfilter rounds the recursion
+    # differently from the loop, and the output peaks at 1
+    np.testing.assert_allclose(out, reverb_loop(x, sr), rtol=0, atol=np.finfo(np.float32).eps)
+
+
+def test_legacy_preset_matches_loop_float64():
+    x = noise(8000, np.float64, seed=1, decay=6)
+    np.testing.assert_allclose(reverb.reverb(x, 8000, preset="legacy"), reverb_loop(x, 8000), rtol=1e-12, atol=1e-12)
+
+
+def test_legacy_overrides_match_loop():
+    x = noise(4000, np.float64, seed=2, decay=6)
+    np.testing.assert_allclose(reverb.reverb(x, 8000, preset="legacy", decay=0.5, wet_level=0.6),
+                               reverb_loop(x, 8000, decay=0.5, wet_level=0.6), rtol=1e-12, atol=1e-12)
+
+
+def test_comb_filter_matches_recursion():
+    x = noise(800, np.float64, seed=3, decay=6)
+    delay, gain = 37, 0.8
+    expected = np.zeros_like(x)
+    for i in range(delay, len(x)):
+        expected[i] = x[i - delay] + gain * expected[i - delay]
+    np.testing.assert_allclose(reverb.comb_filter(x, delay, gain), expected, rtol=1e-12, atol=1e-12)
+
+
+def test_choose_preset():
+    assert reverb.choose_preset() == "legacy"
+    assert reverb.choose_preset("spring") == "spring"
+    assert reverb.choose_preset("Hall Reverb") == "hall"
+    with pytest.raises(ValueError):
+        reverb.choose_preset("Cathedral")
+
+
+@pytest.mark.parametrize("preset", sorted(reverb.PRESETS))
+def test_chain_reverbs_carry_the_preset(preset):
+    from scripts import dsp
+
+    mfcc = np.zeros((13, 10))
+    # Flatness up and RMS down: map_delta_to_dsp adds its reverb
+    delta = np.array([100.0, -0.1, 0.0, 0.2, 1.0])
+    chain = dsp.map_delta_to_dsp(delta, mfcc, mfcc, reverb_preset=preset)
+    reverbs = [effect for effect in chain if effect["effect"] == "reverb"]
+    assert reverbs
+    assert all(effect["preset"] == preset for effect in reverbs)
@@ -0,0 +1,72 @@
+"""FileStorage, and generate() running end to end on it without a network."""
+import io
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from benchmarks.signals import plucked_take, reference_take, write_take
+from scripts import feature_cache, storage
+
+PUBLIC = "https://offline.invalid/storage/v1/object/public/detectfx-bucket/"
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    file_storage = storage.FileStorage(str(tmp_path))
+    monkeypatch.setattr(storage, "_storage", file_storage)
+    # A cold, private feature cache, so analysis really runs
+    monkeypatch.setattr(feature_cache, "_default_cache", feature_cache.FeatureCache(str(tmp_path / "features")))
+    return file_storage
+
+
+def test_upload_and_open_round_trip(store):
+    store.upload("takes/a.bin", b"bytes body")
+    store.upload("takes/b.bin", io.BytesIO(b"file body"))
+    with store.open("takes/a.bin") as f:
+        assert f.read() == b"bytes body"
+
+    files = storage.fetch_many(store, ["takes/b.bin", "takes/a.bin"])
+    assert [f.read() for f in files] == [b"file body", b"bytes body"]
+    for f in files:
+        f.close()
+
+
+def test_upload_replaces_and_leaves_no_temp_files(store):
+    store.upload("a.bin", b"first")
+    store.upload("a.bin", b"second")
+    with store.open("a.bin") as f:
+        assert f.read() == b"second"
+    assert os.listdir(store.root) == ["a.bin"]
+
+
+def test_missing_and_escaping_paths(store):
+    with pytest.raises(storage.StorageError):
+        store.open("nope.wav")
+    with pytest.raises(storage.StorageError):
+        store.upload("../outside.bin", b"x")
+    store.upload("a.bin", b"x")
+    # One failed download fails the batch
+    with pytest.raises(storage.StorageError):
+        storage.fetch_many(store, ["a.bin", "nope.wav"])
+
+
+@pytest.mark.parametrize("render_mode", ["whole", "stream"])
+def test_generate_round_trip(store, render_mode):
+    from scripts.audiotest import generate
+
+    sr = 22050
+    os.makedirs(os.path.join(store.root, "in"))
+    write_take(os.path.join(store.root, "in", "clean.wav"), plucked_take(3, sr, seed=7), sr)
+    write_take(os.path.join(store.root, "in", "reference.wav"), reference_take(4, sr, seed=8, channels=2), sr)
+
+    output = generate(PUBLIC + "in/clean.wav", PUBLIC + "in/reference.wav", f"out/{render_mode}.wav",
+                      render_mode=render_mode)
+
+    assert output["format"] == "wav"
+    with store.open(f"out/{render_mode}.wav") as f:
+        rendered, rendered_sr = sf.read(f)
+    assert rendered_sr == sr
+    assert 0 < len(rendered) <= 3 * sr
+    assert np.all(np.isfinite(rendered)) and np.max(np.abs(rendered)) > 0
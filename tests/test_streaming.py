@@ -0,0 +1,108 @@
+"""The block-streaming render against the whole-file chain it mirrors."""
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from benchmarks.signals import plucked_take, reference_take, write_take
+from scripts import compander, dsp, spool, streaming
+from scripts.analysis import AnalysisContext
+
+SR = 22050
+# The stream skips scalings a later peak normalization undoes, so the two
+# agree to float64 round-off (about 1e-13), not bit for bit
+TOLERANCE = 1e-9
+
+CHAINS = {
+    "core": [],
+    "chorus_reverb": [{"effect": "chorus"}, {"effect": "reverb"}],
+    "hall_reverb": [{"effect": "reverb", "preset": "hall"}],
+    "segment_effects": [{"effect": "lowpass", "cutoff": 3000}, {"effect": "highpass", "cutoff": 120},
+                        {"effect": "gain", "amount_db": 6}, {"effect": "compressor", "intensity": "light"},
+                        {"effect": "distortion"}],
+}
+
+
+def whole(samples, effect_chain, reference):
+    processed = dsp.process_full_chain(samples, SR, effect_chain)
+    processed = dsp.final_processing_touchups(processed, reference, SR)
+    return dsp.match_volume_to_reference(processed, reference, SR)
+
+
+def stream(samples, effect_chain, reference, block_size):
+    blocks = []
+    length = streaming.render(samples, SR, effect_chain, reference, blocks.append, block_size=block_size,
+                              pitch_mode="legacy")
+    out = np.concatenate(blocks)
+    assert len(out) == length
+    return out
+
+
+@pytest.fixture(autouse=True)
+def native_compander(monkeypatch):
+    # Both paths on the in-process compander, whatever DETECTFX_COMPANDER says
+    monkeypatch.setattr(compander, "BACKEND", "native")
+    monkeypatch.setenv("DETECTFX_PITCH_MODE", "legacy")
+
+
+@pytest.mark.parametrize("chain", sorted(CHAINS))
+@pytest.mark.parametrize("block_size", [1000, 8192])
+def test_stream_matches_whole(chain, block_size):
+    samples = plucked_take(4, SR, seed=3)
+    # Longer than the clean take, so the alignment search runs too
+    reference = reference_take(6, SR, seed=4)
+    expected = whole(samples, CHAINS[chain], reference)
+    np.testing.assert_allclose(stream(samples, CHAINS[chain], reference, block_size), expected,
+                               rtol=0, atol=TOLERANCE)
+
+
+def test_stream_matches_whole_with_short_reference():
+    samples = plucked_take(4, SR, seed=5)
+    reference = reference_take(3, SR, seed=6)
+    expected = whole(samples, CHAINS["core"], reference)
+    np.testing.assert_allclose(stream(samples, CHAINS["core"], reference, 4096), expected, rtol=0, atol=TOLERANCE)
+
+
+def test_stream_from_spools_matches_arrays():
+    samples = plucked_take(4, SR, seed=7)
+    reference = reference_take(6, SR, seed=8)
+    # The reference as a trimmed job input is a slice of its spool
+    spooled_reference = spool.write([np.zeros(3000, dtype=np.float32), reference]).slice(3000)
+    expected = stream(samples, CHAINS["chorus_reverb"], reference, 4096)
+    out = stream(spool.write([samples]), CHAINS["chorus_reverb"], spooled_reference, 4096)
+    np.testing.assert_array_equal(out, expected)
+
+
+@pytest.mark.parametrize("orig_sr", [SR, 44100])
+def test_spooled_analysis_matches_in_memory(tmp_path, orig_sr):
+    clean = write_take(tmp_path / "clean.wav", plucked_take(5, orig_sr, seed=9, channels=2), orig_sr)
+    take = reference_take(7, orig_sr, seed=10)
+    take[:20000] *= 1e-3
+    reference = write_take(tmp_path / "reference.wav", take, orig_sr)
+
+    products, keys = [], []
+    for spooled in (False, True):
+        job = AnalysisContext()
+        guitar = job.add("reference", reference, spooled).trimmed()
+        at_rate = guitar.at_rate(22050)
+        products.append((job.add("clean", clean, spooled).tone_vector(), guitar.tone_vector(),
+                         job["reference"].mfcc(), len(guitar.samples),
+                         at_rate.samples if not spooled else at_rate.samples.read()))
+        keys.append(job["reference"].cache_key)
+    for in_memory, spooled in zip(*products):
+        np.testing.assert_allclose(spooled, in_memory, rtol=1e-6, atol=1e-4)
+    # Same PCM, same feature cache entry
+    assert keys[0] == keys[1]
+
+
+def test_stream_memory_does_not_grow_with_the_take():
+    peaks = []
+    for seconds in (8, 32):
+        samples = spool.write([plucked_take(seconds, SR, seed=11)])
+        reference = spool.write([reference_take(seconds + 2, SR, seed=12)])
+        tracemalloc.start()
+        streaming.render(samples, SR, CHAINS["chorus_reverb"], reference, lambda block: None, block_size=4096,
+                         pitch_mode="legacy")
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert peaks[1] < 1.5 * peaks[0]
@@ -0,0 +1,91 @@
+"""waveshaper.fuzz, soft_clip and hard_clip, checked against the original per-sample code."""
+import numpy as np
+import pytest
+
+from benchmarks.signals import noise
+from scripts import waveshaper
+
+
+def fuzz_loop(signal, shape=40, hard_limit_db=-25, wet_db=0, dry_db=-60):
+    """The original fuzz_distortion loop from generate()."""
+    maxv = 2 ** (hard_limit_db / 6)
+    s11 = shape - 1
+    wet = 2 ** (wet_db / 6)
+    dry = 2 ** (dry_db / 6)
+
+    output = []
+    for s in signal:
+        a = abs(s)
+        s0 = s * (a + shape) / (a * (a + s11) + 1)
+        clipped = np.clip(s0, -maxv, maxv)
+        output.append(clipped * wet + s * dry)
+
+    return np.array(output)
+
+
+def signal(dtype, n=20000):
+    x = noise(n, dtype, decay=4)
+    # Exact zeros and full scale are the edges of the curve
+    x[:3] = [0.0, 1.0, -1.0]
+    return x
+
+
+FUZZ_SETTINGS = [
+    {},
+    {"shape": 10, "hard_limit_db": -10, "wet_db": 0, "dry_db": -20},
+    {"shape": 20, "hard_limit_db": -25, "wet_db": -3, "dry_db": -60},
+]
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("settings", FUZZ_SETTINGS)
+def test_fuzz_matches_loop(dtype, settings):
+    x = signal(dtype)
+    expected = fuzz_loop(x, **settings)
+    out = waveshaper.fuzz(x, **settings)
+    assert out.dtype == dtype
+    np.testing.assert_allclose(out, expected, rtol=0, atol=waveshaper.FUZZ_TOLERANCE)
+
+
+@pytest.mark.parametrize("block_size", [1, 777, 65536])
+def test_fuzz_in_place_and_out_match_loop(block_size):
+    x = signal(np.float32, n=5000)
+    expected = fuzz_loop(x, shape=10, hard_limit_db=-10, dry_db=-20)
+
+    out = np.empty_like(x)
+    waveshaper.fuzz(x, shape=10, hard_limit_db=-10, dry_db=-20, out=out, block_size=block_size)
+    np.testing.assert_allclose(out, expected, rtol=0, atol=waveshaper.FUZZ_TOLERANCE)
+
+    result = waveshaper.fuzz(x, shape=10, hard_limit_db=-10, dry_db=-20, in_place=True, block_size=block_size)
+    assert result is x
+    np.testing.assert_allclose(x, expected, rtol=0, atol=waveshaper.FUZZ_TOLERANCE)
+
+
+def test_fuzz_converts_integer_input():
+    x = np.array([0, 1, -1, 2], dtype=np.int16)
+    np.testing.assert_allclose(waveshaper.fuzz(x), fuzz_loop(x.astype(np.float32)),
+                               rtol=0, atol=waveshaper.FUZZ_TOLERANCE)
+    with pytest.raises(TypeError):
+        waveshaper.fuzz(x, in_place=True)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("drive", [3, 5, 6])
+def test_soft_clip_matches_tanh(dtype, drive):
+    x = signal(dtype)
+    # The original soft_clip: np.tanh(drive * signal)
+    expected = np.tanh(drive * x)
+    np.testing.assert_allclose(waveshaper.soft_clip(x, drive=drive), expected,
+                               rtol=0, atol=waveshaper.FUZZ_TOLERANCE)
+    np.testing.assert_allclose(waveshaper.soft_clip(x.copy(), drive=drive, in_place=True), expected,
+                               rtol=0, atol=waveshaper.FUZZ_TOLERANCE)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_hard_clip_matches_clip(dtype):
+    x = signal(dtype)
+    # The original hard_clip: np.clip(signal, -threshold, threshold)
+    expected = np.clip(x, -0.26, 0.26)
+    np.testing.assert_allclose(waveshaper.hard_clip(x), expected, rtol=0, atol=waveshaper.FUZZ_TOLERANCE)
+    np.testing.assert_allclose(waveshaper.hard_clip(x.copy(), in_place=True), expected,
+                               rtol=0, atol=waveshaper.FUZZ_TOLERANCE)